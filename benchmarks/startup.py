@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Measures how quickly Mirage gets going on a large folder tree.
+
+For each size, a tree of small png files is created (1000 images per
+subfolder), and Mirage is started on it with -R in a separate process.
+Three times are reported, counted from when Mirage reads its config:
+
+	first pixel   the first image has been put into the window
+	navigable     the user can move to another image
+	complete      the whole tree has been scanned
+
+Each tree gets its own config and cache dirs (XDG_CONFIG_HOME and
+XDG_CACHE_HOME), so the scan cache and the thumbnails of the user are
+left alone. With --cache, Mirage is started a second time on the same
+tree, with the scan cache written by the first run.
+
+Usage: python benchmarks/startup.py [--sizes 1000,10000,100000] [--cache] [--keep]
+"""
+
+import os, sys, getopt, time, json, shutil, tempfile, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGES_PER_FOLDER = 1000
+
+def make_tree(path, count):
+	import pygtk
+	pygtk.require('2.0')
+	import gtk
+	sample = os.path.join(path, 'sample.png')
+	pix = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, False, 8, 64, 48)
+	pix.fill(0x336699ff)
+	pix.save(sample, 'png')
+	tree = os.path.join(path, 'tree')
+	for i in range(count):
+		folder = os.path.join(tree, 'folder%04d' % (i // IMAGES_PER_FOLDER))
+		if i % IMAGES_PER_FOLDER == 0:
+			os.makedirs(folder)
+		target = os.path.join(folder, 'img%06d.png' % i)
+		try:
+			os.link(sample, target)
+		except OSError:
+			shutil.copyfile(sample, target)
+	return tree
+
+def run_child(tree):
+	# Runs Mirage on tree and prints the times as json
+	sys.path.insert(0, ROOT)
+	import mirage
+	times = {}
+	start = [None]
+	def mark(name):
+		if name not in times:
+			times[name] = time.time() - start[0]
+	orig_read_config = mirage.Base.read_config_and_set_settings
+	def read_config_and_set_settings(self):
+		start[0] = time.time()
+		return orig_read_config(self)
+	orig_put = mirage.Base.put_zoom_image_to_window
+	def put_zoom_image_to_window(self, *args, **kwargs):
+		result = orig_put(self, *args, **kwargs)
+		mark('first pixel')
+		return result
+	orig_sensitivities = mirage.Base.set_go_navigation_sensitivities
+	def set_go_navigation_sensitivities(self, *args, **kwargs):
+		result = orig_sensitivities(self, *args, **kwargs)
+		if self.image_loaded and len(self.image_list) > 1 and self.curr_img_in_list >= 0:
+			mark('navigable')
+		return result
+	mirage.Base.read_config_and_set_settings = read_config_and_set_settings
+	mirage.Base.put_zoom_image_to_window = put_zoom_image_to_window
+	mirage.Base.set_go_navigation_sensitivities = set_go_navigation_sensitivities
+	sys.argv = ['mirage', '-R', tree]
+	base = mirage.Base()
+	mark('complete')
+	times['images'] = len(base.image_list)
+	print json.dumps(times)
+
+def main():
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], "", ["sizes=", "cache", "keep", "child="])
+	except getopt.GetoptError:
+		print __doc__
+		sys.exit(2)
+	sizes = [1000, 10000, 100000]
+	use_cache = False
+	keep = False
+	for o, a in opts:
+		if o == "--child":
+			run_child(a)
+			return
+		elif o == "--sizes":
+			sizes = [int(size) for size in a.split(',')]
+		elif o == "--cache":
+			use_cache = True
+		elif o == "--keep":
+			keep = True
+	runs = ["cold"]
+	if use_cache:
+		runs.append("cached")
+	print "%8s %6s %13s %13s %13s" % ("files", "run", "first pixel", "navigable", "complete")
+	for size in sizes:
+		path = tempfile.mkdtemp(prefix="mirage-bench-")
+		try:
+			tree = make_tree(path, size)
+			env = dict(os.environ)
+			env['XDG_CONFIG_HOME'] = os.path.join(path, 'config')
+			env['XDG_CACHE_HOME'] = os.path.join(path, 'cache')
+			for run in runs:
+				output = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', tree], stdout=subprocess.PIPE, env=env).communicate()[0]
+				times = json.loads(output.strip().splitlines()[-1])
+				print "%8i %6s %12.3fs %12.3fs %12.3fs" % (times['images'], run, times.get('first pixel', -1), times.get('navigable', -1), times['complete'])
+		finally:
+			if keep:
+				print "Kept %s" % path
+			else:
+				shutil.rmtree(path)
+
+if __name__ == "__main__":
+	main()
@@ -1,236 +1,174 @@
 #include "Python.h"
+#include <string.h>
+#include <pygobject.h>
+#include <gdk-pixbuf/gdk-pixbuf.h>
+
+/**
+ * The pixels of a source pixbuf and of the destination pixbuf that the
+ * transformed image is written to
+ */
+typedef struct
+{
+	const guchar *a1;
+	guchar *a2;
+	int w1, h1;
+	int rws1, rws2;
+	int psz;
+} Transform;
+
 /**
- * copy length chars from source to dest
+ * get the GdkPixbuf wrapped by obj, or set an exception and return NULL
  */
-void copy(char *dest, const char *source, const int length)
+static GdkPixbuf *get_pixbuf(PyObject *obj)
 {
-	int i;
-	for(i=0; i< length; i++, dest++, source++)
-		*dest = *source;
+	if(!PyObject_TypeCheck(obj, &PyGObject_Type) || !GDK_IS_PIXBUF(pygobject_get(obj)))
+	{
+		PyErr_SetString(PyExc_TypeError, "expected a gtk.gdk.Pixbuf");
+		return NULL;
+	}
+	return GDK_PIXBUF(pygobject_get(obj));
 }
 
-/* Wrapper methods */
-PyObject *rotate_right(PyObject *self, PyObject *args)
+/**
+ * parse the (source, destination) pixbufs of a transform into t; the
+ * destination has width and height swapped if rotate is set
+ */
+static int get_transform(PyObject *args, Transform *t, int rotate)
 {
-	char *a1;
-	char *a2;
-	int length;
-	int w1, w2;
-	int h1, h2;
-	int rws1, rws2;
-	int psz;
-	int i1, i2;
-	int x1, y1;
-	PyObject *ret;
-	
+	PyObject *o1, *o2;
+	GdkPixbuf *p1, *p2;
+	int w2, h2;
+
 	/* Get Python Arguments */
-	if(!PyArg_ParseTuple(args, "z#iiii", &a1, &length, &w1, &h1, &rws1, &psz)) 
+	if(!PyArg_ParseTuple(args, "OO", &o1, &o2))
+		return 0;
+	if(!(p1 = get_pixbuf(o1)) || !(p2 = get_pixbuf(o2)))
+		return 0;
+
+	t->w1 = gdk_pixbuf_get_width(p1);
+	t->h1 = gdk_pixbuf_get_height(p1);
+	w2 = gdk_pixbuf_get_width(p2);
+	h2 = gdk_pixbuf_get_height(p2);
+	if(p1 == p2
+		|| gdk_pixbuf_get_n_channels(p1) != gdk_pixbuf_get_n_channels(p2)
+		|| gdk_pixbuf_get_bits_per_sample(p1) != 8
+		|| gdk_pixbuf_get_bits_per_sample(p2) != 8
+		|| (rotate ? (w2 != t->h1 || h2 != t->w1) : (w2 != t->w1 || h2 != t->h1)))
 	{
-		return NULL;
+		PyErr_SetString(PyExc_ValueError, "destination pixbuf does not fit the source pixbuf");
+		return 0;
 	}
-	
-	/* Do the mirroring */
-	w2 = h1;
-	h2 = w1;
-	
-	if(w2 % 4 != 0)
-		rws2 = ((w2/4 + 1) * 4) * psz;
-	else
-		rws2 = w2 * psz;
-
-	length = rws2 * h2;
-	a2 = malloc(length);
-	
-	for(x1=0; x1<w1; x1++)
+	t->a1 = gdk_pixbuf_get_pixels(p1);
+	t->a2 = gdk_pixbuf_get_pixels(p2);
+	t->rws1 = gdk_pixbuf_get_rowstride(p1);
+	t->rws2 = gdk_pixbuf_get_rowstride(p2);
+	t->psz = gdk_pixbuf_get_n_channels(p1);
+	return 1;
+}
+
+/* Wrapper methods: each writes the transformed source pixbuf straight
+ * into the destination pixbuf, without copying the pixels in between */
+PyObject *rotate_right(PyObject *self, PyObject *args)
+{
+	Transform t;
+	int x1, y1;
+
+	if(!get_transform(args, &t, 1))
+		return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	for(y1=0; y1<t.h1; y1++)
 	{
-		for(y1=0; y1<h1; y1++)
+		for(x1=0; x1<t.w1; x1++)
 		{
-			i1 = y1 * rws1 + x1 * psz;
-			i2 = (h1 - 1 - y1) * psz + rws2 * x1;
-			copy(a2 + i2, a1 + i1, psz);
+			memcpy(t.a2 + (t.h1 - 1 - y1) * t.psz + t.rws2 * x1, t.a1 + y1 * t.rws1 + x1 * t.psz, t.psz);
 		}
 	}
-	
-	ret = Py_BuildValue("z#iii", a2, length, w2, h2, rws2);
-	free(a2);
-	
-	return ret;
+	Py_END_ALLOW_THREADS
+
+	Py_RETURN_NONE;
 }
 
 PyObject *rotate_left(PyObject *self, PyObject *args)
 {
-	char *a1;
-	char *a2;
-	int length;
-	int w1, w2;
-	int h1, h2;
-	int rws1, rws2;
-	int psz;
-	int i1, i2;
+	Transform t;
 	int x1, y1;
-	PyObject *ret;
-	
-	/* Get Python Arguments */
-	if(!PyArg_ParseTuple(args, "z#iiii", &a1, &length, &w1, &h1, &rws1, &psz)) 
-	{
+
+	if(!get_transform(args, &t, 1))
 		return NULL;
-	}
-	
-	/* Do the mirroring */
-	w2 = h1;
-	h2 = w1;
-
-	if(w2 % 4 != 0)
-		rws2 = ((w2/4 + 1) * 4) * psz;
-	else
-		rws2 = w2 * psz;
-
-	length = rws2 * h2;
-	a2 = malloc(length);
-	
-	for(x1=0; x1<w1; x1++)
+
+	Py_BEGIN_ALLOW_THREADS
+	for(y1=0; y1<t.h1; y1++)
 	{
-		for(y1=0; y1<h1; y1++)
+		for(x1=0; x1<t.w1; x1++)
 		{
-			i1 = y1 * rws1 + x1 * psz;
-			i2 = y1 * psz + rws2 * (w1 - 1 - x1);
-			copy(a2 + i2, a1 + i1, psz);
+			memcpy(t.a2 + y1 * t.psz + t.rws2 * (t.w1 - 1 - x1), t.a1 + y1 * t.rws1 + x1 * t.psz, t.psz);
 		}
 	}
-	
-	ret = Py_BuildValue("z#iii", a2, length, w2, h2, rws2);
-	free(a2);
-	
-	return ret;
+	Py_END_ALLOW_THREADS
+
+	Py_RETURN_NONE;
 }
 
 PyObject *rotate_mirror(PyObject *self, PyObject *args)
 {
-	char *a1;
-	char *a2;
-	int length;
-	int w1, w2;
-	int h1, h2;
-	int rws1, rws2;
-	int psz;
-	int i1, i2;
+	Transform t;
 	int x1, y1;
-	PyObject *ret;
-	
-	/* Get Python Arguments */
-	if(!PyArg_ParseTuple(args, "z#iiii", &a1, &length, &w1, &h1, &rws1, &psz)) 
-	{
+
+	if(!get_transform(args, &t, 0))
 		return NULL;
-	}
-	
-	/* Do the mirroring */
-	w2 = w1;
-	h2 = h1;
-	rws2 = rws1;
-
-	length = rws2 * h2;
-	a2 = malloc(length);
-	
-	for(x1=0; x1<w1; x1++)
+
+	Py_BEGIN_ALLOW_THREADS
+	for(y1=0; y1<t.h1; y1++)
 	{
-		for(y1=0; y1<h1; y1++)
+		for(x1=0; x1<t.w1; x1++)
 		{
-			i1 = y1 * rws1 + x1 * psz;
-			i2 = (w1 - 1 - x1) * psz + rws2 * (h1 - 1 - y1);
-			copy(a2 + i2, a1 + i1, psz);
+			memcpy(t.a2 + (t.w1 - 1 - x1) * t.psz + t.rws2 * (t.h1 - 1 - y1), t.a1 + y1 * t.rws1 + x1 * t.psz, t.psz);
 		}
 	}
-	
-	ret = Py_BuildValue("z#iii", a2, length, w2, h2, rws2);
-	free(a2);
-	
-	return ret;
+	Py_END_ALLOW_THREADS
+
+	Py_RETURN_NONE;
 }
 
 PyObject *flip_vert(PyObject *self, PyObject *args)
 {
-	char *a1;
-	char *a2;
-	int length;
-	int w1, w2;
-	int h1, h2;
-	int rws1, rws2;
-	int psz;
-	int i1, i2;
-	int x1, y1;
-	PyObject *ret;
-	
-	/* Get Python Arguments */
-	if(!PyArg_ParseTuple(args, "z#iiii", &a1, &length, &w1, &h1, &rws1, &psz)) 
-	{
+	Transform t;
+	int y1;
+
+	if(!get_transform(args, &t, 0))
 		return NULL;
-	}
-	
-	/* Do the mirroring */
-	w2 = w1;
-	h2 = h1;
-	rws2 = rws1;
-
-	length = rws2 * h2;
-	a2 = malloc(length);
-	
-	for(x1=0; x1<w1; x1++)
+
+	/* Rows stay the same, so they are copied whole */
+	Py_BEGIN_ALLOW_THREADS
+	for(y1=0; y1<t.h1; y1++)
 	{
-		for(y1=0; y1<h1; y1++)
-		{
-			i1 = y1 * rws1 + x1 * psz;
-			i2 = x1 * psz + rws2 * (h1 - 1 - y1);
-			copy(a2 + i2, a1 + i1, psz);
-		}
+		memcpy(t.a2 + t.rws2 * (t.h1 - 1 - y1), t.a1 + y1 * t.rws1, t.w1 * t.psz);
 	}
-	
-	ret = Py_BuildValue("z#iii", a2, length, w2, h2, rws2);
-	free(a2);
-	
-	return ret;
+	Py_END_ALLOW_THREADS
+
+	Py_RETURN_NONE;
 }
 
 PyObject *flip_horiz(PyObject *self, PyObject *args)
 {
-	char *a1;
-	char *a2;
-	int length;
-	int w1, w2;
-	int h1, h2;
-	int rws1, rws2;
-	int psz;
-	int i1, i2;
+	Transform t;
 	int x1, y1;
-	PyObject *ret;
-	
-	/* Get Python Arguments */
-	if(!PyArg_ParseTuple(args, "z#iiii", &a1, &length, &w1, &h1, &rws1, &psz)) 
-	{
+
+	if(!get_transform(args, &t, 0))
 		return NULL;
-	}
-	
-	/* Do the mirroring */
-	w2 = w1;
-	h2 = h1;
-	rws2 = rws1;
-
-	length = rws2 * h2;
-	a2 = malloc(length);
-	
-	for(x1=0; x1<w1; x1++)
+
+	Py_BEGIN_ALLOW_THREADS
+	for(y1=0; y1<t.h1; y1++)
 	{
-		for(y1=0; y1<h1; y1++)
+		for(x1=0; x1<t.w1; x1++)
 		{
-			i1 = y1 * rws1 + x1 * psz;
-			i2 = (w1 - 1 - x1) * psz + rws2 * y1;
-			copy(a2 + i2, a1 + i1, psz);
+			memcpy(t.a2 + (t.w1 - 1 - x1) * t.psz + t.rws2 * y1, t.a1 + y1 * t.rws1 + x1 * t.psz, t.psz);
 		}
 	}
-	
-	ret = Py_BuildValue("z#iii", a2, length, w2, h2, rws2);
-	free(a2);
-	
-	return ret;
+	Py_END_ALLOW_THREADS
+
+	Py_RETURN_NONE;
 }
 
 /* Method table mapping names to wrappers */
@@ -246,5 +184,8 @@ static PyMethodDef imgfuncs_methods[] = {
 /* Module initialization function */
 void initimgfuncs(void)
 {
+	init_pygobject();
+	if(PyErr_Occurred())
+		return;
 	Py_InitModule("imgfuncs", imgfuncs_methods);
 }
@@ -31,8 +31,10 @@ import gtk
 import os, sys, getopt, string, gc
 import random, urllib, gobject, gettext, locale
 import stat, time, subprocess, shutil, filecmp
-import tempfile, socket, threading, copy
+import tempfile, socket, threading, mimetypes
+import heapq, struct, errno, itertools, math, bisect, re
 from fractions import Fraction
+from collections import OrderedDict, deque
 import json
 
 gettext.install("mirage", unicode=1)
@@ -75,6 +77,32 @@ try:
 except:
 	pass
 
+# scandir() lets us tell files from directories without a stat() call per
+# entry. It is part of os from Python 3.5, and available as a separate
+# module for older versions. Fall back to os.listdir() if neither exists.
+try:
+	from os import scandir
+	HAS_SCANDIR = True
+except:
+	try:
+		from scandir import scandir
+		HAS_SCANDIR = True
+	except:
+		HAS_SCANDIR = False
+
+# inotify lets us follow changes to the opened folders without rescanning
+# them. It is reached through ctypes so that no extra module is needed; it
+# only exists on Linux.
+try:
+	import ctypes, ctypes.util
+	libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+	inotify_init1 = libc.inotify_init1
+	inotify_add_watch = libc.inotify_add_watch
+	inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+	HAS_INOTIFY = True
+except:
+	HAS_INOTIFY = False
+
 if gtk.gtk_version < (2, 10, 0):
 	sys.stderr.write(_("Mirage requires GTK+ %s or newer..\n") % "2.10.0")
 	sys.exit(1)
@@ -89,6 +117,135 @@ def valid_int(inputstring):
 	except:
 		return False
 
+# Signatures of image formats that gdk-pixbuf can load, used to identify
+# files whose names do not tell us what they are. Each entry holds the
+# format name as reported by gtk.gdk.pixbuf_get_formats() and the
+# (offset, bytes) pairs that must all match the start of the file.
+IMAGE_MAGIC = (
+	('png', ((0, '\x89PNG\r\n\x1a\n'),)),
+	('jpeg', ((0, '\xff\xd8\xff'),)),
+	('gif', ((0, 'GIF87a'),)),
+	('gif', ((0, 'GIF89a'),)),
+	('bmp', ((0, 'BM'),)),
+	('tiff', ((0, 'II*\x00'),)),
+	('tiff', ((0, 'MM\x00*'),)),
+	('ico', ((0, '\x00\x00\x01\x00'),)),
+	('ani', ((0, 'RIFF'), (8, 'ACON'))),
+	('webp', ((0, 'RIFF'), (8, 'WEBP'))),
+	('icns', ((0, 'icns'),)),
+	('jpeg2000', ((0, '\x00\x00\x00\x0cjP  \r\n\x87\n'),)),
+	('xpm', ((0, '/* XPM */'),)),
+	)
+
+# Text formats whose first bytes alone would also match ordinary text
+# files, such as C headers, are recognized by a pattern that has to match
+# at the start of the file instead.
+IMAGE_MAGIC_PATTERNS = (
+	('xbm', re.compile(r'#define[ \t]+\S*_width[ \t]+\d')),
+	('pnm', re.compile(r'P[1-6](\s|#[^\n]*\n)+\d')),
+	)
+
+def sniff_image_format(filename):
+	"""Returns the name of the image format of filename judging from its
+	first bytes, or None if the file is not recognized."""
+	try:
+		f = open(filename, 'rb')
+		try:
+			head = f.read(512)
+		finally:
+			f.close()
+	except:
+		return None
+	for name, signature in IMAGE_MAGIC:
+		for offset, magic in signature:
+			if head[offset:offset+len(magic)] != magic:
+				break
+		else:
+			return name
+	for name, pattern in IMAGE_MAGIC_PATTERNS:
+		if pattern.match(head):
+			return name
+	if '<svg' in head:
+		return 'svg'
+	return None
+
+def locale_sort_key(string):
+	"""Returns a key for string that sorts like locale.strcoll()."""
+	if isinstance(string, unicode):
+		string = string.encode('utf-8')
+	return locale.strxfrm(string)
+
+def process_rss():
+	"""Returns the resident size of this process in bytes, or None if it
+	cannot be determined."""
+	try:
+		f = open('/proc/self/statm')
+		try:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+		finally:
+			f.close()
+	except (IOError, OSError, ValueError, IndexError):
+		return None
+
+def load_thumbnail(name, size):
+	"""Returns a pixbuf of the image in name that fits in size x size (or
+	is a little larger), decoded no larger than needed: the thumbnail
+	embedded in the EXIF data is taken if it is large enough, other images
+	are scaled down while they are decoded. The EXIF orientation is applied
+	to the small result."""
+	pix = None
+	orientation = None
+	if HAS_EXIF:
+		try:
+			exifd = pyexiv2.ImageMetadata(name)
+			exifd.read()
+			if "Exif.Image.Orientation" in exifd.exif_keys:
+				orientation = exifd["Exif.Image.Orientation"].value
+			data = exifd.exif_thumbnail.data
+			if data:
+				loader = gtk.gdk.PixbufLoader()
+				loader.write(data)
+				loader.close()
+				pix = loader.get_pixbuf()
+				if max(pix.get_width(), pix.get_height()) < size:
+					pix = None
+		except Exception:
+			pix = None
+	if pix == None:
+		pix = gtk.gdk.pixbuf_new_from_file_at_size(name, size, size)
+	angle = {ImageData.ORIENT_LEFT: 90, ImageData.ORIENT_MIRROR: 180, ImageData.ORIENT_RIGHT: 270}.get(orientation)
+	if angle:
+		pix = pix.rotate_simple(angle)
+	return pix
+
+def read_file_list(fd, separator='\n'):
+	"""Yields the non-empty entries of a list of files read from the file
+	descriptor fd, one per line or separated by separator. Entries are
+	yielded as soon as they have been read, so that a list that is still
+	being written (e.g. by find on the other end of a pipe) can be used
+	right away."""
+	pending = ''
+	while True:
+		try:
+			data = os.read(fd, 65536)
+		except OSError as e:
+			if e.errno == errno.EINTR:
+				continue
+			raise
+		if not data:
+			break
+		entries = (pending + data).split(separator)
+		pending = entries.pop()
+		for entry in entries:
+			if separator == '\n':
+				entry = entry.rstrip('\r')
+			if entry:
+				yield entry
+	if separator == '\n':
+		pending = pending.rstrip('\r')
+	if pending:
+		yield pending
+
 class Base:
 
 	def __init__(self):
@@ -100,6 +257,9 @@ class Base:
 		self.open_mode_1to1 = 2
 		self.open_mode_last = 3
 		self.min_zoomratio = 0.02
+		# Window resizes less than this many seconds apart are a drag, during
+		# which the image is scaled with a fast, rough interpolation
+		self.resize_settle = 0.2
 
 		# Current image:
 		self.curr_img_in_list = 0
@@ -110,10 +270,13 @@ class Base:
 		# self.loaded_img_in_list will retain the current loaded image.
 		self.loaded_img_in_list = -2
 		self.currimg = ImageData(index=0)
-		# Next preloaded image:
-		self.nextimg = ImageData(index=-1)
-		# Previous preloaded image:
-		self.previmg = ImageData(index=-1)
+		# Preloaded images around the current one:
+		self.preloaded = PreloadRing()
+		self.preload_rezoom = False
+		# Recent moves through the list, to guess which images come next:
+		self.navigation = NavigationTracker()
+		# The order of random images, while going to random images:
+		self.shuffle = None
 
 		# Create a dictionary with all settings the users can do in the interface
 		self.usettings = {}
@@ -130,6 +293,10 @@ class Base:
 		self.usettings['last_mode'] = self.open_mode_smart
 		self.usettings['open_all_images'] = True # open all images in the directory(ies)
 		self.usettings['open_hidden_files'] = False
+		self.usettings['fast_image_detection'] = True # classify files by name while scanning
+		self.usettings['use_scan_cache'] = True # remember folder contents between sessions
+		self.usettings['scan_threads'] = 4 # folders scanned at the same time when opening several
+		self.usettings['watch_folders'] = True # follow images added to or removed from opened folders
 		self.usettings['use_numacomp'] = False
 		self.usettings['case_numacomp'] = False
 		self.usettings['use_last_dir'] = True
@@ -139,11 +306,17 @@ class Base:
 		# Settings, Navigation
 		self.usettings['listwrap_mode'] = 0	# 0=no, 1=yes, 2=ask
 		self.usettings['preloading_images'] = True
+		self.usettings['preload_depth'] = 3 # images preloaded on each side of the current one
+		self.usettings['image_cache_size'] = 256 # MB of decoded images kept for revisiting them
+		self.usettings['image_cache_max_rss'] = 1024 # MB the process may use before the cache is shrunk
+		self.usettings['decode_threads'] = 2 # images decoded at the same time in the background
 
 		# Settings, Interface
 		self.usettings['simple_bgcolor'] = False
 		self.usettings['bgcolor'] = {'r':0, 'g':0, 'b': 0}
 		self.usettings['thumbnail_size'] = 128	# Default to 128 x 128
+		self.usettings['thumbnail_threads'] = 4 # thumbnails made at the same time in the background
+		self.usettings['thumbnail_cache_size'] = 32 # MB of thumbnails kept for reopening folders
 		self.usettings['start_in_fullscreen'] = False
 
 		# Settings, Slideshow
@@ -172,16 +345,43 @@ class Base:
 		# Set the bg color variable
 		bgc = self.usettings['bgcolor']
 		self.bgcolor = gtk.gdk.Color(red=bgc['r'], green=bgc['g'], blue=bgc['b'])
+		# Decoded images, so that revisiting an image does not decode it again:
+		self.image_cache = ImageCache(self.usettings['image_cache_size'] * 1024 * 1024, self.usettings['image_cache_max_rss'] * 1024 * 1024)
+		# Thumbnails as shown in the thumbpane, by image and thumbnail size
+		self.thumbnail_cache = ImageCache(self.usettings['thumbnail_cache_size'] * 1024 * 1024)
+		# Images are decoded in the background, the current one first:
+		self.image_decoder = ImageDecoder(max(1, self.usettings['decode_threads']), self.decode_dropped)
+		# Thumbnails are made in the background, the visible ones first:
+		self.thumbnail_maker = ThumbnailMaker(self.thumbpane_make_pixbuf, self.thumbpane_add_pixbufs, max(1, self.usettings['thumbnail_threads']))
+		self.current_decode = None
+		self.current_decode_args = None
+		# Decodes the current image again when it was decoded too small
+		self.larger_decode = None
+		self.preload_decodes = {}
+		# Running average of how long decoding an image takes, in seconds
+		self.decode_seconds = 0.1
+		# Set while the load of the current image waits for the user to
+		# stop skipping through images, and the number of loads skipped so far
+		self.load_deferred = False
+		self.skipped_loads = 0
 		
 		self.going_random = False
 		self.fullscreen_mode = False
 		self.opendialogpath = ""
 		self.zoom_quality = gtk.gdk.INTERP_BILINEAR
+		self.resizing = False
+		self.resize_done_timer = None
+		self.last_resize = 0
 		self.recursive = False
 		self.verbose = False
 		self.image_loaded = False
-		self.image_list = []
-		self.firstimgindex_subfolders_list = []
+		self.image_list = ImageList()
+		self.firstimgindex_subfolders_list = SubfolderIndex()
+		# True while folders are scanned after the first image is shown; the
+		# image list then grows, and navigation follows it:
+		self.image_list_growing = False
+		# The image list the thumbpane rows were made for:
+		self.thumbpane_images = None
 		self.user_prompt_visible = False	# the "wrap?" prompt
 		self.slideshow_mode = False
 		self.slideshow_controls_visible = False	# fullscreen slideshow controls
@@ -190,6 +390,16 @@ class Base:
 		self.closing_app = False
 		self.onload_cmd = None
 		self.searching_for_images = False
+		self.stop_now = False
+		self.dir_scanner = None
+		self.file_list_reader = None
+		self.scan_cache = None
+		self.dir_watcher = None
+		# Whether subfolders created in watched folders are opened too:
+		self.watch_recursive = False
+		# Changes reported by dir_watcher while the list is being built:
+		self.watch_events_held = False
+		self.watch_pending_events = []
 		self.preserve_aspect = True
 		self.ignore_preserve_aspect_callback = False
 		self.image_modified = False
@@ -200,18 +410,18 @@ class Base:
 		self.merge_id_recent = None
 		self.actionGroupRecent = None
 		
-		self.thumbnail_sizes = ["128", "96", "72", "64", "48", "32"]
+		self.thumbnail_sizes = ["256", "192", "128", "96", "72", "64", "48", "32"]
 		
-		self.thumbnail_loaded = []
-		self.thumbpane_updating = False
+		# The blank thumbnail shown for images without one yet, by thumbnail size
+		self.thumbnail_placeholders = {}
+		self.thumbnail_fail_flavour = os.path.join('fail', 'mirage-' + __version__)
 		self.usettings['recentfiles'] = ["", "", "", "", ""]
 		self.usettings['screenshot_delay'] = 2
-		self.thumbpane_bottom_coord_loaded = 0
 		self.no_sort = False
 
 		# Read any passed options/arguments:
 		try:
-			opts, args = getopt.getopt(sys.argv[1:], "hRvVsfno:", ["help", "version", "recursive", "verbose", "slideshow", "fullscreen", "no-sort", "onload="])
+			opts, args = getopt.getopt(sys.argv[1:], "hRvVsfno:0", ["help", "version", "recursive", "verbose", "slideshow", "fullscreen", "no-sort", "onload=", "files-from=", "null"])
 		except getopt.GetoptError:
 			# print help information and exit:
 			self.print_usage()
@@ -219,6 +429,8 @@ class Base:
 		# If options were passed, perform action on them.
 		go_into_fullscreen = False
 		start_slideshow = False
+		files_from = None
+		files_from_separator = '\n'
 		if opts != []:
 			for o, a in opts:
 				if o in ("-v", "--version"):
@@ -239,6 +451,10 @@ class Base:
 					self.no_sort = True
 				elif o in ("-o", "--onload"):
 					self.onload_cmd = a
+				elif o == "--files-from":
+					files_from = a
+				elif o in ("-0", "--null"):
+					files_from_separator = '\0'
 				else:
 					self.print_usage()
 					sys.exit(2)
@@ -254,6 +470,21 @@ class Base:
 
 		self.blank_image = gtk.gdk.pixbuf_new_from_file(self.find_path("mirage_blank.png"))
 
+		# File extensions and mime types of the formats gdk-pixbuf can load,
+		# used to classify files by name when scanning folders:
+		self.image_format_names = set()
+		self.image_extensions = set()
+		self.image_mime_types = set()
+		for format in gtk.gdk.pixbuf_get_formats():
+			self.image_format_names.add(format['name'])
+			for ext in format['extensions']:
+				self.image_extensions.add('.' + ext.lower())
+			for mime_type in format['mime_types']:
+				self.image_mime_types.add(mime_type)
+		# Cache of extension -> True/False/None, see image_type_from_name()
+		self.image_extension_types = {}
+		mimetypes.init()
+
 		# Define the main menubar and toolbar:
 		self.iconfactory = gtk.IconFactory()
 		icon = gtk.gdk.pixbuf_new_from_file(self.find_path('stock_leave-fullscreen.png'))
@@ -513,7 +744,7 @@ class Base:
 		self.hscroll.set_adjustment(self.layout.get_hadjustment())
 		self.table = gtk.Table(3, 2, False)
 
-		self.thumblist = gtk.ListStore(gtk.gdk.Pixbuf)
+		self.thumblist = ThumbnailModel()
 		self.thumbpane = gtk.TreeView(self.thumblist)
 		self.thumbcolumn = gtk.TreeViewColumn(None)
 		self.thumbcell = gtk.CellRendererPixbuf()
@@ -522,6 +753,9 @@ class Base:
 		self.thumbpane.append_column(self.thumbcolumn)
 		self.thumbcolumn.pack_start(self.thumbcell, True)
 		self.thumbcolumn.set_attributes(self.thumbcell, pixbuf=0)
+		# All rows are as high as the largest thumbnail, so that the view
+		# only has to look at the rows it shows
+		self.thumbpane.set_fixed_height_mode(True)
 		self.thumbpane.get_selection().set_mode(gtk.SELECTION_SINGLE)
 		self.thumbpane.set_headers_visible(False)
 		self.thumbpane.set_property('can-focus', False)
@@ -636,10 +870,23 @@ class Base:
 			self.UIManager.get_widget('/Popup/Exit Full Screen').show()
 
 		# If arguments (filenames) were passed, try to open them:
-		self.image_list = []
-		if args != []:
+		self.image_list = ImageList()
+		if args != [] or files_from != None:
 			for i in range(len(args)):
 				args[i] = urllib.url2pathname(args[i]).decode('utf-8')
+			if files_from != None:
+				# The list is read while the images are loaded, instead of
+				# being read into memory first
+				if files_from == "-":
+					fd = sys.stdin.fileno()
+				else:
+					try:
+						fd = os.open(files_from, os.O_RDONLY)
+					except OSError as e:
+						print _("Unable to read %(file)s: %(error)s") % {'file': files_from, 'error': e.strerror}
+						sys.exit(2)
+				files = (entry.decode('utf-8', 'replace') for entry in read_file_list(fd, files_from_separator))
+				args = itertools.chain(args, files)
 			gtk.gdk.threads_enter()
 			self.expand_filelist_and_load_image(args)
 			gtk.gdk.threads_leave()
@@ -797,77 +1044,157 @@ class Base:
 		self.UIManager.get_widget('/MainMenu/MiscKeysMenuHidden').set_property('visible', False)
 
 	def thumbpane_update_images(self, clear_first=False, force_upto_imgnum=-1):
+		# Asks for the thumbnails of the visible rows, then of the rows around
+		# the current image and of the next page down. When first populating
+		# the thumbpane, force_upto_imgnum is shown selected.
 		self.stop_now = False
-		# When first populating the thumbpane, make sure we go up to at least
-		# force_upto_imgnum so that we can show this image selected:
 		if clear_first:
+			self.thumbnail_maker.clear()
 			self.thumbpane_clear_list()
-		# Load all images up to the bottom ofo the visible thumbpane rect:
-		rect = self.thumbpane.get_visible_rect()
-		bottom_coord = rect.y + rect.height + self.usettings['thumbnail_size']
-		if bottom_coord > self.thumbpane_bottom_coord_loaded:
-			self.thumbpane_bottom_coord_loaded = bottom_coord
-		# update images:
-		if not self.thumbpane_updating:
-			thread = threading.Thread(target=self.thumbpane_update_pending_images, args=(force_upto_imgnum, None))
-			thread.setDaemon(True)
-			thread.start()
+		if not self.usettings['thumbpane_show'] or self.closing_app:
+			return
+		self.thumbpane_create_dir()
+		count = len(self.image_list)
+		first, last, page = self.thumbpane_visible_rows()
+		wanted = range(first, last + 1)
+		if self.curr_img_in_list >= 0:
+			for distance in xrange(page):
+				wanted.append(self.curr_img_in_list + distance)
+				wanted.append(self.curr_img_in_list - distance - 1)
+		wanted.extend(xrange(last + 1, last + 1 + page))
+		# The thumbpane holds on to the thumbnails of about twice the rows
+		# asked for here, those of rows further away are dropped
+		self.thumblist.max_pixbufs = max(2 * len(wanted), 200)
+		wanted = [imgnum for imgnum in wanted if imgnum >= 0 and imgnum < count]
+		for imgnum in reversed(wanted):
+			if self.thumblist.has_thumbnail(imgnum):
+				self.thumblist.keep(imgnum)
+		cached = []
+		for priority, imgnum in enumerate(wanted):
+			if not self.thumblist.has_thumbnail(imgnum):
+				pix = self.thumbnail_cache.get(self.image_list[imgnum], self.usettings['thumbnail_size'])
+				if pix != None:
+					cached.append((imgnum, self.image_list[imgnum], pix))
+				else:
+					self.thumbnail_maker.request(imgnum, self.image_list[imgnum], priority)
+		if cached:
+			self.thumbpane_add_pixbufs(cached)
+		if force_upto_imgnum >= 0 and force_upto_imgnum == self.curr_img_in_list:
+			gobject.idle_add(self.thumbpane_select, force_upto_imgnum)
+
+	def thumbpane_visible_rows(self):
+		# Returns (first, last, page): the first and last visible rows of
+		# the thumbpane and the number of rows in a page
+		visible = self.thumbpane.get_visible_range()
+		if visible != None:
+			first, last = visible[0][0], visible[1][0]
+		else:
+			first, last = 0, min(len(self.image_list), 10) - 1
+		return first, last, max(last - first + 1, 10)
 
 	def thumbpane_create_dir(self):
-		if not os.path.exists(os.path.expanduser('~/.thumbnails/')):
-			os.mkdir(os.path.expanduser('~/.thumbnails/'))
-		if not os.path.exists(os.path.expanduser('~/.thumbnails/normal/')):
-			os.mkdir(os.path.expanduser('~/.thumbnails/normal/'))
+		for flavour in ('normal', 'large', self.thumbnail_fail_flavour):
+			path = self.thumbnail_dir(flavour)
+			if not os.path.exists(path):
+				try:
+					os.makedirs(path, 0700)
+				except OSError:
+					pass
 
-	def thumbpane_update_pending_images(self, force_upto_imgnum, foo):
-		self.thumbpane_updating = True
-		self.thumbpane_create_dir()
-		# Check to see if any images need their thumbnails generated.
-		curr_coord = 0
-		imgnum = 0
-		while curr_coord < self.thumbpane_bottom_coord_loaded or imgnum <= force_upto_imgnum:
-			if self.closing_app or self.stop_now or not self.usettings['thumbpane_show']:
-				break
-			if imgnum >= len(self.image_list):
-				break
-			self.thumbpane_set_image(self.image_list[imgnum], imgnum)
-			curr_coord += self.thumbpane.get_background_area((imgnum,),self.thumbcolumn).height
-			if force_upto_imgnum == imgnum:
-				# Verify that the user hasn't switched images while we're loading thumbnails:
-				if force_upto_imgnum == self.curr_img_in_list:
-					gobject.idle_add(self.thumbpane_select, force_upto_imgnum)
-			imgnum += 1
-		self.thumbpane_updating = False
+	def thumbpane_add_pixbufs(self, thumbnails):
+		# Puts the thumbnails made by self.thumbnail_maker, a list of
+		# (imgnum, image_name, pixbuf), into the thumbpane
+		self.thumbscroll.get_vscrollbar().handler_block(self.thumb_scroll_handler)
+		try:
+			for imgnum, image_name, pix in thumbnails:
+				if imgnum >= len(self.image_list) or self.image_list[imgnum] != image_name:
+					# Images have been inserted or removed before this one meanwhile
+					continue
+				if not self.thumblist.has_thumbnail(imgnum):
+					# Images without a thumbnail keep their blank one, rather
+					# than being tried again
+					self.thumblist.set_pixbuf(imgnum, pix)
+					if pix:
+						self.thumbpane_cache_pixbuf(image_name, pix)
+		finally:
+			self.thumbscroll.get_vscrollbar().handler_unblock(self.thumb_scroll_handler)
 
 	def thumbpane_clear_list(self):
-		self.thumbpane_bottom_coord_loaded = 0
+		# Gives the thumbpane a blank row for each image in self.image_list.
+		# The model is taken from the view meanwhile, so that the view does
+		# not have to follow the rows one by one.
+		self.thumbscroll.get_vscrollbar().handler_block(self.thumb_scroll_handler)
+		self.thumbpane.set_model(None)
+		self.thumblist.reset(self.image_list, self.thumbpane_placeholder())
+		self.thumbpane.set_model(self.thumblist)
+		self.thumbscroll.get_vscrollbar().handler_unblock(self.thumb_scroll_handler)
+
+	def thumbpane_insert_images(self, positions):
+		# Adds rows for the images that have been inserted into
+		# self.image_list at positions, in ascending order
+		if not positions:
+			return
 		self.thumbscroll.get_vscrollbar().handler_block(self.thumb_scroll_handler)
-		self.thumblist.clear()
+		self.thumblist.insert_rows(positions, [self.image_list[i] for i in positions])
 		self.thumbscroll.get_vscrollbar().handler_unblock(self.thumb_scroll_handler)
-		for image in self.image_list:
-			blank_pix = self.get_blank_pix_for_image(image)
-			self.thumblist.append([blank_pix])
-		self.thumbnail_loaded = [False]*len(self.image_list)
+		# Rows inserted beyond those that thumbpane_update_images() asks for
+		# do not change which thumbnails are wanted
+		first, last, page = self.thumbpane_visible_rows()
+		if positions[0] <= max(last, self.curr_img_in_list) + page:
+			self.thumbpane_update_images()
+
+	def thumbpane_make_pixbuf(self, image_name, force_update=False):
+		# Returns the thumbnail of image_name as shown in the thumbpane, or
+		# None. Called from the threads of self.thumbnail_maker too.
+		flavour, size = self.thumbnail_flavour()
+		filename, thumbfile = self.thumbnail_get_name(image_name, flavour)
+		pix = self.thumbpane_get_pixbuf(thumbfile, filename, force_update, size)
+		if pix:
+			if self.usettings['thumbnail_size'] != size:
+				# size is the size of the saved thumbnail, so convert if different:
+				pix, image_width, image_height = self.get_pixbuf_of_size(pix, self.usettings['thumbnail_size'], gtk.gdk.INTERP_TILES)
+			pix = self.pixbuf_add_border(pix)
+		return pix
+
+	def thumbpane_cache_pixbuf(self, image_name, pix):
+		# Keeps the thumbpane thumbnail pix of image_name in memory
+		self.thumbnail_cache.add(image_name, pix, pix.get_rowstride() * pix.get_height(), self.usettings['thumbnail_size'])
 
 	def thumbpane_set_image(self, image_name, imgnum, force_update=False):
 		if self.usettings['thumbpane_show']:
-			if not self.thumbnail_loaded[imgnum] or force_update:
-				filename, thumbfile = self.thumbnail_get_name(image_name)
-				pix = self.thumbpane_get_pixbuf(thumbfile, filename, force_update)
+			if not self.thumblist.has_thumbnail(imgnum) or force_update:
+				pix = None
+				if not force_update:
+					pix = self.thumbnail_cache.get(image_name, self.usettings['thumbnail_size'])
+				if pix == None:
+					pix = self.thumbpane_make_pixbuf(image_name, force_update)
+					if pix:
+						self.thumbpane_cache_pixbuf(image_name, pix)
 				if pix:
-					if self.usettings['thumbnail_size'] != 128:
-						# 128 is the size of the saved thumbnail, so convert if different:
-						pix, image_width, image_height = self.get_pixbuf_of_size(pix, self.usettings['thumbnail_size'], gtk.gdk.INTERP_TILES)
-					self.thumbnail_loaded[imgnum] = True
+					if imgnum >= len(self.image_list) or self.image_list[imgnum] != image_name:
+						# Images have been inserted before this one meanwhile
+						return
 					self.thumbscroll.get_vscrollbar().handler_block(self.thumb_scroll_handler)
-					pix = self.pixbuf_add_border(pix)
 					try:
-						self.thumblist[imgnum] = [pix]
+						self.thumblist.set_pixbuf(imgnum, pix)
 					except:
 						pass
 					self.thumbscroll.get_vscrollbar().handler_unblock(self.thumb_scroll_handler)
 
-	def thumbnail_get_name(self, image_name):
+	def thumbnail_dir(self, flavour):
+		# The freedesktop.org thumbnail cache, shared with other programs:
+		# 'normal' (128x128) and 'large' (256x256) thumbnails, and failures
+		# under 'fail/<program>'
+		return os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'thumbnails', flavour)
+
+	def thumbnail_flavour(self):
+		# Returns the kind of saved thumbnail and its size that the
+		# thumbpane is made from
+		if self.usettings['thumbnail_size'] > 128:
+			return 'large', 256
+		return 'normal', 128
+
+	def thumbnail_get_name(self, image_name, flavour='normal'):
 		filename = os.path.expanduser('file://' + image_name)
 		uriname = os.path.expanduser('file://' + urllib.pathname2url(image_name.encode('utf-8')))
 		if HAS_HASHLIB:
@@ -876,40 +1203,81 @@ class Base:
 			m = md5.new()
 		m.update(uriname)
 		mhex = m.hexdigest()
-		mhex_filename = os.path.expanduser('~/.thumbnails/normal/' + mhex + '.png')
+		mhex_filename = os.path.join(self.thumbnail_dir(flavour), mhex + '.png')
 		return filename, mhex_filename
 
-	def thumbpane_get_pixbuf(self, thumb_url, image_url, force_generation):
+	def thumbnail_remove(self, image_name):
+		# Removes all saved thumbnails of image_name, and its failure entry
+		for flavour in ('normal', 'large', self.thumbnail_fail_flavour):
+			try:
+				os.remove(self.thumbnail_get_name(image_name, flavour)[1])
+			except OSError:
+				pass
+
+	def thumbnail_save(self, pix, thumb_url, uri, file_mtime):
+		# Saves pix as the thumbnail thumb_url of uri. It is written to a
+		# temporary file first, so that other programs never see a half
+		# written thumbnail.
+		dirname = os.path.dirname(thumb_url)
+		fd, tmpname = tempfile.mkstemp(suffix='.png', dir=dirname)
+		os.close(fd)
+		try:
+			pix.save(tmpname, "png", {'tEXt::Thumb::URI':uri, 'tEXt::Thumb::MTime':file_mtime, 'tEXt::Software':'Mirage ' + __version__})
+			os.rename(tmpname, thumb_url)
+		except Exception:
+			# Keep the original error if the temporary file cannot be removed
+			# either; a bare raise would re-raise the error of the cleanup
+			error = sys.exc_info()
+			try:
+				os.remove(tmpname)
+			except OSError:
+				pass
+			raise error[0], error[1], error[2]
+
+	def thumbpane_get_pixbuf(self, thumb_url, image_url, force_generation, size=128):
 		# Returns a valid pixbuf or None if a pixbuf cannot be generated. Tries to re-use
-		# a thumbnail from ~/.thumbails/normal/, otherwise generates one with the
+		# the saved thumbnail thumb_url, otherwise generates one of size x size with the
 		# XDG filename: md5(file:///full/path/to/image).png
+		# Images that could not be thumbnailed before are not tried again
+		# until they are modified, unless force_generation is set.
 		imgfile = image_url
 		if imgfile[:7] == 'file://':
 			imgfile = imgfile[7:]
 		try:
-			if os.path.exists(thumb_url) and not force_generation:
-				pix = gtk.gdk.pixbuf_new_from_file(thumb_url)
-				pix_mtime = pix.get_option('tEXt::Thumb::MTime')
-				if pix_mtime:
-					st = os.stat(imgfile)
-					file_mtime = str(st[stat.ST_MTIME])
-					# If the mtimes match, we're good. if not, regenerate the thumbnail..
-					if pix_mtime == file_mtime:
-						return pix
-			# Create the 128x128 thumbnail:
-			uri = 'file://' + urllib.pathname2url(imgfile.encode('utf-8'))
-			#pix = gtk.gdk.pixbuf_new_from_file(imgfile)
-			pix = ImageData()
-			pix.load_pixbuf(imgfile)
-			pix, image_width, image_height = self.get_pixbuf_of_size(pix.pixbuf, 128, gtk.gdk.INTERP_TILES)
 			st = os.stat(imgfile)
-			file_mtime = str(st[stat.ST_MTIME])
-			# Save image to .thumbnails:
-			pix.save(thumb_url, "png", {'tEXt::Thumb::URI':uri, 'tEXt::Thumb::MTime':file_mtime, 'tEXt::Software':'Mirage' + __version__})
-			return pix
+		except OSError:
+			return None
+		file_mtime = str(st[stat.ST_MTIME])
+		uri = 'file://' + urllib.pathname2url(imgfile.encode('utf-8'))
+		fail_url = os.path.join(self.thumbnail_dir(self.thumbnail_fail_flavour), os.path.basename(thumb_url))
+		for url in (thumb_url, fail_url):
+			if os.path.exists(url) and not force_generation:
+				try:
+					pix = gtk.gdk.pixbuf_new_from_file(url)
+				except gobject.GError:
+					continue
+				# If the mtimes match, we're good. if not, regenerate the thumbnail..
+				if pix.get_option('tEXt::Thumb::MTime') == file_mtime:
+					if url == fail_url:
+						return None
+					return pix
+		try:
+			pix = load_thumbnail(imgfile, size)
+			pix, image_width, image_height = self.get_pixbuf_of_size(pix, size, gtk.gdk.INTERP_TILES)
 		except:
-			
+			try:
+				# Remember the failure, as the thumbnail spec describes
+				fail_pix = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, True, 8, 1, 1)
+				fail_pix.fill(0x00000000)
+				self.thumbnail_save(fail_pix, fail_url, uri, file_mtime)
+			except:
+				pass
 			return None
+		try:
+			self.thumbnail_save(pix, thumb_url, uri, file_mtime)
+		except:
+			pass
+		return pix
 
 	def thumbpane_load_image(self, treeview, imgnum):
 		if imgnum != self.curr_img_in_list:
@@ -924,7 +1292,7 @@ class Base:
 		try:
 			model, paths = self.thumbpane.get_selection().get_selected_rows()
 			imgnum = paths[0][0]
-			if not self.thumbnail_loaded[imgnum]:
+			if not self.thumblist.has_thumbnail(imgnum):
 				self.thumbpane_set_image(self.image_list[imgnum], imgnum)
 			gobject.idle_add(self.thumbpane_load_image, treeview, imgnum)
 		except:
@@ -942,6 +1310,8 @@ class Base:
 
 	def thumbpane_set_size(self):
 		self.thumbcolumn.set_fixed_width(self.thumbpane_get_size())
+		# Room for the largest thumbnail, border included:
+		self.thumbcell.set_fixed_size(-1, self.usettings['thumbnail_size'] + 2 + 2 * self.thumbcell.get_property('ypad'))
 		self.window_resized(None, self.window.allocation, True)
 
 	def thumbpane_get_size(self):
@@ -950,33 +1320,26 @@ class Base:
 	def thumbpane_scrolled(self, range):
 		self.thumbpane_update_images()
 
-	def get_blank_pix_for_image(self, image):
-		# Sizes the "blank image" icon for the thumbpane. This will ensure that we don't
-		# load a humongous icon for a small pix, for example, and will keep the thumbnails
-		# from shifting around when they are actually loaded.
-		try:
-			info = gtk.gdk.pixbuf_get_file_info(image)
-			imgwidth = float(info[1])
-			imgheight = float(info[2])
-			if imgheight > self.usettings['thumbnail_size']:
-				if imgheight > imgwidth:
-					imgheight = self.usettings['thumbnail_size']
-				else:
-					imgheight = imgheight/imgwidth * self.usettings['thumbnail_size']
-			imgheight = 2 + int(imgheight) # Account for border that will be added to thumbnails..
-			imgwidth = self.usettings['thumbnail_size']
-		except:
-			imgheight = 2 + self.usettings['thumbnail_size']
-			imgwidth = self.usettings['thumbnail_size']
-		blank_pix = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, True, 8, imgwidth, imgheight)
-		blank_pix.fill(0x00000000)
-		imgwidth2 = int(imgheight*0.8)
-		imgheight2 = int(imgheight*0.8)
-		composite_pix = self.blank_image.scale_simple(imgwidth2, imgheight2, gtk.gdk.INTERP_BILINEAR)
-		leftcoord = int((imgwidth - imgwidth2)/2)
-		topcoord = int((imgheight - imgheight2)/2)
-		composite_pix.copy_area(0, 0, imgwidth2, imgheight2, blank_pix, leftcoord, topcoord)
-		return blank_pix
+	def thumbpane_placeholder(self):
+		# Returns the "blank image" icon shown in the thumbpane for images
+		# whose thumbnails are not there yet. One is shared by all rows, made
+		# once for each thumbnail size, and it is as large as any thumbnail
+		# (the border added to thumbnails included), so that rows do not
+		# change their height when their thumbnails are loaded.
+		size = self.usettings['thumbnail_size']
+		if size not in self.thumbnail_placeholders:
+			imgwidth = size
+			imgheight = size + 2
+			blank_pix = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, True, 8, imgwidth, imgheight)
+			blank_pix.fill(0x00000000)
+			imgwidth2 = int(imgheight*0.8)
+			imgheight2 = int(imgheight*0.8)
+			composite_pix = self.blank_image.scale_simple(imgwidth2, imgheight2, gtk.gdk.INTERP_BILINEAR)
+			leftcoord = int((imgwidth - imgwidth2)/2)
+			topcoord = int((imgheight - imgheight2)/2)
+			composite_pix.copy_area(0, 0, imgwidth2, imgheight2, blank_pix, leftcoord, topcoord)
+			self.thumbnail_placeholders[size] = blank_pix
+		return self.thumbnail_placeholders[size]
 
 	def find_path(self, filename, exit_on_fail=True):
 		""" Find a pixmap or icon by looking through standard dirs.
@@ -1051,6 +1414,10 @@ class Base:
 		while gtk.events_pending():
 			gtk.main_iteration()
 		self.curr_custom_action = 0
+		# The images shown or preloaded are decoded again afterwards if the
+		# actions have changed their files. Preloads may be decoded at window
+		# size, so their pixels cannot be compared with the files.
+		signatures = dict((img.name, self.file_signature(img.name)) for img in [self.currimg] + list(self.preloaded))
 		if batchmode:
 			self.num_custom_actions = len(self.image_list)
 			for i in range(self.num_custom_actions):
@@ -1073,42 +1440,16 @@ class Base:
 		if not os.path.exists(self.currimg.name):
 			self.currimg.unload_pixbuf()
 			self.image_load_failed(False)
-		else:
-			animtest = gtk.gdk.PixbufAnimation(self.currimg.name)
-			if animtest.is_static_image():
-				if self.images_are_different(animtest.get_static_image(), self.currimg.pixbuf_original):
-					self.load_new_image2(False, False, True, False)
-			else:
-				if self.images_are_different(animtest, self.currimg.pixbuf_original):
-					self.load_new_image2(False, False, True, False)
+		elif self.file_signature(self.currimg.name) != signatures.get(self.currimg.name):
+			self.load_new_image2(False, False, True, False)
 		self.running_custom_actions = False
 		self.update_statusbar()
 		while gtk.events_pending():
 			gtk.main_iteration()
-		if not os.path.exists(self.previmg.name):
-			self.previmg.unload_pixbuf()
-		else:
-			animtest = gtk.gdk.PixbufAnimation(self.previmg.name)
-			if animtest.is_static_image():
-				if self.images_are_different(animtest.get_static_image(), self.previmg.pixbuf_original):
-					self.previmg.unload_pixbuf()
-					self.preload_when_idle = gobject.idle_add(self.preload_prev_image, False)
-			else:
-				if self.images_are_different(animtest, self.previmg.pixbuf_original):
-					self.previmg.unload_pixbuf()
-					self.preload_when_idle = gobject.idle_add(self.preload_prev_image, False)
-		if not os.path.exists(self.nextimg.name):
-			self.nextimg.unload_pixbuf()
-		else:
-			animtest = gtk.gdk.PixbufAnimation(self.nextimg.name)
-			if animtest.is_static_image():
-				if self.images_are_different(animtest.get_static_image(), self.nextimg.pixbuf_original):
-					self.nextimg.unload_pixbuf()
-					self.preload_when_idle = gobject.idle_add(self.preload_next_image, False)
-			else:
-				if self.images_are_different(animtest, self.nextimg.pixbuf_original):
-					self.nextimg.unload_pixbuf()
-					self.preload_when_idle = gobject.idle_add(self.preload_next_image, False)
+		for img in list(self.preloaded):
+			if self.file_signature(img.name) != signatures.get(img.name):
+				self.preloaded.discard(img.index)
+		self.schedule_preload()
 		self.stop_now = False
 		if batchmode:
 			# Update all thumbnails:
@@ -1117,11 +1458,13 @@ class Base:
 			# Update only the current thumbnail:
 			gobject.idle_add(self.thumbpane_set_image, self.image_list[self.curr_img_in_list], self.curr_img_in_list, True)
 
-	def images_are_different(self, pixbuf1, pixbuf2):
-		if pixbuf1.get_pixels() == pixbuf2.get_pixels():
-			return False
-		else:
-			return True
+	def file_signature(self, name):
+		# Returns (mtime, size) of the file name, or None if it is gone
+		try:
+			st = os.stat(name)
+		except OSError:
+			return None
+		return (st.st_mtime, st.st_size)
 
 	def recent_action_click(self, action):
 		self.stop_now = True
@@ -1134,7 +1477,7 @@ class Base:
 		if os.path.isfile(self.usettings['recentfiles'][index]) or os.path.exists(self.usettings['recentfiles'][index]) or self.usettings['recentfiles'][index].startswith('http://') or self.usettings['recentfiles'][index].startswith('ftp://'):
 			self.expand_filelist_and_load_image([self.usettings['recentfiles'][index]])
 		else:
-			self.image_list = []
+			self.image_list = ImageList()
 			self.curr_img_in_list = 0
 			self.image_list.append(self.usettings['recentfiles'][index])
 			self.image_load_failed(False)
@@ -1369,6 +1712,10 @@ class Base:
 		print "  -o, --onload 'cmd'   " + _("Execute 'cmd' when an image is loaded")
 		print "                       " + _("uses same syntax as custom actions,")
 		print "                       " + _("i.e. mirage -o 'echo file is %F'")
+		print "  --files-from=FILE    " + _("Also open the files and folders listed in")
+		print "                       " + _("FILE, one per line ('-' reads from stdin)")
+		print "  -0, --null           " + _("Entries in --files-from are separated by")
+		print "                       " + _("null characters instead of newlines")
 
 	def delay_changed(self, action):
 		self.curr_slideshow_delay = self.ss_delayspin.get_value()
@@ -1378,6 +1725,7 @@ class Base:
 				self.timer_delay = gobject.timeout_add(int(self.curr_slideshow_delay*1000), self.goto_random_image, "ss", True)
 			else:
 				self.timer_delay = gobject.timeout_add(int(self.curr_slideshow_delay*1000), self.goto_next_image, "ss", True)
+			self.schedule_preload()
 		self.window.set_focus(self.layout)
 
 	def random_changed(self, action):
@@ -1432,19 +1780,32 @@ class Base:
 		# Update the image size on window resize if the current image was last fit:
 		if self.image_loaded:
 			if force_update or allocation.width != self.prevwinwidth or allocation.height != self.prevwinheight:
+				now = time.time()
+				self.resizing = not force_update and now - self.last_resize < self.resize_settle
+				self.last_resize = now
 				if self.last_image_action_was_fit:
 					self.image_zoom_fit_update()
 				else:
 					self.center_image()
-				self.load_new_image_stop_now()
+				self.preload_stop_now()
 				self.show_scrollbars_if_needed()
-				# Also, regenerate preloaded image for new window size:
-				self.preload_when_idle = gobject.idle_add(self.preload_next_image, True)
-				self.preload_when_idle2 = gobject.idle_add(self.preload_prev_image, True)
+				# Scale the image properly and regenerate preloaded images for
+				# the new window size once the window has stopped changing
+				if self.resize_done_timer:
+					gobject.source_remove(self.resize_done_timer)
+				self.resize_done_timer = gobject.timeout_add(int(self.resize_settle * 1000), self.window_resize_done)
 		self.prevwinwidth = allocation.width
 		self.prevwinheight = allocation.height
 		return
 
+	def window_resize_done(self):
+		self.resize_done_timer = None
+		if self.resizing:
+			self.resizing = False
+			self.image_zoom_fit_update()
+		self.schedule_preload(True)
+		return False
+
 	def save_settings(self):
 		# Save the config as json
 		if not os.path.exists(self.config_dir):
@@ -1456,6 +1817,8 @@ class Base:
 
 		# Also, save accel_map:
 		gtk.accel_map_save(self.config_dir + '/accel_map')
+		if self.scan_cache:
+			self.scan_cache.save()
 	
 	def store_window_size(self,widget,event):
 		# When the window is resized, store the size in the settings
@@ -1492,9 +1855,14 @@ class Base:
 	def put_zoom_image_to_window(self, currimg_preloaded, zoom_ratio=1):
 		self.window.window.freeze_updates()
 		if not currimg_preloaded:
-			# Zoom the pixbuf
+			# Zoom the pixbuf, roughly while the window is being resized
 			colormap = self.imageview.get_colormap()
-			self.currimg.zoom_pixbuf(zoom_ratio, self.zoom_quality, colormap)
+			if self.resizing:
+				self.currimg.zoom_pixbuf(zoom_ratio, gtk.gdk.INTERP_NEAREST, colormap)
+			else:
+				self.currimg.zoom_pixbuf(zoom_ratio, self.zoom_quality, colormap)
+		if not self.resizing:
+			self.decode_larger_image()
 		self.layout.set_size(self.currimg.width, self.currimg.height)
 		self.center_image()
 		self.show_scrollbars_if_needed()
@@ -1572,6 +1940,8 @@ class Base:
 
 	def save_image_now(self, dest_name, fileext=None):
 		try:
+			if not self.load_full_image():
+				raise IOError(dest_name)
 			self.change_cursor(gtk.gdk.Cursor(gtk.gdk.WATCH))
 			while gtk.events_pending():
 				gtk.main_iteration()
@@ -1643,8 +2013,7 @@ class Base:
 					# Ensures that we don't use the current pixbuf for any preload pixbufs if we are in
 					# the process of loading the previous or next image in the list:
 					self.currimg.pixbuf = self.currimg.pixbuf_original
-					self.nextimg.index = -1
-					self.previmg.index = -1
+					self.preloaded.clear()
 					self.loaded_img_in_list = -1
 				else:
 					return True
@@ -1848,7 +2217,7 @@ class Base:
 			st = os.stat(self.currimg.name)
 			filesize = st[stat.ST_SIZE]/1000
 			ratio = int(100 * self.currimg.zoomratio)
-			status_text = os.path.basename(self.currimg.name)+ ":  " +  str(self.currimg.pixbuf_original.get_width()) + "x" + str(self.currimg.pixbuf_original.get_height()) + "   " + str(filesize) + "KB   " + str(ratio) + "%   "
+			status_text = os.path.basename(self.currimg.name)+ ":  " +  str(self.currimg.width_original) + "x" + str(self.currimg.height_original) + "   " + str(filesize) + "KB   " + str(ratio) + "%   "
 		except:
 			status_text=_("Cannot load image.")
 		self.statusbar.push(self.statusbar.get_context_id(""), status_text)
@@ -2253,7 +2622,7 @@ class Base:
 		tmpfile = tmpdir + "screenshot.png"
 		pix.save(tmpfile, 'png')
 		# Load file:
-		self.image_list = [tmpfile]
+		self.image_list = ImageList([tmpfile])
 		self.curr_img_in_list = 0
 		gobject.idle_add(self.load_new_image2, False, False, False, False, True)
 		self.update_statusbar()
@@ -2311,7 +2680,7 @@ class Base:
 		filestat = os.stat(self.currimg.name)
 		filename2 = gtk.Label(os.path.basename(self.currimg.name))
 		filedate2 = gtk.Label(time.strftime('%Y/%m/%d  %H:%M', time.localtime(filestat[stat.ST_MTIME])))
-		imagesize2 = gtk.Label(str(self.currimg.pixbuf_original.get_width()) + "x" + str(self.currimg.pixbuf_original.get_height()))
+		imagesize2 = gtk.Label(str(self.currimg.width_original) + "x" + str(self.currimg.height_original))
 		filetype2 = gtk.Label(self.currimg.fileinfo['mime_types'][0])
 		filesize2 = gtk.Label(str(filestat[stat.ST_SIZE]/1000) + "KB")
 		if not self.currimg.animation and pixbuf.get_has_alpha():
@@ -2500,6 +2869,9 @@ class Base:
 		hiddenimages = gtk.CheckButton(_("Allow loading hidden files"))
 		hiddenimages.set_active(self.usettings['open_hidden_files'])
 		hiddenimages.set_tooltip_text(_("If checked, Mirage will open hidden files. Otherwise, hidden files will be ignored."))
+		fastdetection = gtk.CheckButton(_("Detect images by file extension"))
+		fastdetection.set_active(self.usettings['fast_image_detection'])
+		fastdetection.set_tooltip_text(_("If checked, files are recognized as images by their name, which makes opening large folders much faster. Files without a known extension are still recognized by their contents."))
 		#Numacomp sorting options
 		usenumacomp = gtk.CheckButton(_("Use Numerical aware sort"))
 		usenumacomp.set_active(self.usettings['use_numacomp'])
@@ -2543,11 +2915,12 @@ class Base:
 		table_behavior.attach(hiddenimages, 1, 2, 7, 8, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 30, 0)
 		table_behavior.attach(usenumacomp, 1, 2, 8, 9, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 30, 0)
 		table_behavior.attach(case_numacomp, 1, 2, 9, 10, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 50, 0)
-		table_behavior.attach(gtk.Label(), 1, 2, 10, 11, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 0, 0)
-		table_behavior.attach(openpref1, 1, 2, 11, 12, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 30, 0)
-		table_behavior.attach(openpref2, 1, 2, 12, 13, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 30, 0)
-		table_behavior.attach(hbox_defaultdir, 1, 2, 13, 14, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 45, 0)
-		table_behavior.attach(gtk.Label(), 1, 2, 14, 15, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 45, 0)
+		table_behavior.attach(fastdetection, 1, 2, 10, 11, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 30, 0)
+		table_behavior.attach(gtk.Label(), 1, 2, 11, 12, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 0, 0)
+		table_behavior.attach(openpref1, 1, 2, 12, 13, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 30, 0)
+		table_behavior.attach(openpref2, 1, 2, 13, 14, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 30, 0)
+		table_behavior.attach(hbox_defaultdir, 1, 2, 14, 15, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 45, 0)
+		table_behavior.attach(gtk.Label(), 1, 2, 15, 16, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 45, 0)
 
 		# "Navigation" tab:
 		table_navigation = gtk.Table(14, 2, False)
@@ -2557,6 +2930,13 @@ class Base:
 		preloadnav = gtk.CheckButton(label=_("Preload images for faster navigation"))
 		preloadnav.set_active(self.usettings['preloading_images'])
 		preloadnav.set_tooltip_text(_("If enabled, the next and previous images in the list will be preloaded during idle time. Note that the speed increase comes at the expense of memory usage, so it is recommended to disable this option on machines with limited ram."))
+		hbox_cache = gtk.HBox()
+		hbox_cache.pack_start(gtk.Label(_("Memory for recently viewed images (MB):")), False, False, 0)
+		cache_adj = gtk.Adjustment(self.usettings['image_cache_size'], 0, 65536, 16, 128, 0)
+		cachespin = gtk.SpinButton(cache_adj, 1.0, 0)
+		cachespin.set_numeric(True)
+		cachespin.set_tooltip_text(_("Images that have been viewed are kept in memory up to this size, so that going back to them is instant. Set to 0 to disable."))
+		hbox_cache.pack_start(cachespin, False, False, 5)
 		hbox_listwrap = gtk.HBox()
 		hbox_listwrap.pack_start(gtk.Label(_("Wrap around imagelist:")), False, False, 0)
 		combobox2 = gtk.combo_box_new_text()
@@ -2572,7 +2952,7 @@ class Base:
 		table_navigation.attach(gtk.Label(), 1, 2, 5, 6, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 0, 0)
 		table_navigation.attach(preloadnav, 1, 2, 6, 7, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 30, 0)
 		table_navigation.attach(gtk.Label(), 1, 2, 7, 8, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 30, 0)
-		table_navigation.attach(gtk.Label(), 1, 2, 8, 9, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 0, 0)
+		table_navigation.attach(hbox_cache, 1, 2, 8, 9, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 30, 0)
 		table_navigation.attach(gtk.Label(), 1, 2, 9, 10, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 30, 0)
 		table_navigation.attach(gtk.Label(), 1, 2, 10, 11, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 30, 0)
 		table_navigation.attach(gtk.Label(), 1, 2, 11, 12, gtk.FILL|gtk.EXPAND, gtk.FILL|gtk.EXPAND, 0, 0)
@@ -2690,6 +3070,7 @@ class Base:
 				self.zoom_quality = gtk.gdk.INTERP_HYPER
 			self.usettings['open_all_images'] = openallimages.get_active()
 			self.usettings['open_hidden_files'] = hiddenimages.get_active()
+			self.usettings['fast_image_detection'] = fastdetection.get_active()
 			self.usettings['use_numacomp'] = usenumacomp.get_active()
 			self.usettings['case_numacomp'] = case_numacomp.get_active()
 			if openpref1.get_active():
@@ -2701,6 +3082,8 @@ class Base:
 			preloading_images_prev = self.usettings['preloading_images']
 			self.usettings['preloading_images'] = preloadnav.get_active()
 			self.usettings['listwrap_mode'] = combobox2.get_active()
+			self.usettings['image_cache_size'] = int(cachespin.get_value())
+			self.image_cache.resize(self.usettings['image_cache_size'] * 1024 * 1024)
 			self.usettings['slideshow_delay'] = delayspin.get_value()
 			self.curr_slideshow_delay = self.usettings['slideshow_delay']
 			self.usettings['slideshow_random'] = randomize.get_active()
@@ -2719,13 +3102,10 @@ class Base:
 			self.set_go_navigation_sensitivities(False)
 			if (self.usettings['preloading_images'] and not preloading_images_prev) or (open_mode_prev != self.usettings['open_mode']):
 				# The user just turned on preloading, so do it:
-				self.nextimg.index = -1
-				self.previmg.index = -1
-				self.preload_when_idle = gobject.idle_add(self.preload_next_image, False)
-				self.preload_when_idle2 = gobject.idle_add(self.preload_prev_image, False)
+				self.preloaded.clear()
+				self.schedule_preload()
 			elif not self.usettings['preloading_images']:
-				self.nextimg.index = -1
-				self.previmg.index = -1
+				self.preloaded.clear()
 
 	def prefs_use_fixed_dir_clicked(self, button):
 		if button.get_active():
@@ -2803,11 +3183,8 @@ class Base:
 						return
 					exists_dialog.destroy()
 				shutil.move(self.currimg.name, new_filename)
-				# Update thumbnail filename:
-				try:
-					shutil.move(self_get_name(self.currimg.name)[1], self.thumbnail_get_name(new_filename)[1])
-				except:
-					pass
+				# The saved thumbnails name the old file, so drop them:
+				self.thumbnail_remove(self.currimg.name)
 				self.recent_file_remove_and_refresh_name(self.currimg.name)
 				self.currimg.name = new_filename
 				self.register_file_with_recent_docs(self.currimg.name)
@@ -2851,54 +3228,12 @@ class Base:
 				try:
 					os.remove(self.currimg.name)
 					self.image_modified = False
-					try:
-						os.remove(self.thumbnail_get_name(self.currimg.name)[1])
-					except:
-						pass
+					self.thumbnail_remove(self.currimg.name)
 					self.recent_file_remove_and_refresh_name(self.currimg.name)
-					iter = self.thumblist.get_iter((self.curr_img_in_list,))
-					try:
-						self.thumbnail_loaded.pop(self.curr_img_in_list)
-						self.thumbpane_update_images()
-					except:
-						pass
-					
-					#Decrease the subfolder indexes of folders after the current folder
-					myidx = self.get_firstimgindex_curr_next_prev_subfolder(self.curr_img_in_list)[0]
-					if myidx >= 0 and myidx < self.firstimgindex_subfolders_list[-1]:
-						for idx in xrange(1+self.firstimgindex_subfolders_list.index(myidx),
-								len(self.firstimgindex_subfolders_list)):
-							#Decrease the idxes in the list
-							self.firstimgindex_subfolders_list[idx] -= 1
-						omgset = set(self.firstimgindex_subfolders_list)
-						self.firstimgindex_subfolders_list = sorted(list(omgset))
-					
-					self.thumblist.remove(iter)
-					templist = self.image_list
-					self.image_list = []
-					for item in templist:
-						if item != self.currimg.name:
-							self.image_list.append(item)
-					if len(self.image_list) >= 1:
-						if len(self.image_list) == 1:
-							self.curr_img_in_list = 0
-						elif self.curr_img_in_list == len(self.image_list):
-							self.curr_img_in_list -= 1
+					if len(self.image_list) > 1:
 						self.change_cursor(gtk.gdk.Cursor(gtk.gdk.WATCH))
-						self.previmg.index = -1
-						self.nextimg.index = -1
-						self.load_when_idle = gobject.idle_add(self.load_new_image, False, False, True, True, True, True)
-						self.set_go_navigation_sensitivities(False)
-					else:
-						self.imageview.clear()
-						self.update_title()
-						self.statusbar.push(self.statusbar.get_context_id(""), "")
-						self.image_loaded = False
-						self.set_slideshow_sensitivities()
-						self.set_image_sensitivities(False)
-						self.set_go_navigation_sensitivities(False)
-					# Select new item:
-					self.thumbpane_select(self.curr_img_in_list)
+					self.image_list_remove(self.curr_img_in_list)
+					self.thumbpane_update_images()
 				except:
 					error_dialog = gtk.MessageDialog(self.window, gtk.DIALOG_MODAL, gtk.MESSAGE_WARNING, gtk.BUTTONS_OK, _('Unable to delete %s') % self.currimg.name)
 					error_dialog.set_title(_("Unable to delete"))
@@ -3076,9 +3411,9 @@ class Base:
 				self.enter_fullscreen(None)
 			elif event.button == 2:
 				if self.last_image_action_was_fit:
-					self.zoom_1_to_1(None,False,False)
+					self.zoom_1_to_1(None)
 				else:
-					self.zoom_to_fit_window(None, False, False)
+					self.zoom_to_fit_window(None)
 			# Changes the cursor to the 'resize' cursor, like GIMP, on a middle click:
 			elif event.button == 1 and (self.hscroll.get_property('visible')==True or self.vscroll.get_property('visible')==True):
 				self.change_cursor(gtk.gdk.Cursor(gtk.gdk.FLEUR))
@@ -3098,9 +3433,9 @@ class Base:
 	def image_zoom_fit_update(self):
 		if self.image_loaded and self.last_image_action_was_fit:
 			if self.last_image_action_was_smart_fit:
-				self.zoom_to_fit_or_1_to_1(None, False, False)
+				self.zoom_to_fit_or_1_to_1(None)
 			else:
-				self.zoom_to_fit_window(None, False, False)
+				self.zoom_to_fit_window(None)
 
 	def zoom_in(self, action):
 		if self.currimg.isloaded and self.UIManager.get_widget('/MainMenu/ViewMenu/In').get_property('sensitive'):
@@ -3135,7 +3470,7 @@ class Base:
 			self.update_statusbar()
 
 	def zoom_to_fit_window_action(self, action):
-		self.zoom_to_fit_window(action, False, False)
+		self.zoom_to_fit_window(action)
 
 	def calc_ratio(self, img, ):
 		"""Calculate the ratio needed to fit the image in the view window"""
@@ -3151,13 +3486,9 @@ class Base:
 			premax_ratio = prewidth_ratio
 		return 1/float(premax_ratio)
 
-	def zoom_to_fit_window(self, action, is_preloadimg_next, is_preloadimg_prev):
-		if is_preloadimg_next:
-			if self.usettings['preloading_images'] and self.nextimg.index != -1:
-				self.nextimg.zoomratio = self.calc_ratio(self.nextimg)
-		elif is_preloadimg_prev:
-			if self.usettings['preloading_images'] and self.previmg.index != -1:
-				self.previmg.zoomratio = self.calc_ratio(self.previmg)
+	def zoom_to_fit_window(self, action, preloadimg=None):
+		if preloadimg:
+			preloadimg.zoomratio = self.calc_ratio(preloadimg)
 		else:
 			if self.currimg.isloaded and (self.slideshow_mode or self.UIManager.get_widget('/MainMenu/ViewMenu/Fit').get_property('sensitive')):
 				self.image_zoomed = True
@@ -3170,17 +3501,11 @@ class Base:
 				self.put_zoom_image_to_window(False, wanted_zoomratio)
 				self.update_statusbar()
 
-	def zoom_to_fit_or_1_to_1(self, action, is_preloadimg_next, is_preloadimg_prev):
-		if is_preloadimg_next:
-			if self.usettings['preloading_images'] and self.nextimg.index != -1:
-				self.nextimg.zoomratio = self.calc_ratio(self.nextimg)
-				if self.nextimg.zoomratio > 1:
-					self.nextimg.zoomratio = 1
-		elif is_preloadimg_prev:
-			if self.usettings['preloading_images'] and self.previmg.index != -1:
-				self.previmg.zoomratio = self.calc_ratio(self.previmg)
-				if self.previmg.zoomratio > 1:
-					self.previmg.zoomratio = 1
+	def zoom_to_fit_or_1_to_1(self, action, preloadimg=None):
+		if preloadimg:
+			preloadimg.zoomratio = self.calc_ratio(preloadimg)
+			if preloadimg.zoomratio > 1:
+				preloadimg.zoomratio = 1
 		else:
 			if self.currimg.isloaded:
 				self.image_zoomed = True
@@ -3189,7 +3514,7 @@ class Base:
 				self.set_zoom_sensitivities()
 				if wanted_zoomratio > 1:
 					# Revert to 1:1 zoom
-					self.zoom_1_to_1(action, False, False)
+					self.zoom_1_to_1(action)
 				else:
 					self.put_zoom_image_to_window(False, wanted_zoomratio)
 					self.update_statusbar()
@@ -3197,15 +3522,11 @@ class Base:
 				self.last_image_action_was_smart_fit = True
 
 	def zoom_1_to_1_action(self, action):
-		self.zoom_1_to_1(action, False, False)
-
-	def zoom_1_to_1(self, action, is_preloadimg_next, is_preloadimg_prev):
-		if is_preloadimg_next:
-			if self.usettings['preloading_images']:
-				self.nextimg.zoomratio = 1
-		elif is_preloadimg_prev:
-			if self.usettings['preloading_images']:
-				self.previmg.zoomratio = 1
+		self.zoom_1_to_1(action)
+
+	def zoom_1_to_1(self, action, preloadimg=None):
+		if preloadimg:
+			preloadimg.zoomratio = 1
 		else:
 			if self.currimg.isloaded and (self.slideshow_mode or self.currimg.animation or (not self.currimg.animation and self.UIManager.get_widget('/MainMenu/ViewMenu/1:1').get_property('sensitive'))):
 				self.image_zoomed = True
@@ -3215,13 +3536,13 @@ class Base:
 				self.put_zoom_image_to_window(False, wanted_zoomratio)
 				self.update_statusbar()
 
-	def zoom_check_and_execute(self,action, is_preloadimg_next, is_preloadimg_prev):
+	def zoom_check_and_execute(self, action, preloadimg=None):
 		if self.usettings['open_mode'] == self.open_mode_smart or (self.usettings['open_mode'] == self.open_mode_last and self.usettings['last_mode'] == self.open_mode_smart):
-			self.zoom_to_fit_or_1_to_1(action, is_preloadimg_next, is_preloadimg_prev)
+			self.zoom_to_fit_or_1_to_1(action, preloadimg)
 		elif self.usettings['open_mode'] == self.open_mode_fit or (self.usettings['open_mode'] == self.open_mode_last and self.usettings['last_mode'] == self.open_mode_fit):
-			self.zoom_to_fit_window(action, is_preloadimg_next, is_preloadimg_prev)
+			self.zoom_to_fit_window(action, preloadimg)
 		elif self.usettings['open_mode'] == self.open_mode_1to1 or (self.usettings['open_mode'] == self.open_mode_last and self.usettings['last_mode'] == self.open_mode_1to1):
-			self.zoom_1_to_1(action, is_preloadimg_next, is_preloadimg_prev)
+			self.zoom_1_to_1(action, preloadimg)
 
 	def rotate_left(self, action):
 		self.rotate_left_or_right('/MainMenu/EditMenu/Rotate Left', 90)
@@ -3231,12 +3552,14 @@ class Base:
 
 	def rotate_left_or_right(self, widgetname, angle):
 		if self.currimg.isloaded and self.UIManager.get_widget(widgetname).get_property('sensitive'):
+			if not self.load_full_image():
+				return
 			self.currimg.rotate_pixbuf(angle)
 			if self.last_image_action_was_fit:
 				if self.last_image_action_was_smart_fit:
-					self.zoom_to_fit_or_1_to_1(None, False, False)
+					self.zoom_to_fit_or_1_to_1(None)
 				else:
-					self.zoom_to_fit_window(None, False, False)
+					self.zoom_to_fit_window(None)
 			else:
 				self.layout.set_size(self.currimg.width, self.currimg.height)
 				self.imageview.set_from_pixbuf(self.currimg.pixbuf)
@@ -3253,6 +3576,8 @@ class Base:
 
 	def flip_image_vert_or_horiz(self, widgetname, vertical):
 		if self.currimg.isloaded and self.UIManager.get_widget(widgetname).get_property('sensitive'):
+			if not self.load_full_image():
+				return
 			self.currimg.flip_pixbuf(vertical)
 			self.imageview.set_from_pixbuf(self.currimg.pixbuf)
 			self.image_modified = True
@@ -3299,6 +3624,8 @@ class Base:
 			return pix
 
 	def crop_image(self, action):
+		if not self.load_full_image():
+			return
 		dialog = gtk.Dialog(_("Crop Image"), self.window, gtk.DIALOG_MODAL, (gtk.STOCK_CANCEL, gtk.RESPONSE_REJECT))
 		cropbutton = dialog.add_button(_("C_rop"), gtk.RESPONSE_ACCEPT)
 		cropimage = gtk.Image()
@@ -3493,6 +3820,8 @@ class Base:
 			self.drawing_crop_rectangle = False
 
 	def saturation(self, action):
+		if not self.load_full_image():
+			return
 		dialog = gtk.Dialog(_("Saturation"), self.window, gtk.DIALOG_MODAL, (gtk.STOCK_CANCEL, gtk.RESPONSE_REJECT))
 		resizebutton = dialog.add_button(_("_Saturate"), gtk.RESPONSE_ACCEPT)
 		resizeimage = gtk.Image()
@@ -3531,16 +3860,17 @@ class Base:
 		while gtk.events_pending():
 			gtk.main_iteration()
 		try:
-			bak = self.currimg.pixbuf.copy()
-			self.currimg.pixbuf.saturate_and_pixelate(self.currimg.pixbuf, range.get_value(), False)
-			self.imageview.set_from_pixbuf(self.currimg.pixbuf)
-			self.currimg.pixbuf = bak.copy()
-			del bak
+			preview = self.currimg.pixbuf.copy()
+			preview.saturate_and_pixelate(preview, range.get_value(), False)
+			self.imageview.set_from_pixbuf(preview)
+			del preview
 		except:
 			pass
 		gc.collect()
 
 	def resize_image(self, action):
+		if not self.load_full_image():
+			return
 		dialog = gtk.Dialog(_("Resize Image"), self.window, gtk.DIALOG_MODAL, (gtk.STOCK_CANCEL, gtk.RESPONSE_REJECT))
 		resizebutton = dialog.add_button(_("_Resize"), gtk.RESPONSE_ACCEPT)
 		resizeimage = gtk.Image()
@@ -3674,18 +4004,17 @@ class Base:
 				return
 			check_wrap = False
 			prev_img = self.curr_img_in_list
+			skipping = self.navigation.skipping()
 			if location != "RANDOM":
-				self.randomlist = []
-				self.random_image_list = []
-				self.current_random = -9
+				self.shuffle = None
 			if location == "FIRST":
 				self.curr_img_in_list = 0
 			elif location == "RANDOM":
-				if self.randomlist == []:
+				if self.shuffle == None:
 					self.reinitialize_randomlist()
 				else:
 					# check if we have seen every image; if so, reinitialize array and repeat:
-					if all(self.randomlist):
+					if self.shuffle.remaining() == 0:
 						check_wrap = True
 			elif location == "LAST":
 				self.curr_img_in_list = len(self.image_list)-1
@@ -3730,8 +4059,7 @@ class Base:
 					elif location == "RANDOM": #always next random image
 						self.reinitialize_randomlist()
 					if (location == "PREV" or location == "NEXT") and self.going_random:
-						self.randomize_list
-						self.thumblist.clear()
+						self.randomize_list()
 						self.thumbpane_update_images(True, self.curr_img_in_list)
 				elif self.usettings['listwrap_mode'] == 2:
 					if self.curr_img_in_list != self.loaded_img_in_list:
@@ -3784,7 +4112,6 @@ class Base:
 							self.reinitialize_randomlist()
 						if (location == "PREV" or location == "NEXT") and self.going_random:
 							self.randomize_list()
-							self.thumblist.clear()
 							self.thumbpane_update_images(True, self.curr_img_in_list)
 						if self.fullscreen_mode:
 							self.hide_cursor
@@ -3801,26 +4128,36 @@ class Base:
 						elif not self.slideshow_mode and action != "ss" and (location == "PREV" or location == "NEXT" or location == "RANDOM"): #manual prev/next/random action, ignore as if not pressed
 							return
 			if location == "RANDOM":
-				# Find random image that hasn't already been chosen:
-				j = random.randint(0, len(self.image_list)-1)
-				difflength = len(self.randomlist) - len(self.image_list)
-				if difflength > 0:
-					self.randomlist.extend([False]*difflength)
-				if self.randomlist[j]:
-					not_viewed = [idx for idx,val in enumerate(self.randomlist) if not val]
-					j = random.choice(not_viewed)
+				# Next image in the random order that hasn't already been chosen:
+				j = self.shuffle.next()
+				if j < 0:
+					self.reinitialize_randomlist()
+					j = self.shuffle.next()
 				self.curr_img_in_list = j
-				self.randomlist[j] = True
 				self.currimg.name = str(self.image_list[self.curr_img_in_list])
 			if valid_int(location):
 				self.curr_img_in_list = int(location)
+			if location == "NEXT" or location == "PREV" or valid_int(location):
+				self.navigation.add(self.curr_img_in_list - prev_img, len(self.image_list))
+			elif location == "RANDOM":
+				self.navigation.add_random()
+			elif location == "NEXT_SUBFOLDER" or location == "PREV_SUBFOLDER":
+				self.navigation.add_subfolder(1 if location == "NEXT_SUBFOLDER" else -1)
+			else:
+				self.navigation.clear()
 			if self.curr_img_in_list != prev_img: #don't load the same image again if already loaded
 				if not self.fullscreen_mode and (not self.slideshow_mode or (self.slideshow_mode and action != "ss")):
 					self.change_cursor(gtk.gdk.Cursor(gtk.gdk.WATCH))
-				if location == "PREV" or (valid_int(location) and int(location) == prev_img-1):
-					self.load_when_idle = gobject.idle_add(self.load_new_image, True, False, True, True, True, True)
+				check_prev_last = location == "PREV" or (valid_int(location) and int(location) == prev_img-1)
+				if skipping and not self.image_at_hand(self.curr_img_in_list):
+					# The user is going through images faster than they can be
+					# decoded; show the thumbnail, and only load the image
+					# once the user stops at it
+					self.show_thumbnail_preview(self.curr_img_in_list)
+					self.load_deferred = True
+					self.load_when_idle = gobject.timeout_add(int(NavigationTracker.SETTLE * 1000), self.load_new_image, check_prev_last, False, True, True, True, True)
 				else:
-					self.load_when_idle = gobject.idle_add(self.load_new_image, False, False, True, True, True, True)
+					self.load_when_idle = gobject.idle_add(self.load_new_image, check_prev_last, False, True, True, True, True)
 				self.set_go_navigation_sensitivities(False)
 			if self.slideshow_mode:
 				#if self.curr_slideshow_random:
@@ -3900,8 +4237,7 @@ class Base:
 		self.set_random_image_sensitivities(enable)
 
 	def reinitialize_randomlist(self):
-		self.randomlist = [False]*len(self.image_list)
-		self.randomlist[self.curr_img_in_list] = True
+		self.shuffle = ShuffleOrder(len(self.image_list), self.curr_img_in_list)
 
 	def shall_we_randomize(self,action):
 		if self.UIManager.get_widget('/MainMenu/GoMenu/Randomize list').get_active():
@@ -3909,7 +4245,6 @@ class Base:
 			self.going_random = True
 			if len(self.image_list) > 0:
 				self.randomize_list()
-				self.thumblist.clear()
 				self.curr_img_in_list = self.image_list.index(self.currimg.name)
 				self.thumbpane_update_images(True, self.curr_img_in_list)
 				self.currimg.index = self.curr_img_in_list
@@ -3919,8 +4254,9 @@ class Base:
 
 	def randomize_list(self):
 		random.shuffle(self.image_list)
-		self.previmg.unload_pixbuf()
-		self.nextimg.unload_pixbuf()
+		self.preloaded.clear()
+		self.shuffle = None
+		self.navigation.clear()
 
 	def image_load_failed(self, reset_cursor, filename=""):
 		# If a filename is provided, use it for display:
@@ -3943,24 +4279,41 @@ class Base:
 			gobject.source_remove(self.load_when_idle)
 		except:
 			pass
+		if self.load_deferred:
+			self.load_deferred = False
+			self.skipped_loads += 1
+		if self.current_decode != None:
+			self.current_decode.cancel()
+			self.current_decode = None
 		try:
 			gobject.source_remove(self.preload_when_idle)
 		except:
 			pass
+
+	def preload_stop_now(self):
+		# Stops preloading, which is started again for the new window size
+		# after a resize. An image that is being loaded is left alone.
 		try:
-			gobject.source_remove(self.preload_when_idle2)
+			gobject.source_remove(self.preload_when_idle)
 		except:
 			pass
+		self.cancel_preload_decodes()
 
 	def load_new_image(self, check_prev_last, use_current_pixbuf_original, reset_cursor, perform_onload_action, preload_next_image_after, preload_prev_image_after):
+		# Unless the image is at hand already, it is decoded in the
+		# background and shown once it is ready (see current_image_decoded)
+		self.load_deferred = False
+		if self.curr_img_in_list != self.loaded_img_in_list and self.curr_img_in_list >= 0 and self.curr_img_in_list < len(self.image_list):
+			name = str(self.image_list[self.curr_img_in_list])
+			if self.curr_img_in_list not in self.preloaded and self.image_cache.get(name) == None:
+				self.decode_current_image(name, (check_prev_last, use_current_pixbuf_original, reset_cursor, perform_onload_action, preload_next_image_after, preload_prev_image_after))
+				return
 		try:
 			self.load_new_image2(check_prev_last, use_current_pixbuf_original, reset_cursor, perform_onload_action)
 		except:
 			self.image_load_failed(True)
-		if preload_next_image_after:
-			self.preload_when_idle = gobject.idle_add(self.preload_next_image, False)
-		if preload_prev_image_after:
-			self.preload_when_idle2 = gobject.idle_add(self.preload_prev_image, False)
+		if preload_next_image_after or preload_prev_image_after:
+			self.schedule_preload()
 
 	def load_new_image2(self, check_prev_last, use_current_pixbuf_original, reset_cursor, perform_onload_action, skip_recentfiles=False, image_name=""):
 		# check_prev_last is used to determine if we should check whether
@@ -3970,51 +4323,17 @@ class Base:
 		# If use_current_pixbuf_original == True, do not reload the
 		# self.currimg.pixbuf_original from the file; instead, use the existing
 		# one. This is only currently useful for resizing images.
-		# Determine the indices in the self.image_list array for the
-		# previous and next preload images.
-		next_index = self.curr_img_in_list + 1
-		if next_index > len(self.image_list)-1:
-			if self.usettings['listwrap_mode'] == 0:
-				next_index = -1
-			else:
-				next_index = 0
-		prev_index = self.curr_img_in_list - 1
-		if prev_index < 0:
-			if self.usettings['listwrap_mode'] == 0:
-				prev_index = -1
-			else:
-				prev_index = len(self.image_list)-1
-		used_prev = False
-		used_next = False
-		if self.usettings['preloading_images']:
-			if self.curr_img_in_list != self.loaded_img_in_list:
-				if self.curr_img_in_list == self.previmg.index:
-					#Can Copy previmg into currimg
-					if self.loaded_img_in_list == next_index:
-						self.nextimg = copy.copy(self.currimg)
-						self.currimg = copy.copy(self.previmg)
-					else:
-						self.currimg = copy.copy(self.previmg)
-					self.previmg.unload_pixbuf()
-					used_prev = True
-				elif self.curr_img_in_list == self.nextimg.index:
-					#Can Copy nextimg into currimg
-					if self.loaded_img_in_list == prev_index:
-						self.previmg = copy.copy(self.currimg)
-						self.currimg = copy.copy(self.nextimg)
-					else:
-						self.currimg = copy.copy(self.nextimg)
-					self.nextimg.unload_pixbuf()
-					used_next = True
-				else:
-					if self.previmg.index == next_index:
-						self.nextimg = self.previmg
-						self.previmg.unload_pixbuf()
-					elif self.nextimg.index == prev_index:
-						self.previmg = self.nextimg
-						self.nextimg.unload_pixbuf()
-
-		if used_prev or used_next:
+		# If the image has been preloaded, it is taken from
+		# self.preloaded instead of being loaded again. Returns False if
+		# loading the image was given up for another one.
+		used_preload = False
+		if self.curr_img_in_list != self.loaded_img_in_list:
+			img = self.preloaded.take(self.curr_img_in_list)
+			if img != None:
+				self.replace_current_image(img)
+				used_preload = True
+
+		if used_preload:
 			if self.verbose and self.currimg.name != "":
 				print _("Loading(preloaded): %s") % self.currimg.name
 			self.put_zoom_image_to_window(True)
@@ -4033,7 +4352,6 @@ class Base:
 				self.last_image_action_was_fit = False
 		else:
 			# Need to load the current image
-			self.currimg.unload_pixbuf()
 			if image_name == "":
 				if len(self.image_list) == 1:
 					image_name = str(self.image_list[0])
@@ -4041,15 +4359,29 @@ class Base:
 					image_name = str(self.image_list[self.curr_img_in_list])
 			if self.verbose and image_name != "":
 				print _("Loading(not preloaded): %s") % image_name
+			index = -2
 			if self.curr_img_in_list:
-				self.currimg.load_pixbuf(image_name, self.curr_img_in_list)
+				index = self.curr_img_in_list
+			if self.image_cache.get(image_name) != None:
+				img = self.preloaded.new_entry()
+				img.load_pixbuf(image_name, index, self.image_cache)
 			else:
-				self.currimg.load_pixbuf(image_name)
+				# Decoded in the background like any other image, the window
+				# keeps being drawn and shows previews meanwhile
+				job, img = self.decode_and_wait(image_name, index, self.decode_fit_size(), True)
+				if img == None:
+					if job.cancelled:
+						# Another image is being loaded instead
+						return False
+					self.replace_current_image(self.preloaded.new_entry())
+					raise IOError(image_name)
+				self.image_cache.add_image(img)
+			self.replace_current_image(img)
 			if self.currimg.animation:
-				self.zoom_1_to_1(None, False, False)
+				self.zoom_1_to_1(None)
 				self.set_image_sensitivities(False)
 			else:
-				self.zoom_check_and_execute(None, False, False)
+				self.zoom_check_and_execute(None)
 				self.set_image_sensitivities(True)
 		if self.onload_cmd != None and perform_onload_action:
 			self.parse_action_command(self.onload_cmd, False)
@@ -4059,69 +4391,367 @@ class Base:
 		self.image_modified = False
 		self.image_zoomed = False
 		self.set_slideshow_sensitivities()
+		# Drop the preloaded images that are too far away now
+		if self.usettings['preloading_images']:
+			wanted = self.preload_indices()
+			self.preloaded.trim(wanted)
+			self.cancel_preload_decodes(wanted)
+		else:
+			self.preloaded.clear()
+			self.cancel_preload_decodes()
 		#if not skip_recentfiles:
 		#	self.register_file_with_recent_docs(self.currimg.name)
 		if reset_cursor:
 			if not self.fullscreen_mode:
 				self.change_cursor(None)
+		return True
 
-	def preload_next_image(self, use_existing_image):
+	def replace_current_image(self, img):
+		# Makes img the current image. The image shown so far is kept in
+		# self.preloaded, in case the user goes back to it; its ImageData
+		# is reused for another preload otherwise.
+		if self.currimg.isloaded and self.loaded_img_in_list >= 0 and self.loaded_img_in_list != self.curr_img_in_list and self.usettings['preloading_images']:
+			self.currimg.index = self.loaded_img_in_list
+			self.preloaded.put(self.currimg)
+		else:
+			self.preloaded.recycle(self.currimg)
+		if self.larger_decode != None:
+			self.larger_decode.cancel()
+			self.larger_decode = None
+		self.currimg = img
+
+	def preload_indices(self):
+		# Returns the indices of the images to keep preloaded around the
+		# current one, most likely to be shown next first. Without recent
+		# navigation, these are preload_depth images on each side, the next
+		# image before the previous one at the same distance. While the user
+		# moves through the list in one direction, or a slideshow is running,
+		# more images are preloaded ahead: as many as are passed in the time
+		# it takes to decode one, so that they are ready when reached.
+		indices = []
+		count = len(self.image_list)
+		if count < 2:
+			return indices
+		depth = self.usettings['preload_depth']
+		direction = self.navigation.direction()
+		rate = self.navigation.rate()
+		def add(index):
+			if self.usettings['listwrap_mode'] != 0:
+				index %= count
+			if index >= 0 and index < count and index != self.curr_img_in_list and index not in indices:
+				indices.append(index)
+		if self.shuffle != None:
+			# Going to random images, which come in a known order
+			for index in self.shuffle.upcoming(self.navigation.lookahead(depth, rate, self.decode_seconds)):
+				add(index)
+			add(self.curr_img_in_list + 1)
+			add(self.curr_img_in_list - 1)
+			return indices
+		if self.slideshow_mode and self.curr_slideshow_delay > 0:
+			direction = 1
+			rate = max(rate, 1.0 / self.curr_slideshow_delay)
+		subfolder = self.navigation.subfolder_direction()
+		if subfolder and len(self.firstimgindex_subfolders_list) >= 2:
+			# Another jump to the first image of a subfolder is likely
+			first_images = self.get_firstimgindex_curr_next_prev_subfolder(self.curr_img_in_list)
+			add(first_images[1] if subfolder > 0 else first_images[-1])
+		if direction == 0:
+			for distance in xrange(1, depth + 1):
+				add(self.curr_img_in_list + distance)
+				add(self.curr_img_in_list - distance)
+		else:
+			ahead = self.navigation.lookahead(depth, rate, self.decode_seconds)
+			for distance in xrange(1, ahead + 1):
+				add(self.curr_img_in_list + direction * distance)
+			add(self.curr_img_in_list - direction)
+		return indices
+
+	def schedule_preload(self, rezoom=False):
+		# Fills self.preloaded from the idle loop. If rezoom is set, the
+		# images preloaded already are zoomed again first (e.g. after the
+		# window has been resized).
+		self.preload_rezoom = self.preload_rezoom or rezoom
 		try:
-			if self.usettings['preloading_images'] and len(self.image_list) > 1:
-				if not use_existing_image:
-					next_index = self.curr_img_in_list + 1
-					if next_index > len(self.image_list)-1:
-						if self.usettings['listwrap_mode'] == 0:
-							self.nextimg.unload_pixbuf()
-							return
-						else:
-							next_index = 0
-					if next_index == self.nextimg.index:
-						return
-					name = str(self.image_list[next_index])
-					self.nextimg.load_pixbuf(name, next_index)
-				if self.nextimg.index == -1:
-					return
-				# Determine self.nextimg.zoomratio
-				self.zoom_check_and_execute(None, True, False)
-				# Zoom pixbuf
-				colormap = self.imageview.get_colormap()
-				self.nextimg.zoom_pixbuf(self.nextimg.zoomratio, self.zoom_quality, colormap)
-				gc.collect()
-				if self.verbose:
-					print _("Preloading: %s") % self.nextimg.name
+			gobject.source_remove(self.preload_when_idle)
+		except:
+			pass
+		self.preload_when_idle = gobject.idle_add(self.preload_images)
+
+	def preload_images(self):
+		# Starts decoding the images that are missing from self.preloaded
+		# in the background, nearest first. Images that are in the image
+		# cache only need to be zoomed, which is done right away.
+		if not self.usettings['preloading_images'] or len(self.image_list) < 2:
+			return False
+		if self.preload_rezoom:
+			self.preload_rezoom = False
+			for img in list(self.preloaded):
+				if img.isloaded and not self.zoom_preloaded_image(img):
+					# Decoded for a smaller window, decode it again below
+					self.preloaded.discard(img.index)
+		for rank, index in enumerate(self.preload_indices()):
+			if index in self.preloaded or index in self.preload_decodes:
+				continue
+			name = str(self.image_list[index])
+			if self.image_cache.get(name) == None or not self.preload_image(index, True):
+				self.preload_decodes[index] = self.image_decoder.decode(name, index, rank + 1, self.preload_decoded, self.preloaded.new_entry(), fit_size=self.decode_fit_size())
+		return False
+
+	def preload_decoded(self, job, img):
+		# Called from the main loop when a preload has been decoded, with
+		# img None if the image could not be decoded
+		if self.preload_decodes.get(job.index) is job:
+			del self.preload_decodes[job.index]
+		self.update_decode_seconds(job)
+		if not self.usettings['preloading_images'] or job.index >= len(self.image_list) or self.image_list[job.index] != job.name or job.index not in self.preload_indices():
+			self.preloaded.recycle(job.img)
+			return
+		if img == None:
+			# Keep an empty entry, so that the image is not tried again
+			img = job.img
+			img.unload_pixbuf()
+			img.index = job.index
+		else:
+			self.image_cache.add_image(img)
+			try:
+				self.zoom_preloaded_image(img)
+			except Exception as e:
+				print (e)
+				img.unload_pixbuf()
+				img.index = job.index
+			if self.verbose and img.isloaded:
+				print _("Preloading: %s") % img.name
+		self.preloaded.put(img)
+
+	def cancel_preload_decodes(self, keep=()):
+		for index in self.preload_decodes.keys():
+			if index not in keep:
+				self.preload_decodes.pop(index).cancel()
+
+	def decode_current_image(self, name, args):
+		# Decodes the current image in the background; load_new_image is
+		# called with args once it is done. A preload of the same image
+		# that is being decoded already is taken over.
+		if self.current_decode != None:
+			self.current_decode.cancel()
+		self.current_decode_args = args
+		job = self.preload_decodes.pop(self.curr_img_in_list, None)
+		if job != None and job.started and not job.cancelled:
+			job.on_done = self.current_image_decoded
+		else:
+			if job != None:
+				job.cancel()
+			job = self.image_decoder.decode(name, self.curr_img_in_list, 0, self.current_image_decoded, self.preloaded.new_entry(), self.current_image_preview, (self.available_image_width(), self.available_image_height()), self.decode_fit_size())
+		self.current_decode = job
+
+	def decode_fit_size(self):
+		# Returns the size that images need to be decoded at when they are
+		# fit to the window, or None if they are opened at 1:1
+		mode = self.usettings['open_mode']
+		if mode == self.open_mode_last:
+			mode = self.usettings['last_mode']
+		if mode == self.open_mode_smart or mode == self.open_mode_fit:
+			return (self.available_image_width(), self.available_image_height())
+		return None
+
+	def load_full_image(self):
+		# Decodes the current image at full size if only a reduced version
+		# of it was decoded to fit the window; needed before editing the
+		# image. The window is still drawn while it is decoded. Returns
+		# False if it could not be decoded, or another image has been
+		# shown meanwhile.
+		if not self.currimg.isloaded or not self.currimg.reduced:
+			return True
+		if self.larger_decode != None:
+			self.larger_decode.cancel()
+			self.larger_decode = None
+		name = self.currimg.name
+		self.change_cursor(gtk.gdk.Cursor(gtk.gdk.WATCH))
+		job, img = self.decode_and_wait(name, self.currimg.index)
+		if not self.fullscreen_mode:
+			self.change_cursor(None)
+		if img == None:
+			return False
+		if self.currimg.name == name and self.currimg.reduced:
+			self.image_cache.add_image(img)
+			self.currimg.take_decoded(img)
+		self.preloaded.recycle(img)
+		return self.currimg.name == name and not self.currimg.reduced
+
+	def decode_and_wait(self, name, index, fit_size=None, current=False):
+		# Decodes name through self.image_decoder ahead of the preloads and
+		# runs the GTK main loop until it is done. Returns (job, img), with
+		# img the decoded ImageData, or None if the file could not be
+		# decoded (see job.cancelled for whether the decode was given up).
+		# If current is set, it is the decode of the image to be shown: it
+		# shows previews, and is given up when another image is loaded.
+		done = []
+		def decoded(job, img):
+			done.append(img)
+		if current:
+			if self.current_decode != None:
+				self.current_decode.cancel()
+			job = self.image_decoder.decode(name, index, 0, decoded, self.preloaded.new_entry(), self.current_image_preview, (self.available_image_width(), self.available_image_height()), fit_size)
+			self.current_decode = job
+		else:
+			job = self.image_decoder.decode(name, index, 0, decoded, self.preloaded.new_entry(), fit_size=fit_size)
+		while not done and not job.cancelled:
+			if gtk.main_iteration(True):
+				# gtk.main_quit() has been called
+				job.cancel()
+		if self.current_decode is job:
+			self.current_decode = None
+		if not done:
+			return job, None
+		if done[0] == None:
+			self.preloaded.recycle(job.img)
+		return job, done[0]
+
+	def decode_larger_image(self):
+		# If the current image was decoded smaller than it is shown, decodes
+		# it again in the background: at the size that fits the window if
+		# it is shown no larger than that, at full size if it is zoomed in
+		# further. It is shown scaled up meanwhile.
+		img = self.currimg
+		if not img.isloaded or not img.reduced:
+			return
+		width = int(img.width_original * img.zoomratio)
+		height = int(img.height_original * img.zoomratio)
+		# Rounding may leave the decoded image a pixel short
+		if width <= img.pixbuf_original.get_width() + ImageData.ZOOM_TOLERANCE and height <= img.pixbuf_original.get_height() + ImageData.ZOOM_TOLERANCE:
+			return
+		fit_size = (self.available_image_width(), self.available_image_height())
+		if width > fit_size[0] or height > fit_size[1]:
+			fit_size = None
+		job = self.larger_decode
+		if job != None and job.name == img.name and (job.fit_size == None or (fit_size != None and job.fit_size[0] >= fit_size[0] and job.fit_size[1] >= fit_size[1])):
+			# Large enough already
+			return
+		if job != None:
+			job.cancel()
+		self.larger_decode = self.image_decoder.decode(img.name, img.index, 0, self.larger_image_decoded, self.preloaded.new_entry(), fit_size=fit_size)
+
+	def larger_image_decoded(self, job, img):
+		# Shows the current image decoded again by decode_larger_image()
+		if job is not self.larger_decode:
+			self.preloaded.recycle(job.img)
+			return
+		self.larger_decode = None
+		if img != None and self.currimg.name == job.name and self.currimg.reduced and img.pixbuf_original.get_width() > self.currimg.pixbuf_original.get_width():
+			self.image_cache.add_image(img)
+			self.currimg.take_decoded(img)
+			if self.image_loaded and self.loaded_img_in_list == self.curr_img_in_list:
+				self.put_zoom_image_to_window(False, self.currimg.zoomratio)
+		self.preloaded.recycle(job.img)
+
+	def current_image_preview(self, job, pixbuf):
+		# Shows pixbuf, a preview that fits the window, while the current
+		# image is being decoded
+		if job is self.current_decode:
+			self.show_preview(pixbuf)
+
+	def image_at_hand(self, index):
+		# Returns whether the image at index can be shown without decoding it
+		return index in self.preloaded or self.image_cache.get(str(self.image_list[index])) != None
+
+	def show_thumbnail_preview(self, index):
+		# Shows the saved thumbnail of the image at index scaled to the
+		# window, if there is an up to date one, the large one first
+		for flavour in ('large', 'normal'):
+			filename, thumbfile = self.thumbnail_get_name(self.image_list[index], flavour)
+			try:
+				pix = gtk.gdk.pixbuf_new_from_file(thumbfile)
+				if pix.get_option('tEXt::Thumb::MTime') == str(int(os.stat(self.image_list[index]).st_mtime)):
+					break
+			except (gobject.GError, OSError):
+				pass
+		else:
+			return
+		ratio = min(float(self.available_image_width()) / pix.get_width(), float(self.available_image_height()) / pix.get_height())
+		self.show_preview(pix.scale_simple(max(1, int(pix.get_width() * ratio)), max(1, int(pix.get_height() * ratio)), gtk.gdk.INTERP_BILINEAR))
+
+	def show_preview(self, pixbuf):
+		# Shows pixbuf in place of the current image, which is left alone
+		# until the image itself is there
+		self.window.window.freeze_updates()
+		width = pixbuf.get_width()
+		height = pixbuf.get_height()
+		self.layout.set_size(width, height)
+		self.layout.move(self.imageview, max(0, (self.available_image_width() - width)/2), max(0, (self.available_image_height() - height)/2))
+		self.hscroll.hide()
+		self.vscroll.hide()
+		self.imageview.set_from_pixbuf(pixbuf)
+		self.window.window.thaw_updates()
+
+	def update_decode_seconds(self, job):
+		if job.seconds != None:
+			self.decode_seconds += (job.seconds - self.decode_seconds) / 4
+
+	def decode_dropped(self, img):
+		# Called by self.image_decoder with the ImageData of cancelled decodes
+		self.preloaded.recycle(img)
+
+	def current_image_decoded(self, job, img):
+		# Images may have been added to or removed from the list while the
+		# image was decoded, so it is looked up by name rather than by
+		# job.index
+		if job is not self.current_decode:
+			self.preloaded.recycle(job.img)
+			return
+		self.current_decode = None
+		self.update_decode_seconds(job)
+		index = self.curr_img_in_list
+		if index < 0 or index >= len(self.image_list) or self.image_list[index] != job.name:
+			# The current image has been replaced meanwhile, load that one
+			self.preloaded.recycle(job.img)
+			if index >= 0 and index < len(self.image_list) and index != self.loaded_img_in_list:
+				self.load_new_image(*self.current_decode_args)
+			elif not self.fullscreen_mode:
+				self.change_cursor(None)
+			return
+		if img == None:
+			self.preloaded.recycle(job.img)
+			self.image_load_failed(True)
+			return
+		img.index = index
+		self.image_cache.add_image(img)
+		try:
+			self.zoom_preloaded_image(img)
 		except Exception as e:
 			print (e)
-			self.nextimg.unload_pixbuf()
-
-	def preload_prev_image(self, use_existing_image):
+		self.preloaded.put(img)
+		self.load_new_image(*self.current_decode_args)
+
+	def preload_image(self, index, large_enough=False):
+		# Preloads the image at index and returns True. If large_enough is
+		# set, it is left out and False returned if it comes from the image
+		# cache decoded too small for the window.
+		img = self.preloaded.new_entry()
 		try:
-			if self.usettings['preloading_images'] and len(self.image_list) > 1:
-				if not use_existing_image:
-					index = self.curr_img_in_list - 1
-					if index < 0:
-						if self.usettings['listwrap_mode'] == 0:
-							self.previmg.unload_pixbuf()
-							return
-						else:
-							prev_index = len(self.image_list)-1
-					if index == self.previmg.index:
-						return
-					name = str(self.image_list[index])
-					self.previmg.load_pixbuf(name, index)
-				if self.previmg.index == -1:
-					return
-				# Determine self.previmg.zoomratio
-				self.zoom_check_and_execute(None, False, True)
-				# Always start with the original image to preserve quality!
-				colormap = self.imageview.get_colormap()
-				self.previmg.zoom_pixbuf(self.previmg.zoomratio, self.zoom_quality, colormap)
-				gc.collect()
-				if self.verbose:
-					print _("Preloading: %s") % self.previmg.name
+			img.load_pixbuf(str(self.image_list[index]), index, self.image_cache)
+			if not self.zoom_preloaded_image(img) and large_enough:
+				self.preloaded.recycle(img)
+				return False
+			gc.collect()
+			if self.verbose:
+				print _("Preloading: %s") % img.name
 		except Exception as e:
-			print(e)
-			self.previmg.unload_pixbuf()
+			print (e)
+			# Keep the empty entry, so that the image is not tried again
+			img.unload_pixbuf()
+			img.index = index
+		self.preloaded.put(img)
+		return True
+
+	def zoom_preloaded_image(self, img):
+		# Zooms img for the window. Returns False if it was decoded smaller
+		# than that and is scaled up.
+		# Determine img.zoomratio
+		self.zoom_check_and_execute(None, img)
+		# Zoom pixbuf, always starting with the original image to preserve quality
+		colormap = self.imageview.get_colormap()
+		img.zoom_pixbuf(img.zoomratio, self.zoom_quality, colormap)
+		return not img.reduced or int(img.width_original * img.zoomratio) <= img.pixbuf_original.get_width() + ImageData.ZOOM_TOLERANCE
 
 	def change_cursor(self, type):
 		for i in gtk.gdk.window_get_toplevels():
@@ -4131,20 +4761,20 @@ class Base:
 
 	def expand_filelist_and_load_image(self, inputlist):
 		# Takes the current list (i.e. ["pic.jpg", "pic2.gif", "../images"]) and
-		# expands it into a list of all pictures found
-		self.thumblist.clear()
+		# expands it into a list of all pictures found. inputlist can be any
+		# iterable and is only read as far as needed, so that the first image
+		# is shown before the rest of a long list has been looked at.
+		self.thumbpane_images = None
+		self.start_dir_watcher()
+		self.watch_recursive = self.recursive
 		self.images_found = 0
 		self.stop_now = True # Make sure that any previous search process is stopped
+		self.stop_dir_scanner()
+		self.stop_file_list_reader()
 		self.change_cursor(gtk.gdk.Cursor(gtk.gdk.WATCH))
 		# Reset preload images:
-		self.nextimg.unload_pixbuf()
-		self.previmg.unload_pixbuf()
-		# If any directories were passed, display "Searching..." in statusbar:
+		self.preloaded.clear()
 		self.searching_for_images = False
-		for item in inputlist:
-			if os.path.isdir(item):
-				self.searching_for_images = True
-				self.update_statusbar()
 		if not self.closing_app:
 			while gtk.events_pending():
 				gtk.main_iteration()
@@ -4152,99 +4782,84 @@ class Base:
 		first_image_found = False
 		first_image_loaded = False
 		first_image_loaded_successfully = False
-		self.previmg.unload_pixbuf()
-		self.nextimg.unload_pixbuf()
 		second_image = ""
 		second_image_found = False
 		second_image_preloaded = False
-		self.randomlist = []
+		self.shuffle = None
+		self.navigation.clear()
 		folderlist = []
-		self.image_list = []
+		self.image_list = ImageList()
+		self.thumbpane_clear_list()
 		self.curr_img_in_list = -2
 		go_buttons_enabled = False
 		self.set_go_sensitivities(False)
-		# Clean up list (remove preceding "file://" or "file:" and trailing "/")
-		for itemnum in range(len(inputlist)):
-			# Strip off preceding file..
-			if inputlist[itemnum].startswith('file://'):
-				inputlist[itemnum] = inputlist[itemnum][7:].decode('utf-8')
-			elif inputlist[itemnum].startswith('file:'):
-				inputlist[itemnum] = inputlist[itemnum][5:].decode('utf-8')
-			# Strip off trailing "/" if it exists:
-			if inputlist[itemnum][len(inputlist[itemnum])-1] == "/":
-				inputlist[itemnum] = inputlist[itemnum][:(len(inputlist[itemnum])-1)]
-			if not (inputlist[itemnum].startswith('http://') or inputlist[itemnum].startswith('ftp://')):
-				inputlist[itemnum] = os.path.abspath(inputlist[itemnum])
-			else:
-				try:
-					# Remote file. Save as /tmp/mirage-<random>/filename.ext
-					tmpdir = tempfile.mkdtemp(prefix="mirage-") + "/"
-					tmpfile = tmpdir + os.path.basename(inputlist[itemnum])
-					socket.setdefaulttimeout(5)
-					urllib.urlretrieve(inputlist[itemnum], tmpfile)
-					inputlist[itemnum] = tmpfile.decode('utf-8')
-				except:
-					pass
-		# Remove hidden files from list:
-		if not self.usettings['open_hidden_files']:
-			tmplist = []
-			for item in inputlist:
-				if os.path.basename(item)[0] != '.':
-					tmplist.append(item)
-				elif self.verbose:
-					print _("Skipping: %s") % item
-			inputlist = tmplist
-			if len(inputlist) == 0:
-				# All files/dirs were hidden, exit..
-				self.currimg.unload_pixbuf()
-				self.searching_for_images = False
-				self.set_go_navigation_sensitivities(False)
-				self.set_slideshow_sensitivities()
-				if not self.closing_app:
-					self.change_cursor(None)
-				self.recursive = False
-				self.put_error_image_to_window()
-				self.update_title()
-				return
-		init_image = os.path.abspath(inputlist[0])
+		# The entries are read and checked in the background, and come in
+		# in batches
+		batches = self.read_input(inputlist, not self.usettings['open_all_images'])
+		first_batch = next(batches, None)
+		if first_batch == None:
+			# Nothing to open, or all files/dirs were hidden, exit..
+			self.currimg.unload_pixbuf()
+			self.searching_for_images = False
+			self.set_go_navigation_sensitivities(False)
+			self.set_slideshow_sensitivities()
+			if not self.closing_app:
+				self.change_cursor(None)
+			self.recursive = False
+			self.put_error_image_to_window()
+			self.update_title()
+			return
+		init_image = first_batch[0][0]
 		if self.valid_image(init_image):
 			try:
-				self.load_new_image2(False, False, True, True, image_name=init_image)
-				# Calling load_new_image2 will reset the following two vars
-				# to 0, so ensure they are -1 again (no images preloaded)
-				self.previmg.unload_pixbuf()
-				self.nextimg.unload_pixbuf()
-				if not self.currimg.animation:
-					self.previmg_width = self.currimg.width
-				else:
-					self.previmg_width = self.currimg.width
-				self.image_loaded = True
-				first_image_loaded_successfully = True
-				first_image_loaded = True
-				print "Quickloaded image ahead of imagelist"
-				if not self.closing_app:
-					while gtk.events_pending():
-						gtk.main_iteration(True)
+				if self.load_new_image2(False, False, True, True, image_name=init_image):
+					# No images are preloaded yet
+					self.preloaded.clear()
+					if not self.currimg.animation:
+						self.previmg_width = self.currimg.width
+					else:
+						self.previmg_width = self.currimg.width
+					self.image_loaded = True
+					first_image_loaded_successfully = True
+					first_image_loaded = True
+					print "Quickloaded image ahead of imagelist"
+					if not self.closing_app:
+						while gtk.events_pending():
+							gtk.main_iteration(True)
 			except:
 				pass
 
 		self.stop_now = False
 		# If open all images in dir...
 		if self.usettings['open_all_images']:
-			temp = inputlist
-			inputlist = []
-			for item in temp:
-				if os.path.isfile(item):
-					itempath = os.path.dirname(os.path.abspath(item))
+			folders = []
+			dirlist = []
+			found_dirs = set()
+			for batch in itertools.chain([first_batch], batches):
+				# The folders of each batch are read before the next batch
+				dirlist = []
+				for item, is_dir in batch:
+					if is_dir:
+						folders.append(item)
+					else:
+						dirname = os.path.dirname(item)
+						if dirname not in found_dirs:
+							found_dirs.add(dirname)
+							dirlist.append(dirname)
+				if len(dirlist) > 0:
 					temp = self.recursive
 					self.recursive = False
 					self.stop_now = False
-					self.expand_directory(itempath, False, go_buttons_enabled, False, False)
+					if first_image_loaded_successfully and not self.image_list_growing:
+						# The image is shown already, let the user browse its
+						# folder while it is read
+						self.image_list_ready()
+					self.expand_directories(dirlist, False, go_buttons_enabled, False, False)
 					self.recursive = temp
-				else:
-					inputlist.append(item)
-			for item in self.image_list:
-				inputlist.append(item)
+			self.image_list_growing = False
+			# The images found have been checked by the folder scan already
+			images = list(self.image_list)
+			for i, item in enumerate(images):
 				if first_image_found and not second_image_found:
 					second_image_found = True
 					second_image = item
@@ -4253,29 +4868,56 @@ class Base:
 					first_image_found = True
 					first_image = item
 					first_image_came_from_dir = False
-					self.curr_img_in_list = len(inputlist)-1
-		self.image_list = []
-		for item in inputlist:
-			if not self.closing_app:
-				if os.path.isfile(item):
-					if self.valid_image(item):
-						if not second_image_found and first_image_found:
-							second_image_found = True
-							second_image = item
-							second_image_came_from_dir = False
-						if not first_image_found:
-							first_image_found = True
-							first_image = item
-							first_image_came_from_dir = False
-						self.image_list.append(item)
-						if self.verbose:
+					self.curr_img_in_list = i
+			inputs = [[(item, False) for item in images] + [(item, True) for item in folders]]
+		else:
+			inputs = itertools.chain([first_batch], batches)
+		self.image_list = ImageList()
+		sort_key = self.sort_key()
+		for batch in inputs:
+			if self.closing_app:
+				break
+			if self.image_list_growing:
+				# The list can be browsed already, the images of later batches
+				# are merged into it as they come in
+				images = [item for item, is_dir in batch if not is_dir]
+				folderlist.extend([item for item, is_dir in batch if is_dir])
+				self.sort_list_in_place(images)
+				curr_name = self.image_list_current()
+				added, start = self.image_list.merge_sorted(images, sort_key)
+				if added:
+					self.image_list_grown(start, added, curr_name)
+					if self.verbose:
+						for item in added:
 							self.images_found += 1
 							print _("Found: %(item)s [%(number)i]") % {'item': item, 'number': self.images_found}
+					self.update_title()
+				continue
+			for item, is_dir in batch:
+				if self.closing_app:
+					break
+				if not is_dir:
+					if not second_image_found and first_image_found:
+						second_image_found = True
+						second_image = item
+						second_image_came_from_dir = False
+					if not first_image_found:
+						first_image_found = True
+						first_image = item
+						first_image_came_from_dir = False
+					self.image_list.append(item)
+					if self.verbose:
+						self.images_found += 1
+						print _("Found: %(item)s [%(number)i]") % {'item': item, 'number': self.images_found}
 				else:
 					# If it's a directory that was explicitly selected or passed to
 					# the program, get all the files in the dir.
 					# Retrieve only images in the top directory specified by the user
 					# unless explicitly told to recurse (via -R or in Settings>Preferences)
+					if not self.searching_for_images:
+						# Display "Searching..." in statusbar:
+						self.searching_for_images = True
+						self.update_statusbar()
 					folderlist.append(item)
 					if not second_image_found:
 						# See if we can find an image in this directory:
@@ -4304,44 +4946,39 @@ class Base:
 						self.toggle_slideshow(None)
 					if self.verbose and self.currimg.isloaded:
 						print _("Loading: %s") % self.currimg.name
-					self.load_new_image2(False, False, True, True)
-					# Calling load_new_image2 will reset the following two vars
-					# to 0, so ensure they are -1 again (no images preloaded)
-					self.previmg.unload_pixbuf()
-					self.nextimg.unload_pixbuf()
-					self.previmg_width = self.currimg.width
-					self.image_loaded = True
-					first_image_loaded_successfully = True
-					if not self.closing_app:
-						while gtk.events_pending():
-							gtk.main_iteration(True)
+					if self.load_new_image2(False, False, True, True):
+						# No images are preloaded yet
+						self.preloaded.clear()
+						self.previmg_width = self.currimg.width
+						self.image_loaded = True
+						first_image_loaded_successfully = True
+						if not self.closing_app:
+							while gtk.events_pending():
+								gtk.main_iteration(True)
 					if first_image_came_from_dir:
-						self.image_list = []
+						self.image_list = ImageList()
 				# Pre-load second image:
 				if second_image_found and not second_image_preloaded and ((not second_image_came_from_dir and self.curr_img_in_list+1 <= len(self.image_list)-1) or second_image_came_from_dir):
 					second_image_preloaded = True
-					temp = self.image_list
-					self.image_list = []
-					while len(self.image_list) < self.curr_img_in_list+1:
-						self.image_list.append(first_image)
-					self.image_list.append(second_image)
-					self.preload_next_image(False)
-					self.image_list = temp
-		if first_image_found:
-			# Sort the filelist and folderlist alphabetically, and recurse into folderlist:
-			if first_image_came_from_dir:
-				self.add_folderlist_images(folderlist, go_buttons_enabled)
+					# Decoded in the background; it is only kept if it is at
+					# that index in the list by then
+					index = self.curr_img_in_list+1
+					if index not in self.preload_decodes:
+						self.preload_decodes[index] = self.image_decoder.decode(second_image, index, 1, self.preload_decoded, self.preloaded.new_entry(), fit_size=self.decode_fit_size())
+			if first_image_loaded_successfully and self.currimg.name in self.image_list and not self.image_list_growing:
+				# Let the user browse the images found so far while the rest
+				# of the list is read
 				self.do_image_list_stuff()
-			else:
+				self.image_list_ready()
+		if first_image_found:
+			# Sort the filelist, then recurse into folderlist. The images found
+			# there are merged into the sorted list as they come in, while the
+			# user can already navigate it:
+			if not self.image_list_growing:
 				self.do_image_list_stuff()
-				self.add_folderlist_images(folderlist, go_buttons_enabled)
-
-			prev_image = ''
-			self.firstimgindex_subfolders_list = []
-			for i, image in enumerate(self.image_list):
-				if os.path.dirname(image) != os.path.dirname(prev_image):
-					self.firstimgindex_subfolders_list.append(i)
-				prev_image = image
+				self.image_list_ready()
+			self.add_folderlist_images(folderlist, go_buttons_enabled)
+			self.image_list_growing = False
 
 			if not self.closing_app:
 				while gtk.events_pending():
@@ -4351,31 +4988,158 @@ class Base:
 		else:
 			if self.verbose:
 				print "name:" + self.currimg.name
-			self.curr_img_in_list = self.image_list.index(self.currimg.name)
+			if self.curr_img_in_list < 0:
+				self.curr_img_in_list = self.image_list.index(self.currimg.name)
 			self.update_title()
 		self.searching_for_images = False
 		self.update_statusbar()
 		self.register_file_with_recent_docs(self.currimg.name)
 		self.set_go_navigation_sensitivities(False)
 		self.set_slideshow_sensitivities()
-		self.thumbpane_update_images(True, self.curr_img_in_list)
+		# The thumbpane has been filled along with the list, unless no image
+		# was found
+		self.thumbpane_update_images(not first_image_found, self.curr_img_in_list)
 		if not self.closing_app:
 			self.change_cursor(None)
 		self.recursive = False
+		if self.scan_cache:
+			self.scan_cache.save()
+		self.release_dir_watcher_events()
 
 	def sort_list_in_place(self, list):
-		if self.no_sort:
+		# Keys are computed once per item, instead of comparing the items
+		# themselves O(n log n) times
+		key = self.sort_key()
+		if key == None:
 			return
+		if isinstance(list, ImageList):
+			list.sort(key=list.cached_key(key))
+		else:
+			list.sort(key=key)
+
+	def sort_key(self):
+		# Returns the key function lists are sorted by, or None if lists are
+		# not sorted
+		if self.no_sort:
+			return None
 
 		#Sort based on a numerical aware sort or normal alphabetical sort
 		if self.usettings['use_numacomp'] and HAVE_NUMACOMP:
 			#Use case-sensitive sort?
 			if self.usettings['case_numacomp']:
-				list.sort(cmp=numacomp.numacomp)
+				return numacomp.numakey
 			else:
-				list.sort(cmp=numacomp.numacompi)
+				return numacomp.numakeyi
 		else:
-			list.sort(locale.strcoll)
+			return locale_sort_key
+
+	def input_entries(self, items):
+		# Cleans up the passed files, folders and URLs (removes preceding
+		# "file://" or "file:" and trailing "/", makes paths absolute and
+		# downloads remote files) and yields each resulting path once.
+		# Hidden files are skipped unless they are to be opened.
+		found = set()
+		for item in items:
+			# Strip off preceding file..
+			if item.startswith('file://'):
+				item = item[7:].decode('utf-8')
+			elif item.startswith('file:'):
+				item = item[5:].decode('utf-8')
+			if not item:
+				continue
+			# Strip off trailing "/" if it exists:
+			if len(item) > 1 and item.endswith("/"):
+				item = item[:-1]
+			remote = item.startswith('http://') or item.startswith('ftp://')
+			if not remote:
+				item = os.path.abspath(item)
+			if item in found:
+				continue
+			found.add(item)
+			if remote:
+				try:
+					# Remote file. Save as /tmp/mirage-<random>/filename.ext
+					tmpdir = tempfile.mkdtemp(prefix="mirage-") + "/"
+					tmpfile = tmpdir + os.path.basename(item)
+					socket.setdefaulttimeout(5)
+					urllib.urlretrieve(item, tmpfile)
+					item = tmpfile.decode('utf-8')
+				except:
+					pass
+			# Remove hidden files from list:
+			if not self.usettings['open_hidden_files'] and os.path.basename(item).startswith('.'):
+				if self.verbose:
+					print _("Skipping: %s") % item
+				continue
+			yield item
+
+	def read_input(self, inputlist, only_images):
+		# Yields the entries of inputlist in lists of (path, is_dir), see
+		# classify_input(). They are read and checked in the background by a
+		# FileListReader, and the GTK main loop keeps running while we wait
+		# for them, so that a list read from a slow pipe does not block the
+		# interface.
+		batches = []
+		def classify(entries):
+			return self.classify_input(self.input_entries(entries), only_images)
+		def add_batch(reader, items):
+			batches.append(items)
+		reader = FileListReader(inputlist, classify, add_batch, None, self.file_list_reader_should_stop)
+		self.file_list_reader = reader
+		reader.start()
+		try:
+			while True:
+				while batches:
+					yield batches.pop(0)
+				if reader.finished or reader.cancelled:
+					return
+				if gtk.main_iteration(True):
+					# gtk.main_quit() has been called
+					return
+		finally:
+			reader.cancel()
+
+	def file_list_reader_should_stop(self):
+		# Polled from the reader thread
+		return self.closing_app
+
+	def stop_file_list_reader(self):
+		if self.file_list_reader:
+			self.file_list_reader.cancel()
+			self.file_list_reader = None
+
+	def classify_input(self, entries, only_images=True):
+		# Yields (path, is_dir) for the folders and the image files among
+		# entries, or all files if only_images is False, in order. Files
+		# that do not exist are left out. Entries are checked in chunks that
+		# grow from a single one, so that the first image is available at
+		# once while long lists are still filtered in bulk.
+		entries = iter(entries)
+		chunk_size = 1
+		while True:
+			chunk = list(itertools.islice(entries, chunk_size))
+			if not chunk:
+				return
+			chunk_size = min(chunk_size * 2, 1024)
+			kinds = []
+			files = []
+			for item in chunk:
+				try:
+					mode = os.stat(item).st_mode
+				except OSError:
+					if self.verbose:
+						print _("Skipping: %s") % item
+					continue
+				if stat.S_ISDIR(mode):
+					kinds.append((item, True))
+				elif stat.S_ISREG(mode):
+					kinds.append((item, False))
+					files.append(item)
+			if only_images:
+				images = set(self.filter_images(files))
+				kinds = [(item, is_dir) for item, is_dir in kinds if is_dir or item in images]
+			for kind in kinds:
+				yield kind
 
 	def remove_duplicates_from_list(self, list):
 		found = set()
@@ -4390,60 +5154,332 @@ class Base:
 		if len(folderlist) > 0:
 			folderlist = self.remove_duplicates_from_list(folderlist)
 			self.sort_list_in_place(folderlist)
-			for item in folderlist:
-				if not self.closing_app:
-					if (not self.usettings['open_hidden_files'] and os.path.basename(item)[0] != '.') or self.usettings['open_hidden_files']:
-						self.stop_now = False
-						self.expand_directory(item, False, go_buttons_enabled, True, True)
+			if not self.usettings['open_hidden_files']:
+				folderlist = [item for item in folderlist if os.path.basename(item)[0] != '.']
+			if not self.closing_app:
+				self.stop_now = False
+				self.expand_directories(folderlist, False, go_buttons_enabled, True, True)
 
 	def do_image_list_stuff(self):
 		if len(self.image_list) > 0:
 			self.set_go_navigation_sensitivities(True)
-			self.image_list = self.remove_duplicates_from_list(self.image_list)
+			if self.image_list.has_duplicates():
+				self.image_list = ImageList(self.remove_duplicates_from_list(self.image_list))
 			self.sort_list_in_place(self.image_list)
 
+	def image_list_ready(self):
+		# Called once the first image is shown and the images known so far
+		# are in self.image_list. Sets up the current index, the subfolder
+		# index and the thumbpane for the list, which may keep growing while
+		# folders are scanned (see image_list_grown).
+		self.curr_img_in_list = self.image_list_index(self.currimg.name)
+		self.loaded_img_in_list = self.curr_img_in_list
+		self.preloaded.relocate(lambda img: self.image_list_index(img.name))
+		self.firstimgindex_subfolders_list = SubfolderIndex(self.image_list)
+		if self.thumbpane_images == None or list(self.thumbpane_images) != list(self.image_list):
+			self.thumbpane_update_images(True, self.curr_img_in_list)
+		self.thumbpane_images = self.image_list
+		self.image_list_growing = True
+		self.update_title()
+		self.set_go_navigation_sensitivities(False)
+
+	def image_list_current(self):
+		# Returns the name at self.curr_img_in_list, which may still be being
+		# loaded, or None. Taken before images are merged into the list, for
+		# image_list_grown.
+		if self.curr_img_in_list >= 0 and self.curr_img_in_list < len(self.image_list):
+			return self.image_list[self.curr_img_in_list]
+		return None
+
+	def image_list_grown(self, start, added, curr_name):
+		# The images in added have been merged into self.image_list, which
+		# is unchanged before start; curr_name is what image_list_current()
+		# returned before. Moves the indices that point into the list along,
+		# so that navigation keeps working while the list grows.
+		prev_curr = self.curr_img_in_list
+		if curr_name == None:
+			# The image on screen has not been found in the list yet
+			curr_name = self.currimg.name
+		self.curr_img_in_list = self.image_list_index(curr_name, prev_curr, start)
+		if self.loaded_img_in_list == prev_curr:
+			self.loaded_img_in_list = self.curr_img_in_list
+		elif self.loaded_img_in_list >= start:
+			# The image on screen, while another one is being loaded
+			self.loaded_img_in_list = self.image_list_index(self.currimg.name, self.loaded_img_in_list, start)
+		self.preloaded.relocate(lambda img: self.image_list_index(img.name, img.index, start))
+		if start == len(self.image_list) - len(added):
+			positions = xrange(start, len(self.image_list))
+		else:
+			added = set(added)
+			positions = [i for i in xrange(start, len(self.image_list)) if self.image_list[i] in added]
+		for i in positions:
+			self.firstimgindex_subfolders_list.insert(i, os.path.dirname(self.image_list[i]))
+		if self.shuffle != None:
+			self.shuffle.insert(positions)
+		self.thumbpane_insert_images(positions)
+		self.set_go_navigation_sensitivities(False)
+
+	def image_list_index(self, name, index=-1, start=0):
+		# Returns the index of name in self.image_list, or -1. If images have
+		# been inserted at or after start, index is where name was before.
+		if index >= 0 and index < start:
+			return index
+		try:
+			return self.image_list.index(name, max(index, start))
+		except ValueError:
+			return -1
+
 	def expand_directory(self, item, stop_when_second_image_found, go_buttons_enabled, update_window_title, print_found_msg):
-		if not self.stop_now and not self.closing_app:
-			folderlist = []
-			filelist = []
-			if not os.access(item, os.R_OK):
-				return False
-			item = item.decode('utf-8')
-			for item2 in os.listdir(item):
-				if not self.closing_app and not self.stop_now:
-					while gtk.events_pending():
-						gtk.main_iteration(True)
-					item2 = item + os.sep + item2
-					item_fullpath2 = os.path.abspath(item2)
-					if (not self.usettings['open_hidden_files'] and os.path.basename(item_fullpath2)[0] != '.') or self.usettings['open_hidden_files']:
-						if os.path.isfile(item_fullpath2) and self.valid_image(item_fullpath2):
-							filelist.append(item2)
-							if self.verbose and print_found_msg:
-								self.images_found += 1
-								print _("Found: %(fullpath)s [%(number)i]") % {'fullpath': item_fullpath2, 'number': self.images_found}
-						elif os.path.isdir(item_fullpath2) and self.recursive:
-							folderlist.append(item_fullpath2)
-					elif self.verbose:
-						print _("Skipping: %s") % item_fullpath2
+		return self.expand_directories([item], stop_when_second_image_found, go_buttons_enabled, update_window_title, print_found_msg)
+
+	def expand_directories(self, items, stop_when_second_image_found, go_buttons_enabled, update_window_title, print_found_msg):
+		# Scans the folders in items (and their subfolders if self.recursive
+		# is set) in background threads, up to scan_threads folders at the
+		# same time. The images found are merged into self.image_list as they
+		# are handed back to the main loop, which keeps running while we wait
+		# so that the interface stays responsive.
+		if self.stop_now or self.closing_app:
+			return
+		roots = []
+		for item in items:
+			if os.access(item, os.R_OK):
+				if isinstance(item, str):
+					item = item.decode('utf-8')
+				roots.append(item)
+		if len(roots) == 0:
+			return False
+		buttons_enabled = [go_buttons_enabled]
+		sort_key = self.sort_key()
+		# Batches that sort into the middle of the list, e.g. from the
+		# subfolders of a folder whose own images have been added already,
+		# are held back and merged together: each merge rewrites the rest
+		# of the list. They are merged once they make up an eighth of the
+		# list, or after held_interval seconds.
+		held = []
+		held_count = [0]
+		held_since = [None]
+		held_interval = 0.5
+		def merge(images):
+			# Each batch is sorted, so it can be merged into the list instead
+			# of sorting the whole list again:
+			curr_name = self.image_list_current()
+			added, start = self.image_list.merge_sorted(images, sort_key)
+			if added and self.image_list_growing:
+				self.image_list_grown(start, added, curr_name)
+			if self.verbose and print_found_msg:
+				for item2 in added:
+					self.images_found += 1
+					print _("Found: %(fullpath)s [%(number)i]") % {'fullpath': item2, 'number': self.images_found}
+		def merge_held():
+			images = [item2 for batch in held for item2 in batch]
+			del held[:]
+			held_count[0] = 0
+			held_since[0] = None
+			self.sort_list_in_place(images)
+			merge(images)
+		def add_images(scanner, dirname, images):
+			if stop_when_second_image_found:
+				images = [item2 for item2 in images if item2 not in self.image_list][:max(0, 2-len(self.image_list))]
+				merge(images)
+			elif images and not self.image_list.sorts_last(images[0], sort_key):
+				held.append(images)
+				held_count[0] += len(images)
+				if held_since[0] == None:
+					held_since[0] = time.time()
+			else:
+				merge(images)
+			if held and (held_count[0] * 8 >= len(self.image_list) or time.time() - held_since[0] >= held_interval):
+				merge_held()
+			if stop_when_second_image_found and len(self.image_list)>=2:
+				scanner.cancel()
+				return
+			if not buttons_enabled[0] and len(self.image_list) > 1:
+				self.set_go_navigation_sensitivities(True)
+				buttons_enabled[0] = True
 			if len(self.image_list)>0 and update_window_title:
 				self.update_title()
-			# Sort the filelist and folderlist alphabetically:
-			if len(filelist) > 0:
-				self.sort_list_in_place(filelist)
-				for item2 in filelist:
-					if not item2 in self.image_list:
-						self.image_list.append(item2)
-						if stop_when_second_image_found and len(self.image_list)==2:
-							return
-						if not go_buttons_enabled and len(self.image_list) > 1:
-							self.set_go_navigation_sensitivities(True)
-							go_buttons_enabled = True
-			# Recurse into the folderlist:
-			if len(folderlist) > 0:
-				self.sort_list_in_place(folderlist)
-				for item2 in folderlist:
-					if not self.stop_now:
-						self.expand_directory(item2, stop_when_second_image_found, go_buttons_enabled, update_window_title, print_found_msg)
+		scanner = DirScanner(roots, self.recursive, self.usettings['open_hidden_files'], self.filter_images, self.sort_list_in_place, add_images, None, self.dir_scanner_should_stop, self.verbose, self.get_scan_cache(), max(1, self.usettings['scan_threads']), self.dir_watcher)
+		self.dir_scanner = scanner
+		scanner.start()
+		while not scanner.finished:
+			if gtk.main_iteration(True):
+				# gtk.main_quit() has been called
+				scanner.cancel()
+				break
+		if held and not scanner.is_cancelled():
+			merge_held()
+			if len(self.image_list)>0 and update_window_title:
+				self.update_title()
+
+	def dir_scanner_should_stop(self):
+		# Polled from the scanner thread
+		return self.stop_now or self.closing_app
+
+	def get_scan_cache(self):
+		if not self.usettings['use_scan_cache']:
+			return None
+		if not self.scan_cache or self.scan_cache.fast_image_detection != self.usettings['fast_image_detection']:
+			if self.scan_cache:
+				self.scan_cache.save()
+			self.scan_cache = ScanCache(os.path.join(self.config_dir, 'scancache.json'), self.usettings['fast_image_detection'], self.image_checked_by_content)
+		return self.scan_cache
+
+	def image_checked_by_content(self, file):
+		# Whether filter_images() has to look into file to tell whether it
+		# is an image. Called from the scanner threads too.
+		return not self.usettings['fast_image_detection'] or self.image_type_from_name(file) == None
+
+	def start_dir_watcher(self):
+		# Replaces the watcher of the previous list with a new one. Changes
+		# it reports are held back until the new list has been built.
+		if self.dir_watcher:
+			self.dir_watcher.close()
+			self.dir_watcher = None
+		self.watch_events_held = True
+		self.watch_pending_events = []
+		if self.usettings['watch_folders'] and HAS_INOTIFY:
+			try:
+				self.dir_watcher = DirWatcher(self.dir_watcher_event)
+			except OSError:
+				if self.verbose:
+					print _("Unable to watch folders for changes")
+
+	def release_dir_watcher_events(self):
+		self.watch_events_held = False
+		events = self.watch_pending_events
+		self.watch_pending_events = []
+		for event in events:
+			self.dir_watcher_event(*event)
+
+	def dir_watcher_event(self, kind, path, new_path=None):
+		# Called from the main loop with the changes found by self.dir_watcher
+		if self.watch_events_held:
+			self.watch_pending_events.append((kind, path, new_path))
+			return
+		if kind == 'added':
+			self.watch_image_added(path)
+		elif kind == 'removed':
+			self.watch_image_removed(path)
+		elif kind == 'renamed':
+			self.watch_image_renamed(path, new_path)
+		elif kind == 'dir_added':
+			if self.watch_recursive:
+				self.watch_dir_added(path)
+		elif kind == 'dir_removed':
+			prefix = path + os.sep
+			self.image_list_remove_indices([i for i, item in enumerate(self.image_list) if item.startswith(prefix)])
+
+	def watch_is_image(self, path):
+		if not self.usettings['open_hidden_files'] and os.path.basename(path)[0] == '.':
+			return False
+		return len(self.filter_images([path])) == 1
+
+	def watch_image_added(self, path):
+		if path in self.image_list or not self.watch_is_image(path):
+			return
+		if self.verbose:
+			print _("Found: %s") % path
+		curr_name = self.image_list_current()
+		added, start = self.image_list.merge_sorted([path], self.sort_key())
+		self.image_list_grown(start, added, curr_name)
+		self.update_title()
+
+	def watch_image_removed(self, path):
+		index = self.image_list.find(path, self.sort_key())
+		if index != -1:
+			self.image_list_remove(index)
+
+	def watch_image_renamed(self, path, new_path):
+		index = self.image_list.find(path, self.sort_key())
+		if index == -1:
+			self.watch_image_added(new_path)
+			return
+		if not self.watch_is_image(new_path):
+			self.image_list_remove(index)
+			return
+		was_current = index == self.curr_img_in_list
+		self.image_list_remove(index, was_current)
+		if was_current:
+			self.currimg.name = new_path
+		self.watch_image_added(new_path)
+
+	def watch_dir_added(self, path):
+		if not self.usettings['open_hidden_files'] and os.path.basename(path)[0] == '.':
+			return
+		watcher = self.dir_watcher
+		sort_key = self.sort_key()
+		def add_images(scanner, dirname, images):
+			curr_name = self.image_list_current()
+			added, start = self.image_list.merge_sorted(images, sort_key)
+			if added:
+				self.image_list_grown(start, added, curr_name)
+				self.update_title()
+		def should_stop():
+			return self.closing_app or self.dir_watcher is not watcher
+		scanner = DirScanner([path], True, self.usettings['open_hidden_files'], self.filter_images, self.sort_list_in_place, add_images, None, should_stop, self.verbose, self.get_scan_cache(), 1, watcher)
+		scanner.start()
+
+	def image_list_remove(self, index, keep_current=False):
+		# Removes the image at index from self.image_list, see
+		# image_list_remove_indices()
+		self.image_list_remove_indices([index], keep_current)
+
+	def image_list_remove_indices(self, indices, keep_current=False):
+		# Removes the images at indices, in ascending order, from
+		# self.image_list, along with their rows in the thumbpane. If the
+		# current image is one of them, the image that takes its place is
+		# loaded, unless keep_current is set. Runs of consecutive images, such
+		# as a removed folder, are removed at once.
+		if not indices:
+			return
+		runs = []
+		for index in indices:
+			if runs and runs[-1][1] == index:
+				runs[-1][1] = index + 1
+			else:
+				runs.append([index, index + 1])
+		self.thumbscroll.get_vscrollbar().handler_block(self.thumb_scroll_handler)
+		for start, end in reversed(runs):
+			del self.image_list[start:end]
+			self.thumblist.remove_rows(start, end)
+		self.thumbscroll.get_vscrollbar().handler_unblock(self.thumb_scroll_handler)
+		if self.shuffle != None:
+			self.shuffle.remove(indices)
+		for index in reversed(indices):
+			self.firstimgindex_subfolders_list.remove(index)
+		self.preloaded.images_removed(indices)
+		removed = set(indices)
+		def new_index(index):
+			# Where an image that has not been removed is now
+			return index - bisect.bisect_left(indices, index)
+		if self.loaded_img_in_list in removed:
+			self.loaded_img_in_list = -1
+		elif self.loaded_img_in_list >= 0:
+			self.loaded_img_in_list = new_index(self.loaded_img_in_list)
+		if self.curr_img_in_list in removed and keep_current:
+			self.curr_img_in_list = -1
+		elif self.curr_img_in_list in removed:
+			if len(self.image_list) > 0:
+				self.curr_img_in_list = min(new_index(self.curr_img_in_list), len(self.image_list)-1)
+				self.load_when_idle = gobject.idle_add(self.load_new_image, False, False, True, True, True, True)
+				gobject.idle_add(self.thumbpane_select, self.curr_img_in_list)
+			else:
+				self.curr_img_in_list = 0
+				self.currimg.unload_pixbuf()
+				self.imageview.clear()
+				self.statusbar.push(self.statusbar.get_context_id(""), "")
+				self.image_loaded = False
+				self.set_slideshow_sensitivities()
+				self.set_image_sensitivities(False)
+		elif self.curr_img_in_list >= 0:
+			self.curr_img_in_list = new_index(self.curr_img_in_list)
+		self.update_title()
+		self.set_go_navigation_sensitivities(False)
+
+	def stop_dir_scanner(self):
+		if self.dir_scanner:
+			self.dir_scanner.cancel()
+			self.dir_scanner = None
 
 	def register_file_with_recent_docs(self, imgfile):
 		self.recent_file_add_and_refresh(imgfile)
@@ -4462,7 +5498,50 @@ class Base:
 				else:
 					raise
 
+	def image_type_from_name(self, filename):
+		# Returns True if the extension of filename belongs to an image format
+		# that gdk-pixbuf can load, False if it is known to be something else,
+		# and None if we have to look inside the file to tell.
+		ext = os.path.splitext(filename)[1].lower()
+		try:
+			return self.image_extension_types[ext]
+		except KeyError:
+			pass
+		if not ext:
+			result = None
+		elif ext in self.image_extensions:
+			result = True
+		else:
+			mime_type = mimetypes.guess_type('file' + ext, False)[0]
+			if mime_type == None:
+				result = None
+			else:
+				result = mime_type in self.image_mime_types
+		self.image_extension_types[ext] = result
+		return result
+
+	def filter_images(self, files):
+		# Returns the files in the list that are images, in the same order.
+		# Unless fast image detection is disabled, files are accepted by their
+		# name; those with unknown extensions are identified by their first
+		# bytes. Full header checks are deferred until an image is loaded.
+		if not self.usettings['fast_image_detection']:
+			return [file for file in files if self.valid_image(file)]
+		accepted = {}
+		unknown = []
+		for file in files:
+			is_image = self.image_type_from_name(file)
+			if is_image == None:
+				unknown.append(file)
+			else:
+				accepted[file] = is_image
+		for file in unknown:
+			accepted[file] = sniff_image_format(file) in self.image_format_names
+		return [file for file in files if accepted[file]]
+
 	def valid_image(self, file):
+		if self.usettings['fast_image_detection']:
+			return len(self.filter_images([file])) == 1
 		test = gtk.gdk.pixbuf_get_file_info(file)
 		if test == None:
 			return False
@@ -4493,6 +5572,8 @@ class Base:
 				self.ss_start.hide()
 				self.ss_stop.show()
 				timer_screensaver = gobject.timeout_add(1000, self.disable_screensaver_in_slideshow_mode)
+				# Start decoding what the slideshow will show before it is due
+				self.schedule_preload()
 			else:
 				self.slideshow_mode = False
 				gobject.source_remove(self.timer_delay)
@@ -4504,26 +5585,30 @@ class Base:
 
 	def get_firstimgindex_curr_next_prev_subfolder(self, img_in_list):
 		"""Returns a tuple (current [0], next [1], previous [-1]) firstimgindex"""
-		if len(self.firstimgindex_subfolders_list) >= 2: #subfolders
-			for i, firstimgindex in enumerate(self.firstimgindex_subfolders_list):
-				if img_in_list < firstimgindex:
-					return self.firstimgindex_subfolders_list[i-1], self.firstimgindex_subfolders_list[i], self.firstimgindex_subfolders_list[i-2]
-			return self.firstimgindex_subfolders_list[-1], self.firstimgindex_subfolders_list[0], self.firstimgindex_subfolders_list[-2]
+		subfolders = self.firstimgindex_subfolders_list
+		if len(subfolders) >= 2: #subfolders
+			if img_in_list >= 0 and img_in_list < subfolders.num_images():
+				i = subfolders.folder_of(img_in_list) + 1
+				if i < len(subfolders):
+					return subfolders[i-1], subfolders[i], subfolders[i-2]
+			return subfolders[-1], subfolders[0], subfolders[-2]
 		else:
 			return (-1,-1,-1)
 
 	def get_numimg_subfolder(self, firstimgindex_subfolder):
-		for i, index in enumerate(self.firstimgindex_subfolders_list):
-			if index == firstimgindex_subfolder:
-				if i < len(self.firstimgindex_subfolders_list)-1:
-					return self.firstimgindex_subfolders_list[i+1] - firstimgindex_subfolder
-				else:
-					return len(self.image_list) - firstimgindex_subfolder
+		subfolders = self.firstimgindex_subfolders_list
+		if firstimgindex_subfolder >= 0 and firstimgindex_subfolder < subfolders.num_images():
+			i = subfolders.folder_of(firstimgindex_subfolder)
+			if subfolders[i] == firstimgindex_subfolder:
+				return subfolders.folder_size(i)
 		return -1
 
 	def update_title(self):
 		if len(self.image_list) == 0:
 			title = __appname__
+		elif self.curr_img_in_list < 0:
+			# The current image has not been found in the folders scanned so far
+			title = __appname__ + " - " + os.path.basename(self.currimg.name)
 		else:
 			subfoldertitle = ''
 			firstimgindex_curr_subfolder = self.get_firstimgindex_curr_next_prev_subfolder(self.curr_img_in_list)[0]
@@ -4608,6 +5693,9 @@ class Base:
 		gtk.gdk.threads_enter()
 		gtk.main()
 		gtk.gdk.threads_leave()
+		if self.verbose:
+			print self.image_decoder.stats()
+			print _("Skipped loading %i images while going through images quickly") % self.skipped_loads
 
 class ImageData:
 	
@@ -4617,6 +5705,9 @@ class ImageData:
 	ORIENT_MIRROR = 3
 	ORIENT_RIGHT  = 6
 
+	# A zoomed pixbuf up to this many pixels smaller than asked for is kept
+	ZOOM_TOLERANCE = 1
+
 	def __init__(self, index=-1, name="", width=0, heigth=0, pixbuf=None,
 				pixbuf_original=None, pixbuf_rotated=None, zoomratio=1, animation=False):
 		self.index = index
@@ -4629,13 +5720,53 @@ class ImageData:
 		self.pixbuf_original = pixbuf_original
 		self.pixbuf_rotated = pixbuf_rotated
 		self.zoomratio = zoomratio
+		# The interpolation pixbuf was zoomed with, or None
+		self.zoomquality = None
 		self.animation = animation
 		self.isloaded = (name != "")
 		self.fileinfo = None
-
-	def load_pixbuf(self, name, index=-2):
-		# Load the image in name into self.pixbuf_original
-		animtest = gtk.gdk.PixbufAnimation(name)
+		# Set if pixbuf_original was decoded smaller than the image, which
+		# is width_original x height_original
+		self.reduced = False
+
+	def load_pixbuf(self, name, index=-2, cache=None, reduced_ok=True):
+		# Load the image in name into self.pixbuf_original, or take it
+		# from cache (an ImageCache) if it has been decoded before. Reduced
+		# versions in the cache are only taken if reduced_ok is set.
+		if cache != None:
+			decoded = cache.get(name)
+			if decoded != None and (reduced_ok or decoded[0].get_width() == decoded[3]):
+				self.pixbuf_original, self.orientation, self.fileinfo, self.width_original, self.height_original = decoded
+				self.animation = False
+				self.name = name
+				self.index = index
+				self.pixbuf = self.pixbuf_original
+				self.width = self.pixbuf.get_width()
+				self.height = self.pixbuf.get_height()
+				self.reduced = (self.width, self.height) != (self.width_original, self.height_original)
+				self.zoomratio = 1
+				self.isloaded = True
+				return
+		self.set_loaded(name, index, gtk.gdk.PixbufAnimation(name), gtk.gdk.pixbuf_get_file_info(name)[0])
+		if cache != None:
+			cache.add_image(self)
+
+	def take_decoded(self, img):
+		# Takes the pixbuf of img, the same file decoded at another size,
+		# e.g. at full size if this one was decoded reduced. The zoomed
+		# pixbuf is kept until the image is zoomed again.
+		self.pixbuf_original = img.pixbuf_original
+		self.orientation = img.orientation
+		self.fileinfo = img.fileinfo
+		self.width_original = img.width_original
+		self.height_original = img.height_original
+		self.reduced = img.reduced
+		self.zoomquality = None
+
+	def set_loaded(self, name, index, animtest, fileinfo, full_size=None):
+		# Takes the image in name from animtest, a gtk.gdk.PixbufAnimation,
+		# with fileinfo the format it was read from. If it was decoded
+		# reduced, full_size is the (width, height) of the file.
 		self.animation = not animtest.is_static_image()
 		if self.animation:
 			self.pixbuf_original = animtest
@@ -4660,9 +5791,15 @@ class ImageData:
 					self.rotate_pixbuf(180)
 				elif self.orientation == ImageData.ORIENT_RIGHT :
 					self.rotate_pixbuf(270)
+		self.reduced = False
+		if full_size != None and not self.animation:
+			if self.orientation in (ImageData.ORIENT_LEFT, ImageData.ORIENT_RIGHT):
+				full_size = (full_size[1], full_size[0])
+			self.width_original, self.height_original = full_size
+			self.reduced = full_size != (self.pixbuf_original.get_width(), self.pixbuf_original.get_height())
 		self.zoomratio = 1
 		self.isloaded = True
-		self.fileinfo = gtk.gdk.pixbuf_get_file_info(self.name)[0]
+		self.fileinfo = fileinfo
 
 	def unload_pixbuf(self):
 		self.index = -1
@@ -4672,12 +5809,14 @@ class ImageData:
 		self.height_original = 0
 		self.name = ""
 		self.zoomratio = 1
+		self.zoomquality = None
 		self.animation = False
 		self.pixbuf = None
 		self.pixbuf_original = None
 		self.orientation = None
 		self.isloaded = False
 		self.fileinfo = False
+		self.reduced = False
 	
 	def writable_format(self):
 		if not self.isloaded:
@@ -4690,10 +5829,18 @@ class ImageData:
 		# Calculate image size:
 		if self.animation:
 			return
-		final_width = int(self.pixbuf_original.get_width() * zoomratio)
-		final_height = int(self.pixbuf_original.get_height() * zoomratio)
+		final_width = int(self.width_original * zoomratio)
+		final_height = int(self.height_original * zoomratio)
+		if self.zoomquality == quality and self.pixbuf is not self.pixbuf_original and final_width - self.ZOOM_TOLERANCE <= self.width <= final_width and final_height - self.ZOOM_TOLERANCE <= self.height <= final_height:
+			# Zoomed to (nearly) this size already
+			self.zoomratio = zoomratio
+			return
+		self.zoomquality = quality
 		# Scale image:
-		if self.pixbuf_original.get_has_alpha():
+		if not self.pixbuf_original.get_has_alpha() and (final_width, final_height) == (self.pixbuf_original.get_width(), self.pixbuf_original.get_height()):
+			# Nothing to scale, e.g. at 1:1
+			self.pixbuf = self.pixbuf_original
+		elif self.pixbuf_original.get_has_alpha():
 			light_grey = colormap.alloc_color('#666666', True, True)
 			dark_grey = colormap.alloc_color('#999999', True, True)
 			self.pixbuf = self.pixbuf_original.composite_color_simple(final_width, final_height, quality, 255, 8, light_grey.pixel, dark_grey.pixel)
@@ -4702,16 +5849,23 @@ class ImageData:
 		self.width, self.height = final_width, final_height
 		self.zoomratio = zoomratio
 
-	def transform_pixbuf(self, func) :
+	def transform_pixbuf(self, func, rotate=False) :
+		# func writes the transformed pixels of a pixbuf straight into a new
+		# one, which has width and height swapped if rotate is set
 		def transform(old_pix, func) :
-			width = old_pix.get_width()
-			height = old_pix.get_height()
-			d, w, h, rws = func(old_pix.get_pixels(), width, height, old_pix.get_rowstride(), old_pix.get_n_channels())
-			if d:
-				return gtk.gdk.pixbuf_new_from_data(d, old_pix.get_colorspace(), old_pix.get_has_alpha(), old_pix.get_bits_per_sample(), w, h, rws), w, h
-			return old_pix, width, height
+			w = old_pix.get_width()
+			h = old_pix.get_height()
+			if rotate:
+				w, h = h, w
+			new_pix = gtk.gdk.Pixbuf(old_pix.get_colorspace(), old_pix.get_has_alpha(), old_pix.get_bits_per_sample(), w, h)
+			func(old_pix, new_pix)
+			return new_pix, w, h
+		shared = self.pixbuf is self.pixbuf_original
 		self.pixbuf_original, self.width_original, self.height_original = transform(self.pixbuf_original, func)
-		self.pixbuf         , self.width         ,  self.height         = transform(self.pixbuf         , func)
+		if shared:
+			self.pixbuf, self.width, self.height = self.pixbuf_original, self.width_original, self.height_original
+		else:
+			self.pixbuf, self.width, self.height = transform(self.pixbuf, func)
 
 	def flip_pixbuf(self, vertical):
 		self.transform_pixbuf(imgfuncs.vert if vertical else imgfuncs.horiz)
@@ -4721,18 +5875,21 @@ class ImageData:
 		if angle:
 			d = None
 			if angle % 270 == 0:
-				self.transform_pixbuf(imgfuncs.right)
+				self.transform_pixbuf(imgfuncs.right, True)
 			elif angle % 180 == 0:
 				self.transform_pixbuf(imgfuncs.mirror)
 			elif angle % 90 == 0:
-				self.transform_pixbuf(imgfuncs.left)
+				self.transform_pixbuf(imgfuncs.left, True)
 
 	def resize(self, w, h, quality):
 		self.pixbuf_original = self.pixbuf_original.scale_simple(w, h, quality)
 		self.reset_wh()
 
 	def saturation(self, satval):
+		# The pixbufs may be shared with the image cache, so saturate copies
+		self.pixbuf_original = self.pixbuf_original.copy()
 		self.pixbuf_original.saturate_and_pixelate(self.pixbuf_original, satval, False)
+		self.pixbuf = self.pixbuf.copy()
 		self.pixbuf.saturate_and_pixelate(self.pixbuf, satval, False)
 
 	def crop(self, coords):
@@ -4744,6 +5901,1597 @@ class ImageData:
 	def reset_wh(self):
 		self.width_original = self.pixbuf_original.get_width()
 		self.height_original = self.pixbuf_original.get_height()
+		self.zoomquality = None
+
+class PreloadRing:
+	"""The decoded images around the current one, keyed by their index in
+	the image list. Images that are dropped are unloaded and kept as
+	spares, which later preloads reuse instead of allocating a new
+	ImageData every time."""
+
+	def __init__(self):
+		self.images = {}
+		self.spare = []
+
+	def __len__(self):
+		return len(self.images)
+
+	def __iter__(self):
+		return iter(self.images.values())
+
+	def __contains__(self, index):
+		return index in self.images
+
+	def new_entry(self):
+		if self.spare:
+			return self.spare.pop()
+		return ImageData(index=-1)
+
+	def recycle(self, img):
+		img.unload_pixbuf()
+		self.spare.append(img)
+
+	def put(self, img):
+		"""Adds img at img.index, replacing any image there."""
+		old = self.images.get(img.index)
+		if old != None and old is not img:
+			self.recycle(old)
+		self.images[img.index] = img
+
+	def take(self, index):
+		"""Removes the image at index and returns it, or None if there is
+		no loaded image at index."""
+		img = self.images.pop(index, None)
+		if img != None and not img.isloaded:
+			self.recycle(img)
+			img = None
+		return img
+
+	def discard(self, index):
+		img = self.images.pop(index, None)
+		if img != None:
+			self.recycle(img)
+
+	def clear(self):
+		for img in self.images.values():
+			self.recycle(img)
+		self.images = {}
+
+	def trim(self, indices):
+		"""Drops the images that are not at one of indices."""
+		indices = set(indices)
+		for index in [index for index in self.images if index not in indices]:
+			self.discard(index)
+
+	def relocate(self, new_index):
+		"""Moves every image to new_index(image), dropping those for which
+		it returns -1."""
+		images = self.images.values()
+		self.images = {}
+		for img in images:
+			img.index = new_index(img)
+			if img.index < 0:
+				self.recycle(img)
+			else:
+				self.put(img)
+
+	def images_removed(self, indices):
+		"""Drops the images at indices (in ascending order) and moves the
+		ones after them back, after those have been removed from the list."""
+		removed = set(indices)
+		self.relocate(lambda img: -1 if img.index in removed else img.index - bisect.bisect_left(indices, img.index))
+
+class NavigationTracker:
+	"""The recent moves through the image list, from which the direction
+	and pace of the user are guessed. Moves older than WINDOW seconds are
+	forgotten, and so are all moves when the user jumps elsewhere."""
+
+	WINDOW = 2.0
+	# At most this many times preload_depth images are preloaded ahead
+	MAX_LOOKAHEAD = 4
+	# Moves less than this many seconds apart are skipping through images
+	SETTLE = 0.25
+
+	def __init__(self):
+		self.moves = deque()
+		self.subfolder = 0
+		self.last_move = 0
+
+	def add(self, step, count=0):
+		"""Records a move by step images in a list of count images."""
+		if count > 2 and abs(step) == count - 1:
+			# Wrapped around the end of the list
+			step = -1 if step > 0 else 1
+		if abs(step) != 1:
+			self.clear()
+			return
+		now = time.time()
+		if self.moves and self.moves[-1][1] != step:
+			self.moves.clear()
+		self.moves.append((now, step))
+		self.subfolder = 0
+		self.last_move = now
+		self.expire(now)
+
+	def add_subfolder(self, direction):
+		"""Records a jump to the first image of the next (direction 1) or
+		previous (-1) subfolder."""
+		self.moves.clear()
+		self.subfolder = direction
+		self.last_move = time.time()
+
+	def clear(self):
+		self.moves.clear()
+		self.subfolder = 0
+		self.last_move = 0
+
+	def expire(self, now):
+		while self.moves and now - self.moves[0][0] > self.WINDOW:
+			self.moves.popleft()
+
+	def direction(self):
+		"""Returns 1 if the user has recently been moving forward, -1 if
+		backward, and 0 otherwise (also when going to random images)."""
+		self.expire(time.time())
+		if not self.moves:
+			return 0
+		return self.moves[-1][1]
+
+	def rate(self):
+		"""Returns the number of images per second moved recently."""
+		self.expire(time.time())
+		return len(self.moves) / self.WINDOW
+
+	def add_random(self):
+		"""Records a move to a random image."""
+		if self.moves and self.moves[-1][1] != 0:
+			self.moves.clear()
+		now = time.time()
+		self.moves.append((now, 0))
+		self.subfolder = 0
+		self.last_move = now
+		self.expire(now)
+
+	def skipping(self):
+		"""Returns whether the last move was less than SETTLE seconds ago,
+		i.e. the user is skipping through images rather than viewing them."""
+		return time.time() - self.last_move < self.SETTLE
+
+	def subfolder_direction(self):
+		return self.subfolder
+
+	def lookahead(self, depth, rate, decode_seconds):
+		"""Returns how many images to preload ahead when moving at rate
+		images per second, with images taking decode_seconds to decode."""
+		return min(max(1, depth) * self.MAX_LOOKAHEAD, depth + int(math.ceil(rate * decode_seconds)))
+
+class ShuffleOrder:
+	"""A random order in which each image of a list of count images is
+	visited once, starting with first. The order is drawn one step of a
+	Fisher-Yates shuffle at a time as it is walked, so that going to the next
+	image takes constant time; upcoming() draws the next images ahead, so
+	that they are known before they are shown."""
+
+	def __init__(self, count, first=-1):
+		self.order = range(count)
+		# order[:pos] has been visited, order[:drawn] has been drawn
+		self.pos = 0
+		if first >= 0 and first < count:
+			self.order[0], self.order[first] = first, 0
+			self.pos = 1
+		self.drawn = self.pos
+
+	def draw(self, end):
+		end = min(end, len(self.order))
+		while self.drawn < end:
+			j = random.randint(self.drawn, len(self.order) - 1)
+			self.order[self.drawn], self.order[j] = self.order[j], self.order[self.drawn]
+			self.drawn += 1
+
+	def remaining(self):
+		return len(self.order) - self.pos
+
+	def next(self):
+		"""Returns the next index in the order, or -1 if all have been
+		visited."""
+		if self.pos >= len(self.order):
+			return -1
+		self.draw(self.pos + 1)
+		self.pos += 1
+		return self.order[self.pos - 1]
+
+	def upcoming(self, count):
+		"""Returns the next count indices that next() will return."""
+		self.draw(self.pos + count)
+		return self.order[self.pos:self.pos + count]
+
+	def insert(self, positions):
+		"""Adds the images inserted into the list at positions (in
+		ascending order, as indices into the grown list) as not visited."""
+		positions = list(positions)
+		if not positions:
+			return
+		moved = []
+		new = 0
+		for position in positions:
+			while new < position:
+				moved.append(new)
+				new += 1
+			new += 1
+		new_count = len(self.order) + len(positions)
+		moved.extend(xrange(new, new_count))
+		self.order = [moved[index] for index in self.order]
+		self.order.extend(positions)
+
+	def remove(self, indices):
+		"""Drops the images at indices (in ascending order), which have been
+		removed from the list."""
+		removed = set(indices)
+		order = []
+		pos = self.pos
+		drawn = self.drawn
+		for i, j in enumerate(self.order):
+			if j not in removed:
+				order.append(j - bisect.bisect_left(indices, j))
+			else:
+				if i < pos:
+					self.pos -= 1
+				if i < drawn:
+					self.drawn -= 1
+		self.order = order
+
+class ImageCache:
+	"""Decoded images by file name, for files that have not changed since
+	(same modification time and size). The least recently used images are
+	dropped when their pixbufs take more than max_bytes, and the cache is
+	halved whenever the process has grown past max_rss bytes. Several
+	values can be kept for the same file by passing a different variant,
+	e.g. the size of a thumbnail."""
+
+	def __init__(self, max_bytes, max_rss=0):
+		self.max_bytes = max_bytes
+		self.max_rss = max_rss
+		self.entries = OrderedDict()
+		self.bytes = 0
+
+	def key(self, name, variant=None):
+		try:
+			st = os.stat(name)
+		except OSError:
+			return None
+		return (name, st.st_mtime, st.st_size, variant)
+
+	def get(self, name, variant=None):
+		"""Returns what was added for name, or None."""
+		key = self.key(name, variant)
+		try:
+			entry = self.entries.pop(key)
+		except KeyError:
+			return None
+		self.entries[key] = entry
+		return entry[0]
+
+	def add(self, name, value, size, variant=None):
+		"""Adds value for name, which takes size bytes."""
+		key = self.key(name, variant)
+		if key == None or size > self.max_bytes:
+			return
+		old = self.entries.pop(key, None)
+		if old != None:
+			self.bytes -= old[1]
+		self.entries[key] = (value, size)
+		self.bytes += size
+		self.shrink(self.max_bytes)
+		if self.max_rss > 0:
+			rss = process_rss()
+			if rss != None and rss > self.max_rss:
+				self.shrink(self.bytes // 2)
+
+	def add_image(self, img):
+		"""Adds the decoded image of img, an ImageData, unless it is an
+		animation. A full size image replaces a reduced one."""
+		if img.isloaded and not img.animation:
+			self.add(img.name, (img.pixbuf_original, img.orientation, img.fileinfo, img.width_original, img.height_original), img.pixbuf_original.get_rowstride() * img.pixbuf_original.get_height())
+
+	def shrink(self, max_bytes):
+		while self.bytes > max_bytes and self.entries:
+			self.bytes -= self.entries.popitem(False)[1][1]
+
+	def resize(self, max_bytes):
+		self.max_bytes = max_bytes
+		self.shrink(max_bytes)
+
+	def clear(self):
+		self.entries.clear()
+		self.bytes = 0
+
+class DecodeJob:
+	"""An image that an ImageDecoder has been asked to decode."""
+
+	def __init__(self, name, index, priority, on_done, img, on_preview=None, preview_size=None, fit_size=None):
+		self.name = name
+		self.index = index
+		self.priority = priority
+		self.on_done = on_done
+		self.img = img
+		self.on_preview = on_preview
+		self.preview_size = preview_size
+		self.fit_size = fit_size
+		self.started = False
+		self.cancelled = False
+		# How long decoding took, once it is done
+		self.seconds = None
+
+	def cancel(self):
+		self.cancelled = True
+
+class ImageDecoder:
+	"""Decodes images in background threads, those with the lowest
+	priority first. Files are fed to a gtk.gdk.PixbufLoader in chunks, so
+	that a decode that is no longer wanted can be given up between two
+	chunks. When an image has been decoded, on_done(job, img) is called from
+	the GTK main loop through gobject.idle_add(), with img the ImageData
+	passed to decode(), or None if the file could not be decoded. Cancelled
+	jobs are not reported.
+
+	If on_preview is given, on_preview(job, pixbuf) is called from the main
+	loop with previews no larger than preview_size while the image is being
+	decoded. For large JPEGs, a reduced version is decoded first, which the
+	JPEG loader does many times faster than the full image. Other images
+	are shown as far as they have been decoded, at most every
+	PREVIEW_INTERVAL seconds.
+
+	If on_dropped is given, on_dropped(img) is called from the main loop
+	with the ImageData of each cancelled job once no thread uses it any
+	more, so that it can be reused.
+
+	If fit_size is given, images larger than that are decoded only as
+	large as needed to fit into fit_size, in either orientation, and
+	marked as reduced (see ImageData.reduced). Previews are shown all
+	the same, scaled from the reduced image as far as it has been decoded."""
+
+	CHUNK_SIZE = 65536
+	PREVIEW_INTERVAL = 0.1
+
+	def __init__(self, workers=2, on_dropped=None):
+		self.workers = workers
+		self.on_dropped = on_dropped
+		self.threads = []
+		self.lock = threading.Condition()
+		self.queue = []
+		self.count = 0
+		# Statistics: images decoded, decodes given up after they were
+		# started, and the seconds spent on those
+		self.decoded = 0
+		self.wasted = 0
+		self.wasted_seconds = 0.0
+
+	def decode(self, name, index, priority, on_done, img=None, on_preview=None, preview_size=None, fit_size=None):
+		if img == None:
+			img = ImageData()
+		job = DecodeJob(name, index, priority, on_done, img, on_preview, preview_size, fit_size)
+		self.lock.acquire()
+		try:
+			# The count keeps jobs of the same priority in order
+			heapq.heappush(self.queue, (priority, self.count, job))
+			self.count += 1
+			if len(self.threads) < self.workers:
+				thread = threading.Thread(target=self.run)
+				thread.setDaemon(True)
+				self.threads.append(thread)
+				thread.start()
+			self.lock.notify()
+		finally:
+			self.lock.release()
+		return job
+
+	def run(self):
+		while True:
+			self.lock.acquire()
+			try:
+				while not self.queue:
+					self.lock.wait()
+				job = heapq.heappop(self.queue)[2]
+				job.started = True
+			finally:
+				self.lock.release()
+			if job.cancelled:
+				gobject.idle_add(self.deliver, job, None)
+				continue
+			start = time.time()
+			try:
+				loaded = self.load(job)
+				img = job.img
+			except Exception as e:
+				print (e)
+				loaded = True
+				img = None
+			job.seconds = time.time() - start
+			self.count_job(job, loaded and not job.cancelled)
+			gobject.idle_add(self.deliver, job, img)
+
+	def count_job(self, job, done):
+		self.lock.acquire()
+		try:
+			if done:
+				self.decoded += 1
+			else:
+				self.wasted += 1
+				self.wasted_seconds += job.seconds
+		finally:
+			self.lock.release()
+
+	def feed(self, job, loader):
+		# Writes the file of job to loader in chunks; returns False if the
+		# job was cancelled meanwhile
+		f = open(job.name, 'rb')
+		try:
+			while True:
+				if job.cancelled:
+					try:
+						loader.close()
+					except gobject.GError:
+						pass
+					return False
+				data = f.read(self.CHUNK_SIZE)
+				if not data:
+					break
+				loader.write(data)
+		finally:
+			f.close()
+		loader.close()
+		return True
+
+	def load(self, job):
+		# Decodes job.name into job.img; returns False if the job was
+		# cancelled meanwhile
+		previewed = False
+		if job.on_preview:
+			previewed = self.load_preview(job)
+			if job.cancelled:
+				return False
+		loader = gtk.gdk.PixbufLoader()
+		full_size = [None]
+		if job.fit_size:
+			loader.connect('size-prepared', self.fit_size_prepared, job.fit_size, full_size)
+		if job.on_preview and not previewed:
+			loader.connect('area-prepared', self.area_prepared)
+			loader.connect('area-updated', self.area_updated, job, [time.time()])
+		if not self.feed(job, loader):
+			return False
+		job.img.set_loaded(job.name, job.index, loader.get_animation(), loader.get_format(), full_size[0])
+		return True
+
+	def load_preview(self, job):
+		# Decodes a reduced version of job.name if it is a JPEG that is much
+		# larger than job.preview_size, and passes it to job.on_preview.
+		# Returns True if a preview has been passed on.
+		info = gtk.gdk.pixbuf_get_file_info(job.name)
+		if info == None or info[0]['name'] != 'jpeg':
+			return False
+		ratio = min(float(job.preview_size[0]) / info[1], float(job.preview_size[1]) / info[2])
+		if ratio >= 0.5:
+			return False
+		loader = gtk.gdk.PixbufLoader()
+		loader.connect('size-prepared', self.size_prepared, ratio)
+		if not self.feed(job, loader):
+			return False
+		preview = loader.get_pixbuf()
+		if HAS_EXIF:
+			exifd = pyexiv2.ImageMetadata(job.name)
+			exifd.read()
+			if "Exif.Image.Orientation" in exifd.exif_keys:
+				angle = {ImageData.ORIENT_LEFT: 90, ImageData.ORIENT_MIRROR: 180, ImageData.ORIENT_RIGHT: 270}.get(exifd["Exif.Image.Orientation"].value)
+				if angle:
+					preview = preview.rotate_simple(angle)
+		gobject.idle_add(self.deliver_preview, job, preview)
+		return True
+
+	def size_prepared(self, loader, width, height, ratio):
+		loader.set_size(max(1, int(width * ratio)), max(1, int(height * ratio)))
+
+	def fit_size_prepared(self, loader, width, height, fit_size, full_size):
+		# The EXIF orientation is not known yet, so the image is made to
+		# fit both ways
+		full_size[0] = (width, height)
+		ratio = max(min(float(fit_size[0]) / width, float(fit_size[1]) / height), min(float(fit_size[1]) / width, float(fit_size[0]) / height))
+		if ratio < 1:
+			loader.set_size(max(1, int(width * ratio)), max(1, int(height * ratio)))
+
+	def area_prepared(self, loader):
+		# The pixbuf is not cleared by all loaders
+		loader.get_pixbuf().fill(0x00000000)
+
+	def area_updated(self, loader, x, y, width, height, job, last_preview):
+		now = time.time()
+		if now - last_preview[0] < self.PREVIEW_INTERVAL or job.cancelled:
+			return
+		last_preview[0] = now
+		pixbuf = loader.get_pixbuf()
+		ratio = min(1.0, float(job.preview_size[0]) / pixbuf.get_width(), float(job.preview_size[1]) / pixbuf.get_height())
+		preview = pixbuf.scale_simple(max(1, int(pixbuf.get_width() * ratio)), max(1, int(pixbuf.get_height() * ratio)), gtk.gdk.INTERP_NEAREST)
+		gobject.idle_add(self.deliver_preview, job, preview)
+
+	def deliver_preview(self, job, pixbuf):
+		if not job.cancelled and job.on_preview:
+			job.on_preview(job, pixbuf)
+		return False
+
+	def deliver(self, job, img):
+		if not job.cancelled:
+			job.on_done(job, img)
+		elif self.on_dropped:
+			self.on_dropped(job.img)
+		return False
+
+	def stats(self):
+		"""Returns a line about the work done so far, for --verbose."""
+		self.lock.acquire()
+		try:
+			return _("Decoded %(decoded)i images, gave up %(wasted)i decodes after %(seconds).2fs") % {'decoded': self.decoded, 'wasted': self.wasted, 'seconds': self.wasted_seconds}
+		finally:
+			self.lock.release()
+
+class ThumbnailMaker:
+	"""Makes thumbnails in background threads, those with the lowest
+	priority first. make(image_name) is called from the threads and returns
+	the thumbnail, or None if it could not be made. The thumbnails are passed
+	to on_done(thumbnails) from the GTK main loop in batches, as a list of
+	(index, image_name, pixbuf) of those made during the last BATCH_DELAY
+	seconds."""
+
+	BATCH_DELAY = 0.05
+
+	def __init__(self, make, on_done, workers=4):
+		self.make = make
+		self.on_done = on_done
+		self.workers = workers
+		self.threads = []
+		self.lock = threading.Condition()
+		self.queue = []
+		# The latest request for each image, by name, and the images whose
+		# thumbnails are being made, with the generation they are made for
+		self.requests = {}
+		self.making = {}
+		self.count = 0
+		self.done = []
+		# Bumped by clear(), so that thumbnails being made are dropped
+		self.generation = 0
+
+	def request(self, index, image_name, priority):
+		"""Asks for the thumbnail of image_name, which is at index in the
+		list. Asking again changes the priority."""
+		self.lock.acquire()
+		try:
+			if self.requests.get(image_name) == (index, priority) or self.making.get(image_name) == self.generation:
+				return
+			self.requests[image_name] = (index, priority)
+			heapq.heappush(self.queue, (priority, self.count, index, image_name))
+			self.count += 1
+			if len(self.threads) < self.workers:
+				thread = threading.Thread(target=self.run)
+				thread.setDaemon(True)
+				self.threads.append(thread)
+				thread.start()
+			self.lock.notify()
+		finally:
+			self.lock.release()
+
+	def clear(self):
+		"""Drops all requests, e.g. when another list is opened."""
+		self.lock.acquire()
+		try:
+			self.queue = []
+			self.requests.clear()
+			self.done = []
+			self.generation += 1
+		finally:
+			self.lock.release()
+
+	def run(self):
+		while True:
+			self.lock.acquire()
+			try:
+				while True:
+					while not self.queue:
+						self.lock.wait()
+					priority, count, index, image_name = heapq.heappop(self.queue)
+					# Skip requests that have been made again since
+					if self.requests.get(image_name) == (index, priority):
+						del self.requests[image_name]
+						break
+				generation = self.generation
+				self.making[image_name] = generation
+			finally:
+				self.lock.release()
+			try:
+				pix = self.make(image_name)
+			except Exception as e:
+				print (e)
+				pix = None
+			self.lock.acquire()
+			try:
+				if self.making.get(image_name) == generation:
+					del self.making[image_name]
+				if generation == self.generation:
+					if not self.done:
+						gobject.timeout_add(int(self.BATCH_DELAY * 1000), self.deliver)
+					self.done.append((index, image_name, pix))
+			finally:
+				self.lock.release()
+
+	def deliver(self):
+		self.lock.acquire()
+		try:
+			done = self.done
+			self.done = []
+		finally:
+			self.lock.release()
+		if done:
+			self.on_done(done)
+		return False
+
+class ThumbnailModel(gtk.GenericTreeModel):
+	"""The rows of the thumbpane, one for each image in the list, with a
+	single pixbuf column. Only the max_pixbufs thumbnails that were set or
+	kept last are held, by image name; the other rows all show the same
+	placeholder pixbuf, so that a row costs little more than a list item
+	and the view only asks for the rows it shows."""
+
+	def __init__(self, max_pixbufs=200):
+		gtk.GenericTreeModel.__init__(self)
+		# The row refs are the row numbers. They are kept in self.rows
+		# rather than leaked to GTK.
+		self.set_property('leak-references', False)
+		self.rows = []
+		self.names = []
+		# image name -> thumbnail, or None if it has none, the most recently
+		# used last
+		self.pixbufs = OrderedDict()
+		self.max_pixbufs = max_pixbufs
+		self.placeholder = None
+
+	def reset(self, names, placeholder):
+		"""Replaces all rows with rows for the images in names, showing
+		placeholder. No signals are emitted, so the model must not be shown
+		by a view meanwhile."""
+		self.invalidate_iters()
+		self.names = list(names)
+		self.pixbufs.clear()
+		self.rows = range(len(self.names))
+		self.placeholder = placeholder
+
+	def has_thumbnail(self, index):
+		"""Returns whether the row at index has been given its thumbnail, or
+		found to have none."""
+		return self.names[index] in self.pixbufs
+
+	def keep(self, index):
+		"""Marks the thumbnail of the row at index as used, so that it is
+		dropped after the others."""
+		name = self.names[index]
+		pixbuf = self.pixbufs.pop(name)
+		self.pixbufs[name] = pixbuf
+
+	def set_pixbuf(self, index, pixbuf):
+		"""Shows pixbuf in the row at index, or the placeholder if pixbuf is
+		None. The thumbnails used least recently are dropped if there are
+		more than max_pixbufs."""
+		name = self.names[index]
+		self.pixbufs.pop(name, None)
+		self.pixbufs[name] = pixbuf
+		while len(self.pixbufs) > self.max_pixbufs:
+			self.pixbufs.popitem(False)
+		if pixbuf != None:
+			path = (index,)
+			self.row_changed(path, self.get_iter(path))
+
+	def insert_rows(self, positions, names):
+		"""Adds rows for names, to be at positions (ascending) once they
+		have all been added. The rows are spliced in at once, then the view
+		is told about them."""
+		if not positions:
+			return
+		start = positions[0]
+		old = iter(self.names[start:])
+		tail = []
+		for index, name in itertools.izip(positions, names):
+			while start + len(tail) < index:
+				tail.append(old.next())
+			tail.append(name)
+		tail.extend(old)
+		self.names[start:] = tail
+		self.rows.extend(xrange(len(self.rows), len(self.names)))
+		for index in positions:
+			path = (index,)
+			self.row_inserted(path, self.get_iter(path))
+
+	def remove_rows(self, start, end):
+		"""Removes the rows from start up to end."""
+		count = len(self.names)
+		del self.names[start:end]
+		for i in xrange(count - len(self.names)):
+			self.row_deleted((start,))
+
+	def on_get_flags(self):
+		return gtk.TREE_MODEL_LIST_ONLY
+
+	def on_get_n_columns(self):
+		return 1
+
+	def on_get_column_type(self, column):
+		return gtk.gdk.Pixbuf
+
+	def on_get_iter(self, path):
+		if path[0] < len(self.names):
+			return self.rows[path[0]]
+		return None
+
+	def on_get_path(self, rowref):
+		return (rowref,)
+
+	def on_get_value(self, rowref, column):
+		pixbuf = self.pixbufs.get(self.names[rowref])
+		if pixbuf == None:
+			return self.placeholder
+		return pixbuf
+
+	def on_iter_next(self, rowref):
+		if rowref + 1 < len(self.names):
+			return self.rows[rowref + 1]
+		return None
+
+	def on_iter_children(self, parent):
+		return self.on_iter_nth_child(parent, 0)
+
+	def on_iter_has_child(self, rowref):
+		return False
+
+	def on_iter_n_children(self, rowref):
+		if rowref == None:
+			return len(self.names)
+		return 0
+
+	def on_iter_nth_child(self, parent, n):
+		if parent == None and n < len(self.names):
+			return self.rows[n]
+		return None
+
+	def on_iter_parent(self, child):
+		return None
+
+class ImageList(list):
+	"""A list of image filenames that keeps a hash index of its items, so
+	that membership tests do not have to walk the list. Sorted batches of
+	new images can be merged into the list with merge_sorted(), which keeps
+	a sorted list sorted without sorting it again. The sort keys of the
+	items are cached along with the list."""
+
+	def __init__(self, items=()):
+		list.__init__(self, items)
+		# item -> number of times it is in the list
+		self.counts = {}
+		for item in self:
+			self.counts[item] = self.counts.get(item, 0) + 1
+		# item -> sort key, for the key function in self.key_func
+		self.key_func = None
+		self.key_cache = {}
+
+	def cached_key(self, key):
+		"""Returns a function that returns key(item), remembering the keys
+		already computed for this list."""
+		if key is not self.key_func:
+			self.key_func = key
+			self.key_cache = {}
+		cache = self.key_cache
+		def cached(item):
+			try:
+				return cache[item]
+			except KeyError:
+				result = cache[item] = key(item)
+				return result
+		return cached
+
+	def _add(self, items):
+		for item in items:
+			self.counts[item] = self.counts.get(item, 0) + 1
+
+	def _discard(self, items):
+		for item in items:
+			if self.counts[item] == 1:
+				del self.counts[item]
+			else:
+				self.counts[item] -= 1
+
+	def __contains__(self, item):
+		return item in self.counts
+
+	def __setitem__(self, index, value):
+		if isinstance(index, slice):
+			value = list(value)
+			self._discard(list.__getitem__(self, index))
+			self._add(value)
+		else:
+			self._discard([list.__getitem__(self, index)])
+			self._add([value])
+		list.__setitem__(self, index, value)
+
+	def __delitem__(self, index):
+		if isinstance(index, slice):
+			self._discard(list.__getitem__(self, index))
+		else:
+			self._discard([list.__getitem__(self, index)])
+		list.__delitem__(self, index)
+
+	def __setslice__(self, i, j, value):
+		self.__setitem__(slice(max(0, i), max(0, j)), value)
+
+	def __delslice__(self, i, j):
+		self.__delitem__(slice(max(0, i), max(0, j)))
+
+	def __iadd__(self, items):
+		self.extend(items)
+		return self
+
+	def append(self, item):
+		list.append(self, item)
+		self._add([item])
+
+	def extend(self, items):
+		items = list(items)
+		list.extend(self, items)
+		self._add(items)
+
+	def insert(self, index, item):
+		list.insert(self, index, item)
+		self._add([item])
+
+	def remove(self, item):
+		list.remove(self, item)
+		self._discard([item])
+
+	def pop(self, index=-1):
+		item = list.pop(self, index)
+		self._discard([item])
+		return item
+
+	def find(self, item, key=None):
+		"""Returns the index of item, or -1 if it is not in the list. If the
+		list is sorted by key, item is looked up by bisection."""
+		if item not in self.counts:
+			return -1
+		if key != None:
+			key = self.cached_key(key)
+			item_key = key(item)
+			lo = 0
+			hi = len(self)
+			while lo < hi:
+				mid = (lo + hi) // 2
+				if key(list.__getitem__(self, mid)) < item_key:
+					lo = mid + 1
+				else:
+					hi = mid
+			for i in xrange(lo, len(self)):
+				other = list.__getitem__(self, i)
+				if other == item:
+					return i
+				if key(other) != item_key:
+					break
+		# The list is not sorted (shuffled, or not sorted at all)
+		return list.index(self, item)
+
+	def has_duplicates(self):
+		return len(self.counts) != len(self)
+
+	def sorts_last(self, item, key=None):
+		"""Returns whether item sorts at or after the end of the list by key,
+		so that merge_sorted() would only append it."""
+		if key == None or not self:
+			return True
+		key = self.cached_key(key)
+		return key(item) >= key(self[-1])
+
+	def merge_sorted(self, batch, key=None):
+		"""Adds the items of batch that are not in the list yet. Returns a
+		tuple (added items, index of the first position that changed). If
+		the list and batch are both sorted by key, the list stays sorted;
+		without a key the new items are appended."""
+		new = []
+		for item in batch:
+			if item not in self.counts:
+				self.counts[item] = 1
+				new.append(item)
+		if not new:
+			return new, len(self)
+		if self.sorts_last(new[0], key):
+			# The common case when folders are scanned in order
+			start = len(self)
+			list.extend(self, new)
+			return new, start
+		key = self.cached_key(key)
+		# Only the part of the list that sorts after the first new item has
+		# to be merged:
+		first = key(new[0])
+		lo = 0
+		hi = len(self)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if first < key(list.__getitem__(self, mid)):
+				hi = mid
+			else:
+				lo = mid + 1
+		tail = list.__getitem__(self, slice(lo, None))
+		merged = heapq.merge([(key(item), 0, i, item) for i, item in enumerate(tail)], [(key(item), 1, i, item) for i, item in enumerate(new)])
+		list.__setitem__(self, slice(lo, None), [entry[3] for entry in merged])
+		return new, lo
+
+class SubfolderIndex:
+	"""Tracks where each subfolder starts in the image list, i.e. the
+	positions of the images whose folder differs from the one of the image
+	before. The folders are kept in list order together with the number of
+	images each holds, and a binary indexed tree over those counts gives
+	the first image of a folder, and the folder of an image, in O(log n).
+	Inserting or removing an image only changes the count of its folder,
+	so the folders after it need not be renumbered. Like the plain list it
+	replaces, index[i] is the first image of folder i."""
+
+	def __init__(self, images=()):
+		self.dirs = []
+		self.counts = []
+		for image in images:
+			dirname = os.path.dirname(image)
+			if self.dirs and self.dirs[-1] == dirname:
+				self.counts[-1] += 1
+			else:
+				self.dirs.append(dirname)
+				self.counts.append(1)
+		self.rebuild()
+
+	def rebuild(self):
+		# tree[i] holds the sum of counts[i-(i&-i):i]
+		self.tree = [0] + self.counts
+		for i in xrange(1, len(self.tree)):
+			parent = i + (i & -i)
+			if parent < len(self.tree):
+				self.tree[parent] += self.tree[i]
+
+	def add_to_count(self, folder, delta):
+		self.counts[folder] += delta
+		i = folder + 1
+		while i < len(self.tree):
+			self.tree[i] += delta
+			i += i & -i
+
+	def first_image(self, folder):
+		# Sum of the counts of the folders before folder
+		total = 0
+		i = folder
+		while i > 0:
+			total += self.tree[i]
+			i -= i & -i
+		return total
+
+	def append_folder(self, dirname, count):
+		i = len(self.tree)
+		self.tree.append(count + self.first_image(i-1) - self.first_image(i - (i & -i)))
+		self.dirs.append(dirname)
+		self.counts.append(count)
+
+	def __len__(self):
+		return len(self.dirs)
+
+	def __getitem__(self, folder):
+		if folder < 0:
+			folder += len(self.dirs)
+		if folder < 0 or folder >= len(self.dirs):
+			raise IndexError(folder)
+		return self.first_image(folder)
+
+	def num_images(self):
+		return self.first_image(len(self.dirs))
+
+	def folder_size(self, folder):
+		return self.counts[folder]
+
+	def folder_of(self, image):
+		"""Returns the folder that holds image, for 0 <= image < num_images()."""
+		folder = 0
+		step = 1
+		while step * 2 < len(self.tree):
+			step *= 2
+		while step > 0:
+			if folder + step < len(self.tree) and self.tree[folder + step] <= image:
+				folder += step
+				image -= self.tree[folder]
+			step //= 2
+		return folder
+
+	def insert(self, image, dirname):
+		"""Adds an image in dirname at position image of the list."""
+		if not self.dirs:
+			self.append_folder(dirname, 1)
+			return
+		prev_folder = -1
+		if image > 0:
+			prev_folder = self.folder_of(image-1)
+			if self.dirs[prev_folder] == dirname:
+				self.add_to_count(prev_folder, 1)
+				return
+		next_folder = len(self.dirs)
+		if image < self.num_images():
+			next_folder = self.folder_of(image)
+		if next_folder == prev_folder:
+			# Within the images of another folder, which is split in two
+			left = image - self.first_image(prev_folder)
+			self.dirs[prev_folder:prev_folder+1] = [self.dirs[prev_folder], dirname, self.dirs[prev_folder]]
+			self.counts[prev_folder:prev_folder+1] = [left, 1, self.counts[prev_folder] - left]
+			self.rebuild()
+		elif next_folder < len(self.dirs) and self.dirs[next_folder] == dirname:
+			self.add_to_count(next_folder, 1)
+		elif next_folder == len(self.dirs):
+			self.append_folder(dirname, 1)
+		else:
+			self.dirs.insert(next_folder, dirname)
+			self.counts.insert(next_folder, 1)
+			self.rebuild()
+
+	def remove(self, image):
+		"""Removes the image at position image of the list."""
+		folder = self.folder_of(image)
+		if self.counts[folder] > 1:
+			self.add_to_count(folder, -1)
+			return
+		del self.dirs[folder]
+		del self.counts[folder]
+		if folder == len(self.dirs):
+			# The last folder; the rest of the tree is unaffected
+			self.tree.pop()
+			return
+		if folder > 0 and self.dirs[folder-1] == self.dirs[folder]:
+			# The images before and after it are in the same folder again
+			self.counts[folder-1] += self.counts[folder]
+			del self.dirs[folder]
+			del self.counts[folder]
+		self.rebuild()
+
+class DirScanner:
+	"""Walks one or more directory trees in background threads.
+
+	Directories are read through scandir() when it is available, so files
+	and folders can be told apart without a stat() per entry, and the walk
+	is iterative so that deep trees cannot exhaust the stack.
+	filter_images(files) picks the images among the files of a directory;
+	these are sorted and handed back to the GTK main loop in chunks
+	through gobject.idle_add(), where on_batch(scanner, dirname, images) is
+	called. on_done(scanner) is called from the main loop when the walk has
+	finished or has been cancelled. If a ScanCache is given, directories
+	that have not changed since they were last scanned are not read again.
+	With more than one worker, several roots are walked at the same time;
+	their batches are still passed to on_batch in the order of the roots.
+	If a DirWatcher is given, each directory is added to it before it is
+	read, so that no change made during the scan is missed."""
+
+	def __init__(self, roots, recursive, include_hidden, filter_images, sort_list, on_batch, on_done=None, should_stop=None, verbose=False, cache=None, workers=1, watcher=None, chunk_size=500):
+		self.roots = roots
+		self.recursive = recursive
+		self.include_hidden = include_hidden
+		self.filter_images = filter_images
+		self.sort_list = sort_list
+		self.on_batch = on_batch
+		self.on_done = on_done
+		self.should_stop = should_stop
+		self.verbose = verbose
+		self.cache = cache
+		self.workers = workers
+		self.watcher = watcher
+		self.chunk_size = chunk_size
+		self.cancelled = False
+		self.finished = False
+		# Guards self.visited when several roots are walked at once
+		self.lock = threading.Lock()
+		self.visited = set()
+		# Index of the root whose batches are passed on as they arrive, the
+		# roots that are done, and the batches held back for later roots;
+		# only used from the main loop
+		self.next_root = 0
+		self.roots_done = set()
+		self.held_batches = {}
+
+	def start(self):
+		thread = threading.Thread(target=self.run)
+		thread.setDaemon(True)
+		thread.start()
+
+	def cancel(self):
+		self.cancelled = True
+
+	def is_cancelled(self):
+		if not self.cancelled and self.should_stop and self.should_stop():
+			self.cancelled = True
+		return self.cancelled
+
+	def list_directory(self, path):
+		# Returns a tuple (files, dirs) with the names of the entries in path
+		files = []
+		dirs = []
+		if HAS_SCANDIR:
+			for entry in scandir(path):
+				try:
+					if entry.is_dir():
+						dirs.append(entry.name)
+					elif entry.is_file():
+						files.append(entry.name)
+				except OSError:
+					pass
+		else:
+			for name in os.listdir(path):
+				fullpath = os.path.join(path, name)
+				if os.path.isdir(fullpath):
+					dirs.append(name)
+				elif os.path.isfile(fullpath):
+					files.append(name)
+		return files, dirs
+
+	def scan_directory(self, path, mtime):
+		# Returns a tuple (images, dirs) with the names of the images and
+		# subfolders in path, or None if the scan was cancelled.
+		if self.cache:
+			cached = self.cache.lookup(path, mtime)
+			if cached:
+				return cached
+		files, dirs = self.list_directory(path)
+		images = []
+		for i in range(0, len(files), 200):
+			if self.is_cancelled():
+				return None
+			fullpaths = [os.path.join(path, name) for name in files[i:i+200]]
+			images.extend([os.path.basename(fullpath) for fullpath in self.filter_images(fullpaths)])
+		if self.cache:
+			self.cache.store(path, mtime, images, dirs, files)
+		return images, dirs
+
+	def skip_hidden(self, path, names):
+		if self.include_hidden:
+			return names
+		visible = []
+		for name in names:
+			if name[0] != '.':
+				visible.append(name)
+			elif self.verbose:
+				print _("Skipping: %s") % os.path.join(path, name)
+		return visible
+
+	def run(self):
+		if self.workers > 1 and len(self.roots) > 1:
+			# Walk several roots at the same time; they may well be on
+			# different disks or mounts. Each worker takes the next root
+			# that nobody has started on yet.
+			queue = list(reversed(list(enumerate(self.roots))))
+			running = [min(self.workers, len(self.roots))]
+			def work():
+				while not self.is_cancelled():
+					self.lock.acquire()
+					try:
+						if not queue:
+							break
+						index, root = queue.pop()
+					finally:
+						self.lock.release()
+					self.walk(index, root)
+				self.lock.acquire()
+				try:
+					running[0] -= 1
+					last = running[0] == 0
+				finally:
+					self.lock.release()
+				if last:
+					gobject.idle_add(self.deliver_done)
+			for i in range(running[0]):
+				thread = threading.Thread(target=work)
+				thread.setDaemon(True)
+				thread.start()
+		else:
+			for index, root in enumerate(self.roots):
+				if self.is_cancelled():
+					break
+				self.walk(index, root)
+			gobject.idle_add(self.deliver_done)
+
+	def walk(self, index, root):
+		# Pending directories, the next one to scan last:
+		stack = [root]
+		while stack and not self.is_cancelled():
+			path = stack.pop()
+			try:
+				st = os.stat(path)
+				self.lock.acquire()
+				try:
+					if (st.st_dev, st.st_ino) in self.visited:
+						# Symlink loop, or a folder that was passed twice
+						continue
+					self.visited.add((st.st_dev, st.st_ino))
+				finally:
+					self.lock.release()
+				if not os.access(path, os.R_OK):
+					continue
+				if self.watcher:
+					self.watcher.add(path)
+				result = self.scan_directory(path, st.st_mtime)
+			except OSError, e:
+				if self.cache and e.errno == errno.ENOENT:
+					self.cache.forget(path)
+				continue
+			if result == None:
+				break
+			images = [os.path.join(path, name) for name in self.skip_hidden(path, result[0])]
+			if images:
+				self.sort_list(images)
+				for i in range(0, len(images), self.chunk_size):
+					gobject.idle_add(self.deliver_batch, index, path, images[i:i+self.chunk_size])
+			if self.recursive:
+				dirs = [os.path.join(path, name) for name in self.skip_hidden(path, result[1])]
+				self.sort_list(dirs)
+				dirs.reverse()
+				stack.extend(dirs)
+		gobject.idle_add(self.deliver_root_done, index)
+
+	def deliver_batch(self, index, path, images):
+		# Batches are passed on in the order of the roots, the ones of later
+		# roots are held back until the earlier roots are done
+		if index != self.next_root:
+			self.held_batches.setdefault(index, []).append((path, images))
+		elif not self.is_cancelled():
+			self.on_batch(self, path, images)
+		return False
+
+	def deliver_root_done(self, index):
+		self.roots_done.add(index)
+		while self.next_root in self.roots_done:
+			self.next_root += 1
+			for path, images in self.held_batches.pop(self.next_root, []):
+				if not self.is_cancelled():
+					self.on_batch(self, path, images)
+		return False
+
+	def deliver_done(self):
+		self.finished = True
+		if self.on_done:
+			self.on_done(self)
+		return False
+
+class FileListReader:
+	"""Reads a list of files and folders in a background thread, so that
+	the interface does not wait for a list that is still being written
+	(see read_file_list()). classify(entries) is called from the thread and
+	yields (path, is_dir) for the entries; these are handed back to the GTK
+	main loop, where on_batch(reader, items) is called with the first item
+	at once and then with those classified during each BATCH_DELAY seconds.
+	on_done(reader) is called from the main loop when the list has been
+	read or the reader has been cancelled."""
+
+	BATCH_DELAY = 0.1
+
+	def __init__(self, entries, classify, on_batch, on_done=None, should_stop=None):
+		self.entries = entries
+		self.classify = classify
+		self.on_batch = on_batch
+		self.on_done = on_done
+		self.should_stop = should_stop
+		self.cancelled = False
+		self.finished = False
+		self.lock = threading.Lock()
+		self.pending = []
+		self.scheduled = False
+		self.delivered = False
+
+	def start(self):
+		thread = threading.Thread(target=self.run)
+		thread.setDaemon(True)
+		thread.start()
+
+	def cancel(self):
+		self.cancelled = True
+
+	def is_cancelled(self):
+		if not self.cancelled and self.should_stop and self.should_stop():
+			self.cancelled = True
+		return self.cancelled
+
+	def run(self):
+		try:
+			for item in self.classify(self.entries):
+				if self.is_cancelled():
+					break
+				self.lock.acquire()
+				try:
+					self.pending.append(item)
+					if not self.scheduled:
+						self.scheduled = True
+						if self.delivered:
+							gobject.timeout_add(int(self.BATCH_DELAY * 1000), self.deliver)
+						else:
+							gobject.idle_add(self.deliver)
+				finally:
+					self.lock.release()
+		except Exception as e:
+			print (e)
+		gobject.idle_add(self.deliver_done)
+
+	def deliver(self):
+		self.lock.acquire()
+		try:
+			items = self.pending
+			self.pending = []
+			self.scheduled = False
+			self.delivered = True
+		finally:
+			self.lock.release()
+		if items and not self.is_cancelled():
+			self.on_batch(self, items)
+		return False
+
+	def deliver_done(self):
+		# Batches that are still waiting for their timeout go first
+		self.deliver()
+		self.finished = True
+		if self.on_done:
+			self.on_done(self)
+		return False
+
+class DirWatcher:
+	"""Watches directories for images being added, removed and renamed,
+	through inotify. Events are read from the GTK main loop, where
+	on_event(kind, path, new_path=None) is called for each of them. kind is
+	'added', 'removed', 'renamed' (from path to new_path), 'dir_added' or
+	'dir_removed'. Files are reported as added once they have been
+	written and closed."""
+
+	IN_CLOSE_WRITE = 0x00000008
+	IN_MOVED_FROM = 0x00000040
+	IN_MOVED_TO = 0x00000080
+	IN_CREATE = 0x00000100
+	IN_DELETE = 0x00000200
+	IN_Q_OVERFLOW = 0x00004000
+	IN_IGNORED = 0x00008000
+	IN_ISDIR = 0x40000000
+	IN_NONBLOCK = 0x00000800
+	IN_CLOEXEC = 0x00080000
+	WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+	# struct inotify_event: int wd; uint32_t mask, cookie, len; char name[]
+	EVENT_HEADER = struct.Struct('iIII')
+
+	def __init__(self, on_event):
+		self.on_event = on_event
+		self.fd = inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+		if self.fd < 0:
+			error = ctypes.get_errno()
+			raise OSError(error, os.strerror(error))
+		# watch descriptor -> directory; add() is called from scanner threads
+		self.dirs = {}
+		self.lock = threading.Lock()
+		self.source = gobject.io_add_watch(self.fd, gobject.IO_IN, self.read_events)
+
+	def add(self, path):
+		if isinstance(path, unicode):
+			path = path.encode('utf-8')
+		wd = inotify_add_watch(self.fd, path, self.WATCH_MASK)
+		if wd >= 0:
+			self.lock.acquire()
+			try:
+				self.dirs[wd] = path
+			finally:
+				self.lock.release()
+
+	def close(self):
+		if self.fd >= 0:
+			gobject.source_remove(self.source)
+			os.close(self.fd)
+			self.fd = -1
+
+	def read_events(self, fd, condition):
+		data = ''
+		while True:
+			try:
+				chunk = os.read(self.fd, 65536)
+			except OSError as e:
+				if e.errno == errno.EINTR:
+					continue
+				if e.errno != errno.EAGAIN:
+					print _("Unable to read folder changes: %s") % e
+				break
+			if not chunk:
+				break
+			data += chunk
+		events = []
+		# MOVED_FROM events waiting for the MOVED_TO with the same cookie:
+		moved_from = {}
+		offset = 0
+		while offset + self.EVENT_HEADER.size <= len(data):
+			wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+			offset += self.EVENT_HEADER.size
+			name = data[offset:offset+length].rstrip('\0')
+			offset += length
+			if mask & self.IN_Q_OVERFLOW:
+				print _("Too many changes in the watched folders, some were missed")
+				continue
+			self.lock.acquire()
+			try:
+				if mask & self.IN_IGNORED:
+					# The directory has been removed
+					self.dirs.pop(wd, None)
+					continue
+				dirname = self.dirs.get(wd)
+			finally:
+				self.lock.release()
+			if dirname == None:
+				continue
+			path = os.path.join(dirname, name).decode('utf-8', 'replace')
+			if mask & self.IN_ISDIR:
+				if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+					events.append(['dir_added', path])
+				elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+					events.append(['dir_removed', path])
+			elif mask & self.IN_MOVED_FROM:
+				event = ['removed', path]
+				moved_from[cookie] = event
+				events.append(event)
+			elif mask & self.IN_MOVED_TO:
+				if cookie in moved_from:
+					# A rename within the watched folders
+					event = moved_from.pop(cookie)
+					event[0] = 'renamed'
+					event.append(path)
+				else:
+					events.append(['added', path])
+			elif mask & self.IN_CLOSE_WRITE:
+				events.append(['added', path])
+			elif mask & self.IN_DELETE:
+				events.append(['removed', path])
+		for event in events:
+			self.on_event(*event)
+		return self.fd >= 0
+
+class ScanCache:
+	"""Remembers the images and subfolders found in each scanned directory
+	together with the mtime of the directory, so that a directory only has
+	to be listed again once its mtime has changed. Files that had to be
+	looked into to tell whether they are images (checked_by_content(path)
+	returns True for them) can change without the mtime of the directory
+	changing, so their own mtime and size are kept too. The cache is stored
+	as json, and directories that are found to be gone while scanning are
+	dropped from it. It is only valid for the image detection mode it was
+	built with."""
+
+	version = 2
+
+	def __init__(self, filename, fast_image_detection, checked_by_content=None):
+		self.filename = filename
+		self.fast_image_detection = fast_image_detection
+		self.checked_by_content = checked_by_content
+		# path -> [mtime, image names, subfolder names, {file name: [mtime,
+		# size]} of the files checked by content], loaded on first use
+		self.dirs = None
+		self.dirty = False
+		self.lock = threading.Lock()
+
+	def load(self):
+		# Must be called with self.lock held
+		self.dirs = {}
+		if not os.path.isfile(self.filename):
+			return
+		try:
+			cf = open(self.filename)
+			data = json.load(cf)
+			cf.close()
+			if data['version'] == self.version and data['fast_image_detection'] == self.fast_image_detection:
+				self.dirs = data['dirs']
+		except:
+			print _("Ignoring invalid scan cache %s") % self.filename
+
+	def lookup(self, path, mtime):
+		"""Returns a tuple (images, dirs) with the names cached for path, or
+		None if path is not cached or has been modified since."""
+		self.lock.acquire()
+		try:
+			if self.dirs == None:
+				self.load()
+			entry = self.dirs.get(path)
+		finally:
+			self.lock.release()
+		if not entry or entry[0] != mtime:
+			return None
+		for name, stats in entry[3].iteritems():
+			try:
+				st = os.stat(os.path.join(path, name))
+			except OSError:
+				return None
+			if [st.st_mtime, st.st_size] != stats:
+				return None
+		return entry[1], entry[2]
+
+	def store(self, path, mtime, images, dirs, files=()):
+		"""Remembers the images and subfolders found in path, out of the
+		file names in files."""
+		# A directory or file that was modified within the last few seconds
+		# may still change without its mtime changing (coarse timestamps), so
+		# it is not trusted yet:
+		now = time.time()
+		if now - mtime < 2:
+			return
+		checked = {}
+		if self.checked_by_content:
+			for name in files:
+				fullpath = os.path.join(path, name)
+				if self.checked_by_content(fullpath):
+					try:
+						st = os.stat(fullpath)
+					except OSError:
+						return
+					if now - st.st_mtime < 2:
+						return
+					checked[name] = [st.st_mtime, st.st_size]
+		entry = [mtime, images, dirs, checked]
+		self.lock.acquire()
+		try:
+			if self.dirs == None:
+				self.load()
+			old = self.dirs.get(path)
+			if old != entry:
+				if old:
+					# Forget the subfolders that have been removed since
+					for name in set(old[2]) - set(dirs):
+						self.drop(os.path.join(path, name))
+				self.dirs[path] = entry
+				self.dirty = True
+		finally:
+			self.lock.release()
+
+	def forget(self, path):
+		"""Drops path and the folders cached below it, e.g. because path
+		no longer exists."""
+		self.lock.acquire()
+		try:
+			if self.dirs == None:
+				self.load()
+			self.drop(path)
+		finally:
+			self.lock.release()
+
+	def drop(self, path):
+		# Drops path and its cached subfolders. Must be called with
+		# self.lock held
+		stack = [path]
+		while stack:
+			path = stack.pop()
+			entry = self.dirs.pop(path, None)
+			if entry:
+				self.dirty = True
+				stack.extend([os.path.join(path, name) for name in entry[2]])
+
+	def save(self):
+		"""Writes the cache to its file if it has changed."""
+		self.lock.acquire()
+		try:
+			if not self.dirty:
+				return
+			data = {'version': self.version, 'fast_image_detection': self.fast_image_detection, 'dirs': self.dirs}
+			try:
+				dirname = os.path.dirname(self.filename)
+				if not os.path.exists(dirname):
+					os.makedirs(dirname)
+				# Write to a temporary file first so that a crash can't leave a
+				# truncated cache behind:
+				fd, tmpname = tempfile.mkstemp(dir=dirname)
+				cf = os.fdopen(fd, 'w')
+				json.dump(data, cf)
+				cf.close()
+				os.rename(tmpname, self.filename)
+				self.dirty = False
+			except:
+				print _("Unable to save scan cache %s") % self.filename
+		finally:
+			self.lock.release()
 
 if __name__ == "__main__":
 	base = Base()
@@ -11,6 +11,9 @@
 /* 2010/06/24 Fredric Johansson
  * Introduced a case insensitive version of the compare function
 */
+/* Added numakey/numakeyi, which turn a string into a key that sorts like
+ * numacomp/numacompi, so lists can be sorted with key= instead of cmp=
+*/
 /*-------------------------------------- */
 static char numacomp_docs[] = 
 "numacomp(s1,s2): compare two strings with case sensitive numerically aware comparison\n"
@@ -20,6 +23,12 @@ static char numacompi_docs[] =
 "numacompi(s1,s2): compare two strings with case insensitive numerically aware comparison\n"
 "    e.g. \"A1\" < \"A3\" < \"a3x\" < \"A10\" < \"a30x\" < \"B1\"\n"
 ;
+static char numakey_docs[] = 
+"numakey(s): return a key for s that sorts like numacomp, for use with sort(key=...)\n"
+;
+static char numakeyi_docs[] = 
+"numakeyi(s): return a key for s that sorts like numacompi, for use with sort(key=...)\n"
+;
 /*
  * things to do:
  *    - support unicode
@@ -208,9 +217,102 @@ C_numacomp_i(PyObject* self, PyObject* args)
 	return PyInt_FromLong(k);
 }
 
+/*
+ * build a sort key for a string, so that comparing the keys of two
+ * strings gives the same result as numacomp() on the strings. The key
+ * is a string, so that python can compare two keys with a memcmp().
+ * It holds the text up to the first digit, terminated by '\0', and for
+ * each run of digits that follows:
+ *    - the number of significant digits (4 bytes, big endian)
+ *    - the significant digits
+ *    - the number of leading zeroes (4 bytes, big endian)
+ *    - the text up to the next digit, terminated by '\0'
+ * A text that is followed by digits ends in '0', standing for the digit,
+ * since numacomp compares that digit with the character at the same
+ * position in the other string.
+ */
+static void
+put_count( char *key, int *n, int count)
+{
+	key[(*n)++] = (count >> 24) & 0xff;
+	key[(*n)++] = (count >> 16) & 0xff;
+	key[(*n)++] = (count >> 8) & 0xff;
+	key[(*n)++] = count & 0xff;
+}
+
+static PyObject*
+numakey( unsigned char const *s,		/* string */
+		 int len,			/* len of string */
+		 int case_sensitive)
+{
+	PyObject *result;
+	char *key;
+	int i, n, start, zeroes;
+
+	/* each run of digits adds at most 10 bytes on top of its digits */
+	key = PyMem_Malloc(11*len+1);
+	if (key == NULL)
+		return PyErr_NoMemory();
+	i = 0;
+	n = 0;
+	for (;;) {
+		/* text up to the next digit */
+		while( i < len && !ISDIGIT(s[i])) {
+			key[n++] = case_sensitive? s[i]: tolower(s[i]);
+			++i;
+		}
+		if( i < len )
+			key[n++] = '0';
+		key[n++] = '\0';
+		if( i == len )
+			break;
+		/* run of digits */
+		zeroes = 0;
+		while( i < len && s[i] == '0'){
+			++zeroes;
+			++i;
+		}
+		start = i;
+		while( i < len && ISDIGIT(s[i])){
+			++i;
+		}
+		put_count(key, &n, i-start);
+		memcpy(key+n, s+start, i-start);
+		n += i-start;
+		put_count(key, &n, zeroes);
+	}
+	result = PyString_FromStringAndSize(key, n);
+	PyMem_Free(key);
+	return result;
+}
+
+static PyObject*
+C_numakey(PyObject* self, PyObject* args)
+{
+	unsigned char *s;
+	int len;
+
+	if (!PyArg_ParseTuple(args,"s#:numakey",&s, &len)) 
+		return NULL;
+	return numakey( s, len, 1 ); /* case sensitive version */
+}
+
+static PyObject*
+C_numakey_i(PyObject* self, PyObject* args)
+{
+	unsigned char *s;
+	int len;
+
+	if (!PyArg_ParseTuple(args,"s#:numakeyi",&s, &len)) 
+		return NULL;
+	return numakey( s, len, 0 ); /* case insensitive version */
+}
+
 static PyMethodDef numacomp_methods[] = {
 	{"numacomp", C_numacomp, METH_VARARGS, numacomp_docs },
 	{"numacompi", C_numacomp_i, METH_VARARGS, numacompi_docs },
+	{"numakey", C_numakey, METH_VARARGS, numakey_docs },
+	{"numakeyi", C_numakey_i, METH_VARARGS, numakeyi_docs },
 	{NULL, NULL, 0, NULL}
 };
 
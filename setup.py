@@ -3,10 +3,29 @@
 # $HeadURL$
 # $Id$
 
-import os
+import os, sys, subprocess
 
 from distutils.core import setup, Extension
 
+def pkgconfig(*packages):
+	# Returns the Extension arguments to build against the pkg-config packages
+	args = {}
+	for option, flags, other in (('--cflags', {'-I': 'include_dirs'}, 'extra_compile_args'),
+			('--libs', {'-L': 'library_dirs', '-l': 'libraries'}, 'extra_link_args')):
+		try:
+			proc = subprocess.Popen(['pkg-config', option] + list(packages), stdout=subprocess.PIPE)
+		except OSError:
+			sys.exit("error: pkg-config is required to build Mirage")
+		output = proc.communicate()[0]
+		if proc.returncode != 0:
+			sys.exit("error: the development files of %s are required to build Mirage (e.g. the pygtk and pygobject development packages)" % ", ".join(packages))
+		for token in output.split():
+			if token[:2] in flags:
+				args.setdefault(flags[token[:2]], []).append(token[2:])
+			else:
+				args.setdefault(other, []).append(token)
+	return args
+
 # Create mo files:
 if not os.path.exists("mo/"):
 	os.mkdir("mo/")
@@ -35,7 +54,7 @@ setup(name='Mirage',
 			'Topic :: Multimedia :: Graphics :: Viewers'
 			],
 		py_modules = ['mirage'],
-		ext_modules = [Extension(name='imgfuncs', sources=['imgfuncs.c']), 
+		ext_modules = [Extension(name='imgfuncs', sources=['imgfuncs.c'], **pkgconfig('pygobject-2.0', 'gdk-pixbuf-2.0')), 
 		               Extension(name='xmouse', sources=['xmouse.c'], libraries=['X11']),
 					   Extension(name='mirage_numacomp', sources=['mirage_numacomp.c'])],
 		scripts = ['mirage'],